@@ -1,21 +1,206 @@
-from flask import Flask, jsonify, request, abort
-from storage import list_all, list_by_category, find_by_name_exact, get_metadata, create_media, delete_media, borrow_media, return_media, get_borrowed_items
+import gzip
+import json
+import time
+from flask import Flask, Response, g, jsonify, request, abort, stream_with_context
+import config
+import metrics
+from serialize import encode
+from storage import SORTS, item_cache, catalog_state, changes_since, stream_changes, iter_items, import_many, list_all, list_by_category, category_counts, list_page, list_sorted, search_media, find_by_name_exact, get_by_id, get_metadata, create_media, update_media, delete_media, borrow_media, return_media, get_borrowed_items, overdue_loans, borrower_loans, create_many, delete_many, borrow_many, return_many
 
 app = Flask(__name__)
 
+DEFAULT_PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+MAX_BULK_ITEMS = 50000
+IMPORT_BATCH = 1000  # lines applied per storage batch during an import
+MAX_IMPORT_ERRORS = 100  # error details kept in an import response
+REQUIRED_KEYS = {"name","publication_date","author","category"}
+READONLY_KEYS = {"id","available","borrowed_by","borrow_date"}  # not changed by PATCH
+# names /media/<name> can't reach: routes of their own (/media/changes, /media/bulk/borrow, ...) match first
+RESERVED_NAMES = {"bulk", "category", "changes", "export", "search", "stream"}
+RESERVED_ERROR = f"Reserved name; not one of {sorted(RESERVED_NAMES)}"
+
+def _reserved(name):
+    return isinstance(name, str) and name in RESERVED_NAMES
+
+def _project(items, fields):
+    if not fields:
+        return items
+    return [{k: m[k] for k in fields if k in m} for m in items]
+
+def _limit_arg(default):
+    try:
+        limit = int(request.args.get("limit", default))
+    except ValueError:
+        abort(400, "'limit' must be an integer")
+    if not 1 <= limit <= MAX_PAGE_SIZE:
+        abort(400, f"'limit' must be between 1 and {MAX_PAGE_SIZE}")
+    return limit
+
+def _conditional(build):
+    """Run ``build`` unless the client's copy is still current.
+
+    Responses carry a weak ETag naming the catalog version (and
+    Last-Modified); a request whose If-None-Match (or, without one,
+    If-Modified-Since) still matches gets an empty 304 without the catalog
+    being read. The tag is taken before the body is built, so a write in
+    between makes the tag older than the body, never newer.
+
+    Last-Modified has whole seconds, so it is only sent once the second of
+    the last write is over: a client holding it then has every write of
+    that second, and another write in it can't hide behind the same date.
+    """
+    etag, modified = catalog_state()
+    settled = int(modified) < int(time.time())
+    if request.if_none_match:
+        fresh = request.if_none_match.contains_weak(etag)
+    else:
+        since = request.if_modified_since
+        fresh = since is not None and int(modified) <= since.timestamp()
+    if fresh:
+        resp = Response(status=304)
+    else:
+        resp = app.make_response(build())
+        if resp.status_code != 200:
+            return resp
+    resp.set_etag(etag, weak=True)
+    if settled:
+        resp.last_modified = int(modified)
+    return resp
+
+def _json_bytes(body):
+    return Response(body, mimetype="application/json")
+
+def _list_response(full_list, **filters):
+    """Listing response shared by /media, category and borrowed routes.
+
+    Without ``limit``/``cursor``/``offset`` this is the plain JSON array the
+    API has always returned. With them it is one page in name order:
+    ``{"items": [...], "total": n, "next_cursor": "..." | null}``.
+    ``offset=n`` skips n items, for jumping straight to a row.
+    ``fields=name,author`` keeps only those keys of each item.
+    ``sort=publication_date`` (or ``author``, ``name``; ``-`` first for
+    descending) orders the items, and ``published_from``/``published_to``
+    keep those published in that range, bounds included; either works
+    with or without paging.
+
+    Whole items are not serialized per request but joined from their cached
+    encodings (see serialize.py).
+    """
+    fields = [f for f in request.args.get("fields", "").split(",") if f]
+    cache = item_cache() if config.RESPONSE_CACHE and not fields else None
+    generation = cache.generation if cache is not None else 0  # before reading, see EncodedItems
+    order = {k: request.args[k] for k in ("sort", "published_from", "published_to") if k in request.args}
+    sort = order.get("sort", "name")
+    if sort.removeprefix("-") not in SORTS:
+        abort(400, f"'sort' must be one of {', '.join(SORTS)}, optionally with a leading '-'")
+    if not {"limit", "cursor", "offset"} & request.args.keys():
+        if order:
+            full_list = lambda: list_sorted(**filters, **order)
+        if cache is not None:
+            return _json_bytes(b"[" + cache.join(full_list(), generation) + b"]")
+        return jsonify(_project(full_list(), fields))
+    limit = _limit_arg(DEFAULT_PAGE_SIZE)
+    offset = request.args.get("offset", "0")
+    if not offset.isdigit():
+        abort(400, "'offset' must be a non-negative integer")
+    try:
+        page = list_page(limit, request.args.get("cursor"), offset=int(offset), **filters, **order)
+    except ValueError:
+        abort(400, "Invalid 'cursor'")
+    if cache is not None:
+        items = cache.join(page.pop("items"), generation)
+        return _json_bytes(b'{"items":[' + items + b"]," + encode(page)[1:])  # keys in jsonify's order
+    page["items"] = _project(page["items"], fields)
+    return jsonify(page)
+
+def _route():
+    return request.url_rule.rule if request.url_rule else "unmatched"  # not the raw path: one series per route
+
+@app.before_request
+def _start_request():
+    g.started = time.perf_counter()
+    g.profile = metrics.start_profile()
+
+# registered before _compress, so it runs after it and counts its time
+@app.after_request
+def _record_request(resp):
+    started = g.get("started")
+    if started is not None:
+        metrics.record_request(request.method, _route(), resp.status_code, time.perf_counter() - started)
+    profile = g.pop("profile", None)
+    if profile is not None:
+        metrics.stop_profile(profile, f"{request.method} {_route()}")
+    return resp
+
+@app.teardown_request
+def _stop_profile(exc):
+    profile = g.pop("profile", None)  # only left if _record_request didn't run
+    if profile is not None:
+        metrics.stop_profile(profile, f"{request.method} {_route()}")
+
+@app.route("/metrics", methods=["GET"])
+def api_metrics():
+    """Request and storage metrics in the Prometheus text format."""
+    return Response(metrics.REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+@app.after_request
+def _compress(resp):
+    """gzip bodies of at least COMPRESS_MIN_BYTES for clients that accept it."""
+    if resp.status_code != 200 or resp.is_streamed or resp.direct_passthrough or "Content-Encoding" in resp.headers:
+        return resp  # streams (SSE, export) go out as they are produced
+    data = resp.get_data()
+    if len(data) < config.COMPRESS_MIN_BYTES:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    if request.accept_encodings.quality("gzip") > 0:
+        resp.set_data(gzip.compress(data, compresslevel=config.COMPRESS_LEVEL, mtime=0))
+        resp.headers["Content-Encoding"] = "gzip"
+    return resp
+
 @app.route("/media", methods=["GET"])
 def api_list_all():
-    return jsonify(list_all())
+    return _conditional(lambda: _list_response(list_all))
+
+@app.route("/media/changes", methods=["GET"])
+def api_changes():
+    """Delta since ``?since=<version>`` (an ETag value from any listing):
+    ``{"version", "upserts", "deletes"}``, or ``{"version", "resync": true}``
+    when the client is too far behind and should reload."""
+    since = request.args.get("since", "")
+    try:
+        return jsonify(changes_since(since.removeprefix("W/").strip('"')))
+    except ValueError:
+        abort(400, "Invalid 'since'")
+
+@app.route("/media/stream", methods=["GET"])
+def api_stream():
+    """Live changes as server-sent events (see ``storage.stream_changes``).
+    A reconnecting EventSource resumes from its Last-Event-ID."""
+    since = request.headers.get("Last-Event-ID") or request.args.get("since")
+    if since:
+        since = since.removeprefix("W/").strip('"')
+    return Response(stream_with_context(stream_changes(since)), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+@app.route("/media/category", methods=["GET"])
+def api_category_counts():
+    return _conditional(lambda: jsonify(category_counts()))
 
 @app.route("/media/category/<category>", methods=["GET"])
 def api_list_category(category):
-    return jsonify(list_by_category(category))
+    return _conditional(lambda: _list_response(lambda: list_by_category(category), category=category))
 
 @app.route("/media/search", methods=["GET"])
 def api_search_name():
+    """``?name=`` looks up one exact title; ``?q=`` runs a ranked word-prefix
+    search over titles and authors and returns up to ``limit`` items."""
+    query = request.args.get("q")
+    if query is not None:
+        return jsonify(search_media(query, _limit_arg(10)))
     name = request.args.get("name")
     if not name:
-        abort(400, "Missing 'name' query parameter")
+        abort(400, "Missing 'name' or 'q' query parameter")
     res = find_by_name_exact(name)
     if not res:
         return jsonify({}), 404
@@ -23,23 +208,44 @@ def api_search_name():
 
 @app.route("/media/<name>", methods=["GET"])
 def api_get_metadata(name):
-    res = get_metadata(name)
-    if not res:
-        return jsonify({}), 404
-    return jsonify(res)
+    def build():
+        res = get_metadata(name)
+        if not res:
+            return jsonify({}), 404
+        return jsonify(res)
+    return _conditional(build)
+
+@app.route("/media/<name>", methods=["PATCH"])
+def api_update_media(name):
+    """Change some fields of an item; ``{"name": ...}`` renames it (its id stays)."""
+    changes = request.get_json(silent=True)
+    if not isinstance(changes, dict) or not changes:
+        abort(400, "Expected a JSON object with the fields to change")
+    if READONLY_KEYS & changes.keys():
+        abort(400, f"Read-only keys: {sorted(READONLY_KEYS & changes.keys())}")
+    if "name" in changes and (not isinstance(changes["name"], str) or not changes["name"]):
+        abort(400, "'name' must be a non-empty string")
+    if _reserved(changes.get("name")):
+        abort(400, RESERVED_ERROR)
+    if update_media(name, changes):
+        return jsonify(get_metadata(changes.get("name", name))), 200
+    if get_metadata(name) is None:
+        return jsonify({"error":"Not found"}), 404
+    return jsonify({"error":"An item with that name already exists"}), 409
 
 @app.route("/media", methods=["POST"])
 def api_create_media():
     if not request.is_json:
         abort(400, "Expected JSON body")
     media = request.get_json()
-    required = {"name","publication_date","author","category"}
-    if not required.issubset(media.keys()):
-        abort(400, f"Missing keys. Required: {required}")
+    if not REQUIRED_KEYS.issubset(media.keys()):
+        abort(400, f"Missing keys. Required: {REQUIRED_KEYS}")
+    if _reserved(media["name"]):
+        abort(400, RESERVED_ERROR)
     ok = create_media(media)
     if not ok:
         return jsonify({"error":"Item already exists or invalid name"}), 400
-    return jsonify({"status":"created"}), 201
+    return jsonify({"status":"created", "id":media["id"]}), 201
 
 @app.route("/media/<name>", methods=["DELETE"])
 def api_delete_media(name):
@@ -66,9 +272,191 @@ def api_return_media(name):
         return jsonify({"error":"Item not found or not borrowed"}), 404
     return jsonify({"status":"returned", "item":name}), 200
 
+def _by_id(item_id, view):
+    """Answer with the name-keyed ``view`` for the item numbered ``item_id``."""
+    item = get_by_id(item_id)
+    if item is None:
+        return jsonify({"error":"Not found"}), 404
+    return view(item["name"])
+
+@app.route("/media/id/<int:item_id>", methods=["GET"])
+def api_get_by_id(item_id):
+    def build():
+        res = get_by_id(item_id)
+        if not res:
+            return jsonify({}), 404
+        return jsonify(res)
+    return _conditional(build)
+
+@app.route("/media/id/<int:item_id>", methods=["PATCH"])
+def api_update_by_id(item_id):
+    return _by_id(item_id, api_update_media)
+
+@app.route("/media/id/<int:item_id>", methods=["DELETE"])
+def api_delete_by_id(item_id):
+    return _by_id(item_id, api_delete_media)
+
+@app.route("/media/id/<int:item_id>/borrow", methods=["POST"])
+def api_borrow_by_id(item_id):
+    return _by_id(item_id, api_borrow_media)
+
+@app.route("/media/id/<int:item_id>/return", methods=["POST"])
+def api_return_by_id(item_id):
+    return _by_id(item_id, api_return_media)
+
 @app.route("/media/borrowed/list", methods=["GET"])
 def api_get_borrowed():
-    return jsonify(get_borrowed_items())
+    return _conditional(lambda: _list_response(get_borrowed_items, borrowed=True))
+
+@app.route("/loans/overdue", methods=["GET"])
+def api_overdue_loans():
+    """Open loans past their due date, the longest overdue first (at most ``?limit=``).
+    Times in loans are seconds since the epoch."""
+    return jsonify(overdue_loans(_limit_arg(DEFAULT_PAGE_SIZE)))
+
+@app.route("/borrowers/<name>/loans", methods=["GET"])
+def api_borrower_loans(name):
+    """Everything ``name`` has borrowed, the latest first; ``?open=1`` for what is still out."""
+    return jsonify(borrower_loans(name, open_only=request.args.get("open") in ("1", "true")))
+
+def _bulk_body():
+    """Entries of a bulk request: a JSON array, or NDJSON with one entry per line."""
+    if request.mimetype in ("application/x-ndjson", "application/jsonl"):
+        try:
+            entries = [json.loads(line) for line in request.get_data(as_text=True).splitlines() if line.strip()]
+        except ValueError:
+            abort(400, "Invalid NDJSON body")
+    elif request.is_json:
+        entries = request.get_json()
+        if not isinstance(entries, list):
+            abort(400, "Expected a JSON array")
+    else:
+        abort(400, "Expected a JSON array or NDJSON body")
+    if len(entries) > MAX_BULK_ITEMS:
+        abort(413, f"At most {MAX_BULK_ITEMS} entries per request")
+    return entries
+
+def _bulk_response(entries, parse, apply, status, failure):
+    """Validate each entry with ``parse`` and run the valid ones through ``apply`` as one batch.
+
+    ``parse(entry)`` returns ``(name, arg)`` or an error message; ``apply``
+    takes the list of args and returns one success flag per arg.
+    """
+    results = [None] * len(entries)
+    slots, names, args = [], [], []
+    for i, entry in enumerate(entries):
+        parsed = parse(entry)
+        if isinstance(parsed, str):
+            results[i] = {"index": i, "status": "error", "error": parsed}
+        else:
+            slots.append(i)
+            names.append(parsed[0])
+            args.append(parsed[1])
+    for i, name, ok in zip(slots, names, apply(args) if args else []):
+        results[i] = {"index": i, "name": name, "status": status} if ok else \
+            {"index": i, "name": name, "status": "error", "error": failure}
+    succeeded = sum(1 for r in results if r["status"] == status)
+    return jsonify({"results": results, "succeeded": succeeded, "failed": len(results) - succeeded}), 200
+
+def _parse_new_item(entry):
+    if not isinstance(entry, dict) or not REQUIRED_KEYS.issubset(entry.keys()):
+        return f"Missing keys. Required: {REQUIRED_KEYS}"
+    if _reserved(entry["name"]):
+        return RESERVED_ERROR
+    return entry.get("name"), entry
+
+def _parse_name(entry):
+    name = entry.get("name") if isinstance(entry, dict) else entry
+    if not isinstance(name, str) or not name:
+        return "Expected an item name or {\"name\": ...}"
+    return name, name
+
+def _parse_loan(entry):
+    if not isinstance(entry, dict) or not isinstance(entry.get("name"), str) or not isinstance(entry.get("borrower"), str) \
+            or not entry["name"] or not entry["borrower"]:
+        return "Expected {\"name\": ..., \"borrower\": ...}"
+    return entry["name"], (entry["name"], entry["borrower"])
+
+@app.route("/media/bulk", methods=["POST"])
+def api_bulk_create():
+    return _bulk_response(_bulk_body(), _parse_new_item, create_many, "created", "Item already exists or invalid name")
+
+@app.route("/media/bulk/delete", methods=["POST"])
+def api_bulk_delete():
+    return _bulk_response(_bulk_body(), _parse_name, delete_many, "deleted", "Not found")
+
+@app.route("/media/bulk/borrow", methods=["POST"])
+def api_bulk_borrow():
+    return _bulk_response(_bulk_body(), _parse_loan, borrow_many, "borrowed", "Item not found or already borrowed")
+
+@app.route("/media/bulk/return", methods=["POST"])
+def api_bulk_return():
+    return _bulk_response(_bulk_body(), _parse_name, return_many, "returned", "Item not found or not borrowed")
+
+@app.route("/media/export", methods=["GET"])
+def api_export():
+    """Stream the catalog as NDJSON, one item per line, in name order.
+
+    Optional filters: ``category=<c>`` and ``available=true|false``.
+    """
+    if request.args.get("format", "ndjson") != "ndjson":
+        abort(400, "Only format=ndjson is supported")
+    available = request.args.get("available")
+    if available is not None:
+        if available.lower() not in ("true", "false"):
+            abort(400, "'available' must be true or false")
+        available = available.lower() == "true"
+    items = iter_items(category=request.args.get("category"), available=available)
+    lines = (json.dumps(m, ensure_ascii=False) + "\n" for m in items)
+    return Response(stream_with_context(lines), mimetype="application/x-ndjson",
+                    headers={"Content-Disposition": "attachment; filename=media-export.ndjson"})
+
+@app.route("/media/import", methods=["POST"])
+def api_import():
+    """Load an NDJSON export, reading the body line by line.
+
+    Items keep their borrow state. Names that already exist are skipped,
+    or overwritten with ``?replace=true``.
+    """
+    replace = request.args.get("replace", "false").lower() == "true"
+    imported, errors, failed = 0, [], 0
+    batch, batch_lines = [], []
+
+    def fail(line_no, error):
+        nonlocal failed
+        failed += 1
+        if len(errors) < MAX_IMPORT_ERRORS:
+            errors.append({"line": line_no, "error": error})
+
+    def flush():
+        nonlocal imported
+        for line_no, ok in zip(batch_lines, import_many(batch, replace=replace)):
+            if ok:
+                imported += 1
+            else:
+                fail(line_no, "Item already exists or invalid name")
+        batch.clear()
+        batch_lines.clear()
+
+    for line_no, line in enumerate(request.stream, 1):
+        if not line.strip():
+            continue
+        try:
+            media = json.loads(line)
+        except ValueError:
+            fail(line_no, "Invalid JSON")
+            continue
+        parsed = _parse_new_item(media)
+        if isinstance(parsed, str):
+            fail(line_no, parsed)
+            continue
+        batch.append(media)
+        batch_lines.append(line_no)
+        if len(batch) >= IMPORT_BATCH:
+            flush()
+    flush()
+    errors.sort(key=lambda e: e["line"])
+    return jsonify({"imported": imported, "failed": failed, "errors": errors}), 200
 
 if __name__ == "__main__":
     app.run(debug=True)
@@ -0,0 +1,30 @@
+"""Storage engines behind ``storage.py``; pick one with ``config.STORAGE_BACKEND``."""
+import os
+import shutil
+
+from .base import SORTS, CommitHook, Op, StorageBackend, published_range, sort_key
+from .json_backend import JsonBackend
+from .sqlite_backend import SqliteBackend
+
+BACKENDS = {"json": JsonBackend, "sqlite": SqliteBackend}
+
+
+def create_backend(kind: str, path: str, **options) -> StorageBackend:
+    try:
+        cls = BACKENDS[kind]
+    except KeyError:
+        raise ValueError(f"Unknown storage backend {kind!r}; expected one of {sorted(BACKENDS)}") from None
+    return cls(path, **options)
+
+
+def migrate(source: StorageBackend, target: StorageBackend) -> int:
+    """Copy every item from ``source`` into ``target``; returns the item count.
+
+    The loan ledger next to the source (``<path>.loans``, see ``loans.py``)
+    goes along: it refers to items by id, and the copy keeps their ids.
+    """
+    data = source.load_all()
+    target.replace_all(data)
+    if os.path.exists(source.path + ".loans"):
+        shutil.copyfile(source.path + ".loans", target.path + ".loans")
+    return len(data)
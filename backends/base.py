@@ -0,0 +1,199 @@
+import abc
+from typing import Callable, Dict, Any, List, NamedTuple, Optional, Tuple
+
+# listener(op, name, item, version): op is "put" (item added or changed),
+# "del", or "reset" (the whole catalog was replaced or reloaded; name and item
+# are None); version is the catalog version right after the change
+Listener = Callable[[str, Optional[str], Optional[Dict[str, Any]], int], None]
+
+# one mutation for StorageBackend.batch, e.g. ("borrow", name, borrower, date)
+Op = Tuple[Any, ...]
+
+# on_commit(changes) for StorageBackend.batch: one (before, after) pair per
+# applied op, the item as it was and as it is now (None if absent)
+CommitHook = Callable[[List[Tuple[Optional[Dict[str, Any]], Optional[Dict[str, Any]]]]], None]
+
+# fields a listing can be sorted by (see StorageBackend.page)
+SORTS = ("name", "publication_date", "author")
+# after every other character: prefix + TOP is above every string starting with prefix
+TOP = "\U0010ffff"
+
+
+def sort_key(value: Any) -> str:
+    """What listings sort an item's field by: a string as it is, anything else
+    (a missing date, say) as "", first."""
+    return value if isinstance(value, str) else ""
+
+
+def published_range(published_from: Optional[str], published_to: Optional[str]) -> Tuple[str, str]:
+    """``[lo, hi)`` of the publication date sort keys from ``published_from``
+    to ``published_to``, both included. A bound may be a prefix: "2010" as
+    the end takes in 2010-12-31. Items without a date are never in a range.
+    """
+    lo = published_from or "\0"  # above "", the key of a missing date
+    return lo, TOP if published_to is None else published_to + TOP
+
+
+def op_name(op: Op) -> str:
+    """The item name an op applies to."""
+    return op[1]["name"] if op[0] in ("create", "put") else op[1]
+
+
+def op_names(op: Op) -> List[str]:
+    """Every item name an op touches: a rename touches the new name too."""
+    if op[0] == "update" and "name" in op[2]:
+        return [op[1], op[2]["name"]]
+    return [op_name(op)]
+
+
+class CatalogVersion(NamedTuple):
+    """Where the catalog is in its history.
+
+    ``version`` goes up by one for every applied change and never goes back;
+    ``epoch`` names the store it counts in, so a recreated store that starts
+    counting again is not mistaken for the old one. ``modified`` is the time
+    of the last change (seconds since the epoch).
+    """
+    epoch: str
+    version: int
+    modified: float
+
+
+class StorageBackend(abc.ABC):
+    """Catalog engine used by the functions in ``storage.py``.
+
+    Items are plain dicts keyed by their ``name``. The storage layer fills in
+    the borrow fields before calling :meth:`create`, so engines only persist.
+
+    Every item also has an ``id``, a positive int the engine assigns when
+    the name is first stored and keeps across borrows, overwrites and
+    renames. Ids are never handed out twice, so a deleted item's id does
+    not come back as someone else's. An item written with an id that is
+    free keeps it (restoring a backup keeps its ids).
+    """
+
+    def __init__(self):
+        self._listeners: List[Listener] = []
+
+    def subscribe(self, listener: Listener) -> None:
+        """Call ``listener`` after every change, in the order changes are applied.
+
+        Listeners run while the engine holds its write lock, so they must be
+        quick and must not call back into the engine.
+        """
+        self._listeners.append(listener)
+
+    def _notify(self, op: str, name: Optional[str] = None, item: Optional[Dict[str, Any]] = None,
+                version: int = 0) -> None:
+        for listener in self._listeners:
+            listener(op, name, item, version)
+
+    def sync(self) -> None:
+        """Tell listeners about changes other processes made to the same store.
+
+        Engines do this on their own as they read; callers that answer from
+        listener-fed state alone (the search index, a live stream) call it
+        first.
+        """
+
+    @abc.abstractmethod
+    def version(self) -> CatalogVersion:
+        """The current :class:`CatalogVersion`; it changes with every write."""
+
+    @abc.abstractmethod
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        """Return the whole catalog as ``{name: item}``."""
+
+    @abc.abstractmethod
+    def replace_all(self, data: Dict[str, Dict[str, Any]],
+                    on_commit: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> None:
+        """Replace the whole catalog with ``data``.
+
+        ``on_commit``, if given, is called with the new items (ids filled
+        in) while the engine still holds its write lock, like the one of
+        :meth:`batch`.
+        """
+
+    @abc.abstractmethod
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def get_by_id(self, item_id: int) -> Optional[Dict[str, Any]]:
+        ...
+
+    @abc.abstractmethod
+    def list_all(self) -> List[Dict[str, Any]]:
+        """Every item, in name order (as are the other unpaged listings)."""
+
+    @abc.abstractmethod
+    def list_by_category(self, category: str) -> List[Dict[str, Any]]:
+        """Items whose category matches ``category`` case-insensitively, by name."""
+
+    @abc.abstractmethod
+    def list_borrowed(self) -> List[Dict[str, Any]]:
+        """Items that are out, by name."""
+
+    @abc.abstractmethod
+    def category_counts(self) -> Dict[Any, int]:
+        """Number of items per category; categories differing only in case are one."""
+
+    @abc.abstractmethod
+    def page(self, after: Optional[Any], limit: int, category: Optional[str] = None,
+             borrowed: bool = False, offset: int = 0, sort: str = "name", descending: bool = False,
+             published: Optional[Tuple[str, str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        """Up to ``limit`` items that come after ``after``, skipping the first
+        ``offset`` of them.
+
+        Items are in ``sort`` order (one of SORTS: by :func:`sort_key` of that
+        field, then by name), reversed if ``descending``. ``after`` is the
+        name of the last item of the previous page when sorting by name, and
+        its ``(sort key, name)`` otherwise.
+
+        ``category`` and ``borrowed`` filter like :meth:`list_by_category` and
+        :meth:`list_borrowed`; ``published``, a range from
+        :func:`published_range`, keeps the items published in it. Also
+        returns how many items match in total.
+        """
+
+    @abc.abstractmethod
+    def batch(self, ops: List[Op], on_commit: Optional[CommitHook] = None) -> List[bool]:
+        """Apply ``ops`` in order as one transaction; one success flag per op.
+
+        Each op is ``("create", media)``, ``("put", media)`` (create or
+        overwrite), ``("delete", name)``, ``("borrow", name, borrower,
+        borrow_date)``, ``("return", name)`` or ``("update", name, changes)``
+        (merge ``changes`` into the item; a new ``"name"`` renames it, and
+        fails if that name is taken).
+        An op that can't apply (create of an existing name, borrow of an
+        item that is out, ...) is skipped without failing the others, and
+        later ops see the effect of earlier ones in the same batch.
+
+        ``on_commit``, if given, is called with the applied changes while the
+        engine still holds its write lock: what it writes elsewhere (the loan
+        ledger) is ordered like the catalog's own writes, across processes
+        too. Like a listener it must be quick and must not call back into the
+        engine. It is not called if no op applies.
+        """
+
+    def create(self, media: Dict[str, Any]) -> bool:
+        """Insert ``media``; False if an item with that name exists."""
+        return self.batch([("create", media)])[0]
+
+    def delete(self, name: str) -> bool:
+        return self.batch([("delete", name)])[0]
+
+    def borrow(self, name: str, borrower: str, borrow_date: str) -> bool:
+        """Mark an available item as borrowed; False if missing or already out."""
+        return self.batch([("borrow", name, borrower, borrow_date)])[0]
+
+    def update(self, name: str, changes: Dict[str, Any]) -> bool:
+        """Merge ``changes`` into an item; False if missing or renamed onto a taken name."""
+        return self.batch([("update", name, changes)])[0]
+
+    def give_back(self, name: str) -> bool:
+        """Mark a borrowed item as available; False if missing or not borrowed."""
+        return self.batch([("return", name)])[0]
+
+    def close(self) -> None:
+        pass
@@ -0,0 +1,175 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+try:
+    import fcntl
+except ImportError:  # Windows: no cross-process lock, one process per store
+    fcntl = None
+
+log = logging.getLogger(__name__)
+
+
+class FileLock:
+    """A lock that holds off other threads and, through an ``flock`` on
+    ``path``, other processes using the same files."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+        self._fd: Optional[int] = None
+        self._pid = 0  # process that opened _fd; a forked child opens its own
+
+    def __enter__(self) -> "FileLock":
+        self._lock.acquire()
+        if fcntl is not None:
+            try:
+                if self._pid != os.getpid():
+                    # flock belongs to the open file, which a fork would share
+                    self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+                    self._pid = os.getpid()
+                fcntl.flock(self._fd, fcntl.LOCK_EX)
+            except BaseException:
+                self._lock.release()
+                raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        if fcntl is not None:
+            fcntl.flock(self._fd, fcntl.LOCK_UN)
+        self._lock.release()
+
+    def close(self) -> None:
+        if self._fd is not None and self._pid == os.getpid():
+            os.close(self._fd)
+        self._fd, self._pid = None, 0
+
+
+class Journal:
+    """Append-only file of compact JSON records, one per line.
+
+    ``offset`` is the end of the last complete line this object has read or
+    written. Bytes past it with no trailing newline are a torn write (the
+    process died mid-append); they are ignored when reading and cut off
+    before the next append.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.fsync = fsync
+        self.offset = 0
+        self._fd = None
+
+    def size(self) -> int:
+        try:
+            return os.stat(self.path).st_size
+        except FileNotFoundError:
+            return 0
+
+    def read_from(self, offset: int) -> Tuple[List[Dict[str, Any]], int]:
+        """Parse the complete records after ``offset``; returns them and the new offset."""
+        try:
+            with open(self.path, "rb") as f:
+                f.seek(offset)
+                chunk = f.read()
+        except FileNotFoundError:
+            return [], 0
+        end = chunk.rfind(b"\n") + 1
+        lines = [line for line in chunk[:end].decode("utf-8", "replace").split("\n") if line.strip()]
+        try:
+            records = json.loads("[" + ",".join(lines) + "]")  # one parse instead of one per line
+        except ValueError:
+            records = []
+            for line in lines:
+                try:
+                    records.append(json.loads(line))
+                except ValueError:
+                    log.warning("Skipping unreadable record in %s", self.path)
+        self.offset = offset + end
+        return records, self.offset
+
+    def _open(self) -> int:
+        if self._fd is not None:
+            try:
+                current = os.stat(self.path).st_ino
+            except FileNotFoundError:
+                current = None
+            if current != os.fstat(self._fd).st_ino:  # set aside (by another process): start a new file
+                self.close()
+        if self._fd is None:
+            self._fd = os.open(self.path, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+        return self._fd
+
+    def append(self, records: List[Dict[str, Any]]) -> None:
+        """Write ``records`` with a single write (and fsync)."""
+        fd = self._open()
+        if os.fstat(fd).st_size > self.offset:
+            # leftover of a torn append; don't glue new records onto it
+            os.ftruncate(fd, self.offset)
+        payload = b"".join(
+            json.dumps(r, ensure_ascii=False, separators=(",", ":")).encode("utf-8") + b"\n" for r in records)
+        os.write(fd, payload)
+        if self.fsync:
+            os.fsync(fd)
+        self.offset += len(payload)
+
+    def reset(self, header: Dict[str, Any]) -> None:
+        """Empty the journal in place and start it with ``header``."""
+        fd = self._open()
+        os.ftruncate(fd, 0)
+        self.offset = 0
+        self.append([header])
+
+    def rotate(self, header: Dict[str, Any]) -> None:
+        """Start a new journal with ``header``, keeping this one as ``<path>.prev``
+        (replacing the previous one) for other processes still reading it."""
+        self.close()
+        try:
+            os.replace(self.path, self.path + ".prev")
+        except FileNotFoundError:
+            pass
+        self.offset = 0
+        self.append([header])
+
+    def set_aside(self) -> str:
+        """Move the journal to ``<path>.orphan-<time>``, keeping its records; returns the new path."""
+        self.close()
+        backup = f"{self.path}.orphan-{int(time.time())}"
+        os.replace(self.path, backup)
+        self.offset = 0
+        return backup
+
+    def close(self) -> None:
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
+
+
+def file_digest(path: str, chunk: int = 1 << 20) -> Optional[str]:
+    """Digest of the bytes of ``path``, or None if there is no such file."""
+    try:
+        with open(path, "rb") as f:
+            h = hashlib.blake2b(digest_size=16)
+            for block in iter(lambda: f.read(chunk), b""):
+                h.update(block)
+    except FileNotFoundError:
+        return None
+    return h.hexdigest()
+
+
+def write_atomic(path: str, data: Any, indent: int = 2, default: Optional[Callable[[Any], Any]] = None) -> None:
+    """Write ``data`` as JSON to ``path`` via a temp file and rename.
+
+    ``default`` converts objects json can't encode, one at a time as they
+    are written (see ``json.dump``).
+    """
+    tmp = f"{path}.tmp-{os.getpid()}"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=indent, ensure_ascii=False, default=default)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
@@ -0,0 +1,789 @@
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from contextlib import ExitStack
+from itertools import islice
+from operator import itemgetter
+from typing import Callable, Dict, Any, List, Optional, Tuple
+
+from .base import CommitHook, CatalogVersion, Op, StorageBackend, op_name, op_names, sort_key
+from .journal import FileLock, Journal, file_digest, write_atomic
+from .record import Record, assign_ids, valid_id
+from .snapshot import Snapshot, SnapshotRecords, open_snapshot, write_snapshot
+from .sorted_index import SortedKeys
+
+log = logging.getLogger(__name__)
+
+
+def _category_key(category: Any) -> str:
+    return "" if category is None else str(category).lower()
+
+
+def _item(record: Optional[Record]) -> Optional[Dict[str, Any]]:
+    return None if record is None else record.to_dict()
+
+
+class _Commit:
+    """One batch's journal records, waiting to be written with others."""
+
+    __slots__ = ("records", "reloads", "changes", "on_commit", "ok", "error", "done")
+
+    def __init__(self, records: List[Dict[str, Any]], reloads: int, changes: list, on_commit: Optional[CommitHook]):
+        self.records = records
+        self.reloads = reloads
+        self.changes = changes  # (before, after) for on_commit
+        self.on_commit = on_commit
+        self.ok = False
+        self.error: Optional[BaseException] = None
+        self.done = False
+
+
+class JsonBackend(StorageBackend):
+    """The catalog as a snapshot (JSON, ``{name: item}``) plus a journal.
+
+    Every mutation is appended to ``<path>.journal`` as one compact record
+    and applied to the in-memory catalog, so a write costs O(1) instead of
+    rewriting the file. Every ``compact_every`` records the catalog is
+    written out as a new snapshot (temp file + rename) and the journal is
+    emptied. On load the snapshot is read and the journal replayed on top.
+
+    The journal starts with a ``base`` record naming the snapshot it
+    applies to by its token: the digest of a JSON snapshot's bytes, or the
+    token in a binary one's header. Touching or copying the snapshot keeps
+    the journal; a journal that belongs to another snapshot (a crash
+    between the two steps of a compaction, a backup restored over the
+    file, someone editing the JSON by hand) is not replayed, but moved
+    aside to ``<path>.journal.orphan-<time>`` with its writes intact.
+
+    Listings in date or author order read ``(sort key, name)`` indexes:
+    dates overall and per category, and authors. They are built the first
+    time such a listing is asked for (most stores never need them, and a
+    binary snapshot would have to decode every item) and kept up to date
+    from then on.
+
+    Concurrency: readers never lock. Items are replaced, never edited in
+    place, so a reader sees either the old or the new version of an item.
+    In memory each item is a :class:`~backends.record.Record`, found by
+    name in ``_cache`` or by id through ``_ids``; readers get fresh dicts.
+
+    A mutation holds the stripe lock for its item name across its
+    check-then-write, which makes borrow/return/create/delete of the same
+    name linearizable while writes to different names only queue for the
+    journal append itself (``_lock``). A batch holds the stripes of all its
+    names and is journaled with one write.
+
+    Group commit: with fsync on, batches don't each write and fsync the
+    journal. They queue, and a caller that finds no write in progress
+    becomes the writer. It journals everything queued (up to ``group_max``
+    batches, gathered for up to ``group_window`` seconds) with one write
+    and one fsync, then wakes the callers it wrote for, so a write returns
+    only once it is durable. Concurrent writers share the cost of an fsync
+    instead of lining up for one each; a lone writer pays no hand-off.
+
+    Several processes may share the files (``serve.py`` workers). ``_lock``
+    is also an ``flock`` on ``<path>.lock`` (see :class:`FileLock`), and
+    each process replays what the others journaled before its own next read
+    or write. A batch whose checks ran before such a replay is checked again.
+    Compaction keeps the journal it ends as ``<path>.journal.prev``, so the
+    others catch up with a new snapshot from it and its successor instead
+    of reloading the catalog (see :meth:`_follow_compaction`).
+
+    The snapshot may also be a binary one (see ``backends/snapshot.py``),
+    told apart by its first bytes. It is mapped rather than parsed: the
+    indexes are built from its name, id, category and flag columns, and an
+    item is decoded from it only when read (see :class:`SnapshotRecords`).
+    ``snapshot_format`` ("json" or "binary") is what compaction writes;
+    None keeps the format the file has, JSON for a new store.
+    """
+
+    STRIPES = 64
+    FORMATS = ("json", "binary")
+    WALK_SHARE = 16  # walk the author index for a category holding at least 1/WALK_SHARE of the items
+
+    def __init__(self, path: str, compact_every: int = 10000, fsync: bool = True,
+                 group_commit: bool = True, group_window: float = 0.0, group_max: int = 256,
+                 snapshot_format: Optional[str] = None):
+        super().__init__()
+        if snapshot_format not in (None,) + self.FORMATS:
+            raise ValueError(f"Unknown snapshot format {snapshot_format!r}; expected one of {self.FORMATS}")
+        self.path = path
+        self.compact_every = compact_every
+        self.snapshot_format = snapshot_format
+        self.journal = Journal(path + ".journal", fsync=fsync)
+        self.group_commit = group_commit and fsync  # without fsync there is little to share
+        self.group_window = group_window
+        self.group_max = group_max
+        self._queue: List[_Commit] = []
+        self._queue_cond = threading.Condition()
+        self._writing = False  # a caller is writing a group
+        self._lock = FileLock(path + ".lock")
+        self._stripes = [threading.Lock() for _ in range(self.STRIPES)]
+        self._reloads = 0  # times _refresh found the files changed by someone else
+        self._cache: Optional[Dict[str, Record]] = None
+        self._ids: Dict[int, str] = {}  # id -> name
+        self._next_id = 1
+        self._names = SortedKeys()  # names in order, for paging
+        self._categories: Dict[str, SortedKeys] = {}  # lower(category) -> names
+        self._category_labels: Dict[str, Any] = {}  # lower(category) -> first spelling seen
+        self._borrowed = SortedKeys()  # names of items that are out
+        self._category_borrowed: Dict[str, SortedKeys] = {}  # lower(category) -> names of its items that are out
+        # (sort key, name) indexes, None until first needed (see _ensure_sort_indexes)
+        self._by_date: Optional[SortedKeys] = None
+        self._by_author: Optional[SortedKeys] = None
+        self._category_dates: Dict[str, SortedKeys] = {}  # lower(category) -> (date, name)
+        self._snapshot_sig: Optional[Tuple[int, int, int]] = None  # stat of the snapshot, to notice a new one
+        self._token: Optional[str] = None  # which snapshot it is (see the class docstring)
+        self._binary = False  # the snapshot on disk is a binary one
+        self._pending = 0  # journal records since the last snapshot
+        self._version = 0  # changes applied since the store was created
+        self._epoch = ""
+        self._modified = 0.0
+
+    def _file_signature(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            st = os.stat(self.path)
+        except FileNotFoundError:
+            return None
+        return (st.st_mtime_ns, st.st_size, st.st_ino)
+
+    def _read_file(self) -> Tuple[Dict[str, Dict[str, Any]], Optional[str]]:
+        """The JSON snapshot's items and its token (None if there is no file)."""
+        try:
+            with open(self.path, "rb") as f:
+                raw = f.read()
+            return json.loads(raw), hashlib.blake2b(raw, digest_size=16).hexdigest()
+        except FileNotFoundError:
+            return {}, None
+        except ValueError:  # not JSON, or not UTF-8
+            # snapshots are written atomically, so this is damage from outside;
+            # keep the bytes for inspection rather than silently dropping them
+            backup = f"{self.path}.corrupt-{int(time.time())}"
+            os.replace(self.path, backup)
+            log.error("Unreadable catalog %s moved to %s", self.path, backup)
+            return {}, None
+
+    def _base_record(self) -> Dict[str, Any]:
+        return {"op": "base", "token": self._token, "v": self._version, "epoch": self._epoch,
+                "next_id": self._next_id}
+
+    def _is_base(self, base: Dict[str, Any]) -> bool:
+        """Whether the journal's ``base`` record is for the snapshot just loaded."""
+        if not base:
+            return False
+        if "token" in base:
+            return base["token"] == self._token
+        sig = self._snapshot_sig  # a journal from before tokens named the snapshot by its stat
+        return base.get("snapshot") == (list(sig) if sig else None)
+
+    def _mtime(self) -> float:
+        times = []
+        for path in (self.path, self.journal.path):
+            try:
+                times.append(os.stat(path).st_mtime)
+            except FileNotFoundError:
+                pass
+        return max(times, default=0.0)
+
+    def _index(self, record: Record) -> None:
+        name, key = record.name, _category_key(record.category)
+        names = self._categories.get(key)
+        if names is None:
+            names = self._categories[key] = SortedKeys()
+            self._category_labels[key] = record.category
+        names.add(name)
+        if not record.available:
+            self._borrowed.add(name)
+            out = self._category_borrowed.get(key)
+            if out is None:
+                out = self._category_borrowed[key] = SortedKeys()
+            out.add(name)
+        self._ids[record.id] = name
+        if self._by_date is not None:
+            date = (sort_key(record.publication_date), name)
+            self._by_date.add(date)
+            self._by_author.add((sort_key(record.author), name))
+            dates = self._category_dates.get(key)
+            if dates is None:
+                dates = self._category_dates[key] = SortedKeys()
+            dates.add(date)
+
+    def _unindex(self, record: Record) -> None:
+        name, key = record.name, _category_key(record.category)
+        names = self._categories.get(key)
+        if names is not None:
+            names.discard(name)
+            if not len(names):
+                del self._categories[key]
+                del self._category_labels[key]
+        self._borrowed.discard(name)
+        out = self._category_borrowed.get(key)
+        if out is not None:
+            out.discard(name)
+            if not len(out):
+                del self._category_borrowed[key]
+        self._ids.pop(record.id, None)
+        if self._by_date is not None:
+            date = (sort_key(record.publication_date), name)
+            self._by_date.discard(date)
+            self._by_author.discard((sort_key(record.author), name))
+            dates = self._category_dates.get(key)
+            if dates is not None:
+                dates.discard(date)
+                if not len(dates):
+                    del self._category_dates[key]
+
+    def _ensure_sort_indexes(self) -> None:
+        """Build the date and author indexes, the first time they are needed."""
+        if self._by_date is not None:
+            return
+        with self._lock:
+            self._refresh()
+            if self._by_date is not None:
+                return
+            dates, authors, by_category = [], [], {}
+            for record in self._cache.values():
+                date = (sort_key(record.publication_date), record.name)
+                dates.append(date)
+                authors.append((sort_key(record.author), record.name))
+                by_category.setdefault(_category_key(record.category), []).append(date)
+            self._by_author = SortedKeys(authors)
+            self._category_dates = {key: SortedKeys(group) for key, group in by_category.items()}
+            self._by_date = SortedKeys(dates)  # last: once it is set, readers use them all
+
+    def _load(self) -> Dict[str, Record]:
+        """Read the snapshot, whichever its format, and index it."""
+        snapshot = open_snapshot(self.path)
+        self._binary = snapshot is not None
+        if snapshot is None:
+            items, self._token = self._read_file()
+            data = self._to_records(items)
+            self._rebuild_indexes(data)
+            return data
+        self._next_id = snapshot.next_id
+        self._token = snapshot.token
+        names = snapshot.names()
+        data = SnapshotRecords(snapshot, names)
+        self._index_snapshot(snapshot, names, data)
+        return data
+
+    def _index_snapshot(self, snapshot: Snapshot, names: List[str], data: SnapshotRecords) -> None:
+        """The indexes of a binary snapshot, from its columns: no record is
+        decoded but those whose category is not a string."""
+        self._by_date = self._by_author = None  # rebuilt when next needed
+        self._category_dates = {}
+        self._names = SortedKeys.from_sorted(list(names))  # a copy: data keeps the snapshot's
+        self._ids = dict(zip(snapshot.ids, names))
+        self._categories, self._category_labels, self._category_borrowed = {}, {}, {}
+        borrowed = set(snapshot.borrowed)
+        for label, positions in snapshot.categories():
+            group = list(map(names.__getitem__, positions))
+            if label is None:
+                for name in group:
+                    self._index(data[name])
+                continue
+            key = _category_key(label)
+            out = [names[i] for i in positions if i in borrowed]
+            if key in self._categories:  # the same category in another case
+                self._categories[key] = SortedKeys([*self._categories[key], *group])
+                out += self._category_borrowed.get(key, ())
+            else:
+                self._categories[key] = SortedKeys.from_sorted(group)
+                self._category_labels[key] = label
+            if out:
+                self._category_borrowed[key] = SortedKeys(out)
+        self._borrowed = SortedKeys.from_sorted(list(map(names.__getitem__, snapshot.borrowed)))
+
+    def _rebuild_indexes(self, data: Dict[str, Record]) -> None:
+        self._by_date = self._by_author = None  # rebuilt when next needed
+        self._category_dates = {}
+        self._names = SortedKeys(data)
+        self._categories, self._category_labels, self._category_borrowed = {}, {}, {}
+        self._borrowed = SortedKeys()
+        self._ids = {}
+        for name in self._names:
+            self._index(data[name])  # in name order, so each add is an append
+
+    def _to_records(self, data: Dict[str, Dict[str, Any]], start: int = 1) -> Dict[str, Record]:
+        """Records for plain items (read from disk, or given to replace_all),
+        numbering the ones that have no id yet from ``start``."""
+        self._next_id = max(self._next_id, assign_ids(data.values(), start))
+        return {name: Record.from_dict(item) for name, item in data.items()}
+
+    def _replay(self, records: List[Dict[str, Any]]) -> None:
+        data = self._cache
+        for rec in records:
+            op = rec.get("op")
+            if op == "base":
+                continue
+            self._pending += 1
+            self._version += 1
+            self._modified = time.time()
+            if op == "put":
+                item = rec["item"]
+                name = item["name"]
+                old = data.get(name)
+                if old is None:
+                    self._names.add(name)
+                else:
+                    self._unindex(old)
+                record = Record.from_dict(item)
+                if not valid_id(record.id):  # journaled before items had ids
+                    record.id = self._next_id if old is None else old.id
+                    item = record.to_dict()
+                self._next_id = max(self._next_id, record.id + 1)
+                data[name] = record
+                self._index(record)
+                self._notify("put", name, item, self._version)
+            elif op == "del":
+                old = data.pop(rec["name"], None)
+                if old is not None:
+                    self._names.discard(rec["name"])
+                    self._unindex(old)
+                    self._notify("del", rec["name"], version=self._version)
+
+    def _refresh(self) -> bool:
+        """Bring the cache up to date with the files; True if they had changed.
+
+        Caller holds the lock.
+        """
+        sig = self._file_signature()
+        if self._cache is not None and sig != self._snapshot_sig and self._follow_compaction():
+            self._reloads += 1
+            return True
+        if self._cache is None or sig != self._snapshot_sig:
+            self._next_id = 1
+            self._cache = self._load()
+            self._snapshot_sig = self._file_signature()
+            self._pending = 0
+            modified = self._mtime()
+            records, _ = self.journal.read_from(0)
+            base = records[0] if records and records[0].get("op") == "base" else {}
+            self._epoch = base.get("epoch") or uuid.uuid4().hex[:8]
+            self._version = base.get("v", 0)
+            if self._is_base(base):
+                self._next_id = max(self._next_id, base.get("next_id", 1))  # don't reuse ids of deleted items
+                self._notify("reset", version=self._version)
+                self._replay(records[1:])
+            else:
+                changes = [r for r in records if r.get("op") != "base"]
+                if changes:
+                    backup = self.journal.set_aside()
+                    log.error("Journal %s does not belong to snapshot %s; its %d changes are NOT applied. "
+                              "Moved it to %s", self.journal.path, self.path, len(changes), backup)
+                    # count the ignored records too, so the version still only grows
+                    self._version += len(records)
+                self._notify("reset", version=self._version)
+                self.journal.reset(self._base_record())
+            self._modified = modified
+        elif self.journal.size() > self.journal.offset:
+            records, _ = self.journal.read_from(self.journal.offset)
+            if not records:
+                return False  # only a torn append
+            self._replay(records)
+        else:
+            return False
+        self._reloads += 1
+        return True
+
+    def _follow_compaction(self) -> bool:
+        """Catch up with a snapshot another process compacted the catalog into,
+        without reading it: finish the journal it ended (kept as ``.prev``)
+        from where this process stopped, check that lands on the new base's
+        version, and replay the new journal. False, changing nothing, if the
+        snapshot is not this catalog compacted (a reload is needed then).
+
+        Caller holds the lock.
+        """
+        records, _ = Journal(self.journal.path).read_from(0)
+        base = records[0] if records and records[0].get("op") == "base" else {}
+        if not base or base.get("epoch") != self._epoch or "token" not in base:
+            return False
+        tail: List[Dict[str, Any]] = []
+        if base.get("v") != self._version:
+            prev, _ = Journal(self.journal.path + ".prev").read_from(0)
+            if not prev or prev[0].get("op") != "base" or prev[0].get("token") != self._token:
+                return False  # not the journal this process was following
+            tail, _ = Journal(self.journal.path + ".prev").read_from(self.journal.offset)
+            if self._version + sum(1 for r in tail if r.get("op") != "base") != base.get("v"):
+                return False
+        snapshot = open_snapshot(self.path)
+        token = file_digest(self.path) if snapshot is None else snapshot.token
+        if token != base["token"] or (snapshot is not None) != self._binary:
+            if snapshot is not None:  # not the base's snapshot, or compacted into the other format
+                snapshot.close()
+            return False
+        self._replay(tail)
+        if snapshot is not None:  # the same items, from the new file
+            if snapshot.count != len(self._names):
+                snapshot.close()
+                return False
+            self._cache = SnapshotRecords(snapshot, list(self._names))
+        self._snapshot_sig = self._file_signature()
+        self._token = base["token"]
+        self._next_id = max(self._next_id, base.get("next_id", 1))
+        self._pending = 0
+        self.journal.close()  # appends go to the new file
+        self.journal.offset = 0
+        records, _ = self.journal.read_from(0)
+        self._replay(records[1:])
+        return True
+
+    def _catalog(self) -> Dict[str, Record]:
+        """Return the cached catalog, reading from disk only if the files changed."""
+        if (self._cache is not None and self._file_signature() == self._snapshot_sig
+                and self.journal.size() == self.journal.offset):
+            return self._cache
+        with self._lock:
+            self._refresh()
+            return self._cache
+
+    def _commit(self, records: List[Dict[str, Any]], reloads: int, changes: list,
+                on_commit: Optional[CommitHook]) -> bool:
+        """Journal ``records`` and apply them; False, writing nothing, if the
+        catalog was reloaded since ``_reloads`` was ``reloads``. Then, still
+        under the lock, ``on_commit(changes)``.
+
+        Callers hold the stripe lock of every name the records touch, so
+        within this process the checks they made are still valid here;
+        only a write by another process can have changed the outcome.
+        """
+        commit = _Commit(records, reloads, changes, on_commit)
+        if not self.group_commit:
+            self._write([commit])
+        else:
+            self._enqueue(commit)
+        if commit.error is not None:
+            raise commit.error
+        return commit.ok
+
+    def _enqueue(self, commit: _Commit) -> None:
+        """Have ``commit`` written in a group, by this thread or the one writing now."""
+        cond = self._queue_cond
+        with cond:
+            self._queue.append(commit)
+            while self._writing and not commit.done:
+                cond.wait()
+            if not commit.done:
+                self._writing = True
+                try:
+                    while not commit.done:  # ours may not fit in the first group
+                        self._write_queued()
+                finally:
+                    self._writing = False
+                    cond.notify_all()  # the next waiter takes over
+
+    def _write_queued(self) -> None:
+        """Write one group from the queue. Caller is the writer and holds ``_queue_cond``."""
+        cond = self._queue_cond
+        deadline = time.monotonic() + self.group_window
+        while len(self._queue) < self.group_max:
+            left = deadline - time.monotonic()
+            if left <= 0:
+                break
+            cond.wait(left)
+        group, self._queue = self._queue[:self.group_max], self._queue[self.group_max:]
+        cond.release()  # others may queue meanwhile
+        try:
+            self._write(group)
+        except BaseException as e:
+            for commit in group:
+                commit.error = e
+        finally:
+            cond.acquire()
+        for commit in group:
+            commit.done = True
+        cond.notify_all()
+
+    def _write(self, commits: List[_Commit]) -> None:
+        """Journal the records of ``commits`` with one append and apply them.
+
+        They touch different names (their callers hold those names' stripes),
+        so numbering them together is the same as one after the other.
+        """
+        with self._lock:
+            self._refresh()
+            records = []
+            for commit in commits:
+                commit.ok = self._reloads == commit.reloads
+                if commit.ok:
+                    records.extend(commit.records)
+            if not records:
+                return
+            self._number(records)
+            self.journal.append(records)
+            self._replay(records)
+            for commit in commits:
+                if commit.ok and commit.on_commit is not None:
+                    try:
+                        commit.on_commit(commit.changes)
+                    except Exception as e:  # the catalog change stands; its caller hears of the rest
+                        commit.error = e
+            if self._pending >= self.compact_every:
+                self._snapshot(self._cache)
+
+    def _number(self, records: List[Dict[str, Any]]) -> None:
+        """Give the items in ``records`` their ids. Caller holds the lock.
+
+        An item keeps the id of the item it overwrites, or the id it carries
+        if no other item has it (a rename carries the id of the name it
+        leaves in the same commit); otherwise it gets the next new id.
+        """
+        data, ids = self._cache, self._ids
+        current: Dict[str, Optional[int]] = {}  # id of each name as of this record (None: deleted)
+        freed, used = set(), set()
+        for rec in records:
+            name = rec["name"] if rec["op"] == "del" else rec["item"]["name"]
+            old = current[name] if name in current else getattr(data.get(name), "id", None)
+            if rec["op"] == "del":
+                freed.add(old)
+                current[name] = None
+                continue
+            item = rec["item"]
+            wanted = item.get("id")
+            if old is not None:
+                item_id = old
+            elif valid_id(wanted) and wanted not in used and (wanted not in ids or wanted in freed):
+                item_id = wanted
+            else:
+                item_id = self._next_id
+            self._next_id = max(self._next_id, item_id + 1)
+            used.add(item_id)
+            current[name] = item_id
+            item["id"] = item_id
+
+    def _snapshot(self, data: Dict[str, Any]) -> None:
+        """Write ``data`` as the new snapshot and empty the journal. Caller holds the lock.
+
+        ``data`` is the cache itself (compaction) or plain items replacing
+        the catalog.
+        """
+        replaced = data is not self._cache
+        if replaced:
+            data = self._to_records(data, start=self._next_id)
+        binary = self._binary if self.snapshot_format is None else self.snapshot_format == "binary"
+        if binary:
+            names = sorted(data) if replaced else list(self._names)
+            token = uuid.uuid4().hex
+            write_snapshot(self.path, (data[name] for name in names), self._next_id, token)
+        else:
+            if isinstance(data, SnapshotRecords):  # leaving the binary format
+                data = dict(data.items())
+            # records are turned into dicts one at a time as they are written
+            write_atomic(self.path, data, default=Record.to_dict)
+            token = file_digest(self.path)
+        self._token = token
+        self._binary = binary
+        if replaced:
+            self._rebuild_indexes(data)
+            self._version += 1
+            self._modified = time.time()
+        if binary:
+            # read back from the new file: the records decoded since the last
+            # snapshot are dropped, and unchanged items stay undecoded
+            data = SnapshotRecords(Snapshot(self.path), names)
+        self._cache = data
+        self._snapshot_sig = self._file_signature()
+        self._pending = 0
+        self.journal.rotate(self._base_record())
+        if replaced:
+            self._notify("reset", version=self._version)
+
+    def compact(self) -> None:
+        """Fold the journal into a fresh snapshot now."""
+        with self._lock:
+            self._refresh()
+            self._snapshot(self._cache)
+
+    def invalidate(self) -> None:
+        """Drop the cached catalog so the next read goes back to disk."""
+        with self._lock:
+            self._cache = None
+            self._snapshot_sig = None
+
+    def version(self) -> CatalogVersion:
+        self._catalog()
+        return CatalogVersion(self._epoch, self._version, self._modified)
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        return {name: record.to_dict() for name, record in list(self._catalog().items())}
+
+    def sync(self) -> None:
+        self._catalog()
+
+    def replace_all(self, data: Dict[str, Dict[str, Any]],
+                    on_commit: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> None:
+        with self._lock:
+            self._refresh()  # so the version goes on from the latest one
+            self._snapshot(data)
+            if on_commit is not None:
+                on_commit(list(data.values()))  # numbered in place by _to_records
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        return _item(self._catalog().get(name))
+
+    def get_by_id(self, item_id: int) -> Optional[Dict[str, Any]]:
+        data = self._catalog()
+        name = self._ids.get(item_id)
+        return None if name is None else _item(data.get(name))
+
+    def list_all(self) -> List[Dict[str, Any]]:
+        self._catalog()
+        return self._items(self._names)  # in name order, as SQLite lists them
+
+    def _items(self, names) -> List[Dict[str, Any]]:
+        data = self._catalog()
+        # a single list() over an index doesn't release the GIL, so it is a
+        # consistent copy even while writers insert or delete names
+        records = [data.get(n) for n in list(names)]
+        return [r.to_dict() for r in records if r is not None]  # skip names deleted meanwhile
+
+    def list_by_category(self, category: str) -> List[Dict[str, Any]]:
+        self._catalog()
+        return self._items(self._categories.get(_category_key(category), ()))
+
+    def list_borrowed(self) -> List[Dict[str, Any]]:
+        self._catalog()
+        return self._items(self._borrowed)
+
+    def category_counts(self) -> Dict[Any, int]:
+        self._catalog()
+        labels = self._category_labels
+        return {labels.get(key, key): len(names) for key, names in list(self._categories.items())}
+
+    def page(self, after: Optional[Any], limit: int, category: Optional[str] = None,
+             borrowed: bool = False, offset: int = 0, sort: str = "name", descending: bool = False,
+             published: Optional[Tuple[str, str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        self._catalog()
+        if sort != "name" or descending or published is not None:
+            return self._sorted_page(after, limit, category, borrowed, offset, sort, descending, published)
+        if category is None:
+            index = self._borrowed if borrowed else self._names
+            return self._items(index.after(after, limit, offset)), len(index)
+        groups = self._category_borrowed if borrowed else self._categories
+        names = groups.get(_category_key(category), SortedKeys())
+        return self._items(names.after(after, limit, offset)), len(names)
+
+    def _sorted_page(self, after: Optional[Any], limit: int, category: Optional[str], borrowed: bool,
+                     offset: int, sort: str, descending: bool,
+                     published: Optional[Tuple[str, str]]) -> Tuple[List[Dict[str, Any]], int]:
+        """:meth:`page` in another order than by name, or over a date range.
+
+        When an index in the wanted order covers the category and date
+        filters, the page is a range of it: O(log n + offset + limit).
+        A large category is walked in author order and filtered. Otherwise
+        the matches are taken from the narrowest index (the date range, or
+        the category) and sorted: O(log n + k log k) for k matches.
+        """
+        self._ensure_sort_indexes()
+        key = None if category is None else _category_key(category)
+        lo, hi = (None, None) if published is None else ((published[0],), (published[1],))
+        out = self._borrowed
+        empty = SortedKeys()
+        members = None  # a category to filter a walk by
+        if sort == "publication_date":
+            index = self._by_date if key is None else self._category_dates.get(key, empty)
+        elif published is None and sort == "name":
+            if borrowed:
+                index = out if key is None else self._category_borrowed.get(key, empty)
+                borrowed = False  # the index holds only what is out
+            else:
+                index = self._names if key is None else self._categories.get(key, empty)
+        elif published is None and key is None:
+            index = self._by_author
+        elif published is None and len(self._categories.get(key, ())) * self.WALK_SHARE >= len(self._names):
+            index = self._by_author
+            members = self._categories[key]
+        else:
+            # no index in this order covers the filters: sort the matches
+            if published is not None:
+                dates = self._by_date if key is None else self._category_dates.get(key, empty)
+                names = [name for _, name in dates.iter_window(lo, hi)]
+            else:  # by author, in a category
+                names = list(self._categories.get(key, ()))
+            if borrowed:
+                names = [name for name in names if name in out]
+            if sort == "name":
+                index = SortedKeys(names)
+            else:
+                data = self._cache
+                records = (data.get(name) for name in names)
+                index = SortedKeys((sort_key(getattr(r, sort)), r.name) for r in records if r is not None)
+            lo = hi = None
+            borrowed = False  # filtered already
+        name_of = (lambda k: k) if sort == "name" else itemgetter(1)
+        if members is not None:
+            matches = (k for k in index.iter_window(lo, hi, after, descending)
+                       if k[1] in members and (not borrowed or k[1] in out))
+            keys = list(islice(matches, offset, offset + limit))
+            total = len(self._category_borrowed.get(key, ()) if borrowed else members)
+        elif borrowed and index is not out:
+            matches = (k for k in index.iter_window(lo, hi, after, descending) if name_of(k) in out)
+            keys = list(islice(matches, offset, offset + limit))
+            if published is None:  # the whole category: its count of what is out
+                total = len(self._category_borrowed.get(key, ()) if key is not None else out)
+            else:
+                total = sum(1 for k in index.iter_window(lo, hi) if name_of(k) in out)
+        else:
+            keys = index.window(lo, hi, after, limit, offset, descending)
+            total = index.count(lo, hi)
+        return self._items(map(name_of, keys)), total
+
+    def batch(self, ops: List[Op], on_commit: Optional[CommitHook] = None) -> List[bool]:
+        stripes = sorted({hash(name) % self.STRIPES for op in ops for name in op_names(op)})
+        with ExitStack() as stack:
+            for i in stripes:  # always in index order, so batches can't deadlock
+                stack.enter_context(self._stripes[i])
+            while True:
+                reloads = self._reloads
+                results, records, changes = self._plan(ops, self._catalog())
+                if not records or self._commit(records, reloads, changes, on_commit):
+                    return results
+
+    def _plan(self, ops: List[Op], data: Dict[str, Record]) -> Tuple[List[bool], List[Dict[str, Any]], list]:
+        """Check ``ops`` against the catalog: their results, the journal
+        records and the ``(before, after)`` of every op that applies."""
+        staged: Dict[str, Optional[Dict[str, Any]]] = {}  # this batch's view of changed names
+        results, records, changes = [], [], []
+        for op in ops:
+            kind, name = op[0], op_name(op)
+            item = staged[name] if name in staged else _item(data.get(name))
+            if kind == "create":
+                ok = item is None
+                new = op[1]
+            elif kind == "put":
+                ok = True
+                new = op[1]
+            elif kind == "delete":
+                ok = item is not None
+                new = None
+            elif kind == "borrow":
+                ok = item is not None and item.get("available", True)
+                new = ok and dict(item, available=False, borrowed_by=op[2], borrow_date=op[3])
+            elif kind == "return":
+                ok = item is not None and not item.get("available", True)
+                new = ok and dict(item, available=True, borrowed_by=None, borrow_date=None)
+            elif kind == "update":
+                target = op[2].get("name", name)
+                ok = item is not None and (target == name or (
+                    staged[target] if target in staged else data.get(target)) is None)
+                new = ok and dict(item, **op[2])
+                if ok and target != name:
+                    staged[name] = None  # a rename: the old name goes, the id moves with the item
+                    records.append({"op": "del", "name": name})
+                    name = target
+            else:
+                raise ValueError(f"Unknown op {kind!r}")
+            results.append(ok)
+            if ok:
+                staged[name] = new
+                records.append({"op": "del", "name": name} if new is None else {"op": "put", "item": new})
+                changes.append((item, new))  # _number gives ``new`` its id in place
+        return results, records, changes
+
+    def close(self) -> None:
+        self.journal.close()
+        self._lock.close()
@@ -0,0 +1,66 @@
+import sys
+from typing import Any, Dict, Iterable
+
+# keys every item has; anything else an item carries is kept in Record.extra
+FIELDS = ("id", "name", "author", "publication_date", "category", "available", "borrowed_by", "borrow_date")
+_FIELD_SET = frozenset(FIELDS)
+
+
+class Record:
+    """One catalog item as the JSON engine keeps it in memory.
+
+    A per-item dict repeats its keys' hash table in every item; slots hold
+    just the values, about a third of the size. Categories are interned, so
+    a million items share a handful of category strings.
+    """
+
+    __slots__ = FIELDS + ("extra",)
+
+    @classmethod
+    def from_dict(cls, item: Dict[str, Any]) -> "Record":
+        rec = cls.__new__(cls)
+        rec.id = item.get("id")
+        rec.name = item["name"]
+        rec.author = item.get("author")
+        rec.publication_date = item.get("publication_date")
+        category = item.get("category")
+        rec.category = sys.intern(category) if isinstance(category, str) else category
+        rec.available = item.get("available", True)
+        rec.borrowed_by = item.get("borrowed_by")
+        rec.borrow_date = item.get("borrow_date")
+        rec.extra = {k: v for k, v in item.items() if k not in _FIELD_SET} or None
+        return rec
+
+    def to_dict(self) -> Dict[str, Any]:
+        item = {"id": self.id, "name": self.name, "author": self.author,
+                "publication_date": self.publication_date, "category": self.category,
+                "available": self.available, "borrowed_by": self.borrowed_by, "borrow_date": self.borrow_date}
+        if self.extra:
+            item.update(self.extra)
+        return item
+
+
+def valid_id(value: Any) -> bool:
+    return isinstance(value, int) and not isinstance(value, bool) and value > 0
+
+
+def assign_ids(items: Iterable[Dict[str, Any]], start: int = 1) -> int:
+    """Give every item without a usable ``id`` a new one; returns the next free id.
+
+    Items are numbered in name order from ``start`` or after the highest id
+    already present, so the same catalog always gets the same ids. An id is unusable if it
+    is not a positive int or an earlier item (by name) already has it.
+    Sets ``item["id"]`` in place.
+    """
+    items = sorted(items, key=lambda m: m["name"])
+    taken, missing = set(), []
+    for item in items:
+        if valid_id(item.get("id")) and item["id"] not in taken:
+            taken.add(item["id"])
+        else:
+            missing.append(item)
+    next_id = max(start, max(taken, default=0) + 1)
+    for item in missing:
+        item["id"] = next_id
+        next_id += 1
+    return next_id
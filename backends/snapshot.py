@@ -0,0 +1,267 @@
+"""Binary catalog snapshots, read through ``mmap`` instead of parsed up front.
+
+Layout (integers little-endian)::
+
+    header   MAGIC, item count, next id, token (32 ASCII bytes, new for every
+             snapshot written), start and length of each section below
+    records  per item, in name order: u32 length + a compact JSON row
+    strings  JSON array of the category and author strings rows refer to
+    names    JSON array of the item names, in order
+    ids      i64 per item
+    groups   JSON array of [category, count]: category is an index into
+             strings, or -1 for the items whose category is not a string
+    bycat    u32 positions of the items, by category (in groups order) and name
+    out      u32 positions of the borrowed items, in name order
+    index    u64 per item: where its record starts
+
+A row is ``[id, name, author, publication_date, category, available,
+borrowed_by, borrow_date, extra]``. Author and category are an index into
+``strings`` when they are strings, otherwise the value wrapped in a list.
+
+Opening one reads the header and strings only. The names, ids, groups
+and positions are what the JSON engine's indexes are built from, without a
+single record being parsed; a record is decoded when it is asked for.
+"""
+import json
+import mmap
+import os
+import struct
+import sys
+from array import array
+from bisect import bisect_left
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Sequence, Tuple
+
+from .record import Record
+
+MAGIC = b"PKSNAP1\n"
+SECTIONS = ("records", "strings", "names", "ids", "groups", "bycat", "out", "index")
+_HEADER = struct.Struct("<8sQQ32s" + "QQ" * len(SECTIONS))  # (start, length) of each section
+_LENGTH = struct.Struct("<I")
+_LITTLE = sys.byteorder == "little"
+# json.loads on bytes spends more time working out the encoding than parsing a row
+_parse = json.JSONDecoder().raw_decode
+
+
+def _ints(buf: memoryview, typecode: str) -> Sequence[int]:
+    """The little-endian ints in ``buf``, without a copy where the CPU allows."""
+    if _LITTLE:
+        return buf.cast(typecode)
+    values = array(typecode, buf.tobytes())
+    values.byteswap()
+    return values
+
+
+def _int_bytes(typecode: str, values: Iterable[int]) -> bytes:
+    values = array(typecode, values)
+    if not _LITTLE:
+        values.byteswap()
+    return values.tobytes()
+
+
+class Snapshot:
+    """A binary snapshot file, mapped read-only.
+
+    The file is never changed in place (a new snapshot replaces it by
+    rename), so records can be read from the mapping without a lock.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        if self._mm[:len(MAGIC)] != MAGIC:
+            self._mm.close()
+            raise ValueError(f"{path} is not a catalog snapshot")
+        _, self.count, self.next_id, token, *spans = _HEADER.unpack_from(self._mm)
+        self.token = token.decode("ascii")
+        view = memoryview(self._mm)
+        self._sections = {name: view[spans[2 * i]:spans[2 * i] + spans[2 * i + 1]]
+                          for i, name in enumerate(SECTIONS)}
+        self.strings: List[str] = [sys.intern(s) for s in json.loads(bytes(self._sections["strings"]))]
+        self.ids = _ints(self._sections["ids"], "q")
+        self.borrowed = _ints(self._sections["out"], "I")
+        self._by_category = _ints(self._sections["bycat"], "I")
+        self._index = _ints(self._sections["index"], "Q")
+        self._records_start = spans[0]
+
+    def names(self) -> List[str]:
+        """Every item name, in order (position ``i`` is record ``i``)."""
+        return json.loads(bytes(self._sections["names"]))
+
+    def categories(self) -> Iterator[Tuple[Any, Sequence[int]]]:
+        """``(category, positions)`` for each category string, in name order;
+        ``(None, positions)`` for the items whose category is not a string."""
+        start = 0
+        for category, count in json.loads(bytes(self._sections["groups"])):
+            yield (None if category < 0 else self.strings[category]), self._by_category[start:start + count]
+            start += count
+
+    def record(self, i: int) -> Record:
+        """Decode record ``i``."""
+        start = self._records_start + self._index[i]
+        (length,) = _LENGTH.unpack_from(self._mm, start)
+        row, _ = _parse(self._mm[start + _LENGTH.size:start + _LENGTH.size + length].decode("utf-8"))
+        rec = Record.__new__(Record)
+        (rec.id, rec.name, author, rec.publication_date, category, rec.available, rec.borrowed_by,
+         rec.borrow_date, rec.extra) = row
+        strings = self.strings
+        rec.author = strings[author] if author.__class__ is int else author[0]
+        rec.category = strings[category] if category.__class__ is int else category[0]
+        return rec
+
+    def close(self) -> None:
+        for view in (self.ids, self.borrowed, self._by_category, self._index):
+            if isinstance(view, memoryview):
+                view.release()
+        for view in self._sections.values():
+            view.release()
+        self._mm.close()
+
+
+_STORED = object()  # "as the snapshot has it", in SnapshotRecords._changed lookups
+
+
+class SnapshotRecords:
+    """The JSON engine's ``{name: Record}`` catalog over a :class:`Snapshot`.
+
+    Only the items changed since the snapshot are held, in ``_changed``
+    (None for a deleted one); the others are found by name in the
+    snapshot's sorted names and decoded each time they are read. Nothing
+    is built per item when a snapshot is opened, and the decoded records
+    are not kept: the OS keeps the hot pages in memory.
+
+    Supports what the engine does with its catalog: ``get``, ``[]``,
+    ``in``, ``len``, assignment, ``pop``, ``values`` and ``items`` (the
+    snapshot's items in name order, then the added ones).
+    """
+
+    def __init__(self, snapshot: Snapshot, names: List[str]):
+        self.snapshot = snapshot
+        self._names = names  # the snapshot's, in order; never changed
+        self._changed: Dict[str, Optional[Record]] = {}
+        self._len = len(names)
+
+    def _position(self, name: str) -> int:
+        i = bisect_left(self._names, name)
+        return i if i < len(self._names) and self._names[i] == name else -1
+
+    def get(self, name: str, default: Any = None) -> Any:
+        record = self._changed.get(name, _STORED)
+        if record is _STORED:
+            i = self._position(name)
+            return default if i < 0 else self.snapshot.record(i)
+        return default if record is None else record
+
+    def __getitem__(self, name: str) -> Record:
+        record = self.get(name)
+        if record is None:
+            raise KeyError(name)
+        return record
+
+    def __contains__(self, name: str) -> bool:
+        record = self._changed.get(name, _STORED)
+        return self._position(name) >= 0 if record is _STORED else record is not None
+
+    def __len__(self) -> int:
+        return self._len
+
+    def __setitem__(self, name: str, record: Record) -> None:
+        if name not in self:
+            self._len += 1
+        self._changed[name] = record
+
+    def pop(self, name: str, *default: Any) -> Any:
+        record = self.get(name)
+        if record is None:
+            if default:
+                return default[0]
+            raise KeyError(name)
+        self._changed[name] = None
+        self._len -= 1
+        return record
+
+    def items(self) -> List[Tuple[str, Record]]:
+        changed = self._changed.copy()  # a consistent copy: dict.copy doesn't release the GIL
+        found = []
+        for i, name in enumerate(self._names):
+            record = changed.pop(name, _STORED)
+            if record is _STORED:
+                found.append((name, self.snapshot.record(i)))
+            elif record is not None:
+                found.append((name, record))
+        found.extend((name, record) for name, record in changed.items() if record is not None)
+        return found
+
+    def values(self) -> List[Record]:
+        return [record for _, record in self.items()]
+
+
+def _row(record: Record, strings: Dict[str, int]) -> List[Any]:
+    def ref(value):
+        if isinstance(value, str):
+            return strings.setdefault(value, len(strings))
+        return [value]
+    return [record.id, record.name, ref(record.author), record.publication_date, ref(record.category),
+            record.available, record.borrowed_by, record.borrow_date, record.extra]
+
+
+def write_snapshot(path: str, records: Iterable[Record], next_id: int, token: str) -> None:
+    """Write ``records`` (in name order) as a binary snapshot, atomically.
+    ``token`` (32 ASCII characters) names this snapshot; see ``Snapshot.token``.
+
+    Records are encoded and written one at a time; the per-item columns
+    are kept until the end, a few dozen bytes per item.
+    """
+    tmp = f"{path}.tmp-{os.getpid()}"
+    strings: Dict[str, int] = {}
+    names, ids, index, borrowed = [], array("q"), array("Q"), array("I")
+    by_category: Dict[int, array] = {}
+    with open(tmp, "wb") as f:
+        f.write(b"\0" * _HEADER.size)
+        offset = 0
+        for record in records:
+            row = json.dumps(_row(record, strings), ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+            f.write(_LENGTH.pack(len(row)))
+            f.write(row)
+            index.append(offset)
+            offset += _LENGTH.size + len(row)
+            position = len(names)
+            names.append(record.name)
+            ids.append(record.id)
+            category = strings[record.category] if isinstance(record.category, str) else -1
+            group = by_category.get(category)
+            if group is None:
+                group = by_category[category] = array("I")
+            group.append(position)
+            if not record.available:
+                borrowed.append(position)
+        groups = [[category, len(positions)] for category, positions in by_category.items()]
+        sections = [
+            json.dumps(list(strings), ensure_ascii=False).encode("utf-8"),
+            json.dumps(names, ensure_ascii=False).encode("utf-8"),
+            _int_bytes("q", ids), json.dumps(groups).encode("ascii"),
+            b"".join(_int_bytes("I", positions) for positions in by_category.values()),
+            _int_bytes("I", borrowed), _int_bytes("Q", index),
+        ]
+        spans = [_HEADER.size, offset]
+        position = _HEADER.size + offset
+        for data in sections:
+            padding = -position % 8  # keep the int columns aligned
+            f.write(b"\0" * padding)
+            position += padding
+            spans += [position, len(data)]
+            f.write(data)
+            position += len(data)
+        f.seek(0)
+        f.write(_HEADER.pack(MAGIC, len(names), next_id, token.encode("ascii"), *spans))
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+
+
+def open_snapshot(path: str) -> Optional[Snapshot]:
+    """The snapshot at ``path``, or None if there is none or it is JSON."""
+    try:
+        return Snapshot(path)
+    except (FileNotFoundError, ValueError):  # ValueError: not a snapshot, or an empty file
+        return None
@@ -0,0 +1,97 @@
+from bisect import bisect_left, bisect_right
+from typing import Any, Iterable, Iterator, List, Optional
+
+
+class SortedKeys:
+    """A sorted list of unique keys with bisect-based updates and range reads.
+
+    Inserts and removals are O(log n) to find plus a memmove; reading a page
+    that starts after a given key is O(log n + page size).
+    """
+
+    def __init__(self, keys: Iterable[Any] = ()):
+        self._keys: List[Any] = sorted(set(keys))
+
+    @classmethod
+    def from_sorted(cls, keys: List[Any]) -> "SortedKeys":
+        """Wrap a list that is already sorted and free of duplicates (no copy)."""
+        index = cls.__new__(cls)
+        index._keys = keys
+        return index
+
+    def __len__(self) -> int:
+        return len(self._keys)
+
+    def __iter__(self) -> Iterator[Any]:
+        return iter(self._keys)
+
+    def __contains__(self, key: Any) -> bool:
+        i = bisect_left(self._keys, key)
+        return i < len(self._keys) and self._keys[i] == key
+
+    def add(self, key: Any) -> None:
+        i = bisect_left(self._keys, key)
+        if i == len(self._keys) or self._keys[i] != key:
+            self._keys.insert(i, key)
+
+    def discard(self, key: Any) -> None:
+        i = bisect_left(self._keys, key)
+        if i < len(self._keys) and self._keys[i] == key:
+            del self._keys[i]
+
+    def after(self, key: Optional[Any], limit: int, offset: int = 0) -> List[Any]:
+        """Up to ``limit`` keys strictly greater than ``key`` (from the start if
+        None), skipping the first ``offset`` of them."""
+        start = (0 if key is None else bisect_right(self._keys, key)) + offset
+        return self._keys[start:start + limit]
+
+    def count(self, lo: Optional[Any] = None, hi: Optional[Any] = None) -> int:
+        """Number of keys in ``[lo, hi)`` (None: unbounded), in O(log n)."""
+        start = 0 if lo is None else bisect_left(self._keys, lo)
+        end = len(self._keys) if hi is None else bisect_left(self._keys, hi)
+        return max(0, end - start)
+
+    def window(self, lo: Optional[Any], hi: Optional[Any], after: Optional[Any], limit: int,
+               offset: int = 0, reverse: bool = False) -> List[Any]:
+        """Up to ``limit`` keys in ``[lo, hi)`` that come after ``after`` (from
+        the start if None), skipping the first ``offset``; with ``reverse``,
+        walking down from the top, so "after" means smaller. O(log n + limit)."""
+        keys = self._keys
+        start = 0 if lo is None else bisect_left(keys, lo)
+        end = len(keys) if hi is None else bisect_left(keys, hi)
+        if not reverse:
+            if after is not None:
+                start = max(start, bisect_right(keys, after))
+            start += offset
+            return keys[start:max(start, min(end, start + limit))]
+        if after is not None:
+            end = min(end, bisect_left(keys, after))
+        end -= offset
+        return keys[max(start, end - limit):max(start, end)][::-1]
+
+    def iter_window(self, lo: Optional[Any], hi: Optional[Any], after: Optional[Any] = None,
+                    reverse: bool = False, chunk: int = 256) -> Iterator[Any]:
+        """The keys :meth:`window` would return one chunk at a time, to the end of the range."""
+        while True:
+            keys = self.window(lo, hi, after, chunk, reverse=reverse)
+            yield from keys
+            if len(keys) < chunk:
+                return
+            after = keys[-1]
+
+    def iter_from(self, key: Any, chunk: int = 256) -> Iterator[Any]:
+        """Keys greater than or equal to ``key`` in order, read a chunk at a time."""
+        start = bisect_left(self._keys, key)
+        keys = self._keys[start:start + chunk]
+        yield from keys
+        if len(keys) == chunk:
+            yield from self.iter_after(keys[-1], chunk)
+
+    def iter_after(self, key: Optional[Any], chunk: int = 256) -> Iterator[Any]:
+        """Keys greater than ``key`` in order, read a chunk at a time."""
+        while True:
+            keys = self.after(key, chunk)
+            yield from keys
+            if len(keys) < chunk:
+                return
+            key = keys[-1]
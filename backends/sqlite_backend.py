@@ -0,0 +1,433 @@
+import json
+import sqlite3
+import threading
+import time
+from typing import Callable, Dict, Any, Iterable, List, Optional, Tuple
+
+from .base import CatalogVersion, CommitHook, Op, StorageBackend, op_name
+from .record import FIELDS, assign_ids, valid_id
+
+# Columns with a fixed meaning; any other item keys round-trip through `extra`.
+COLUMNS = FIELDS
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS media (
+    id INTEGER,
+    name TEXT PRIMARY KEY,
+    author TEXT,
+    publication_date TEXT,
+    category TEXT,
+    available INTEGER NOT NULL DEFAULT 1,
+    borrowed_by TEXT,
+    borrow_date TEXT,
+    extra TEXT
+);
+CREATE INDEX IF NOT EXISTS idx_media_category ON media(lower(category));
+CREATE INDEX IF NOT EXISTS idx_media_author ON media(author);
+CREATE INDEX IF NOT EXISTS idx_media_publication_date ON media(publication_date);
+CREATE INDEX IF NOT EXISTS idx_media_available ON media(available);
+
+-- Listings in date or author order (StorageBackend.page) sort by these
+-- expressions (sort_key: text as it is, anything else as ''), then name.
+CREATE INDEX IF NOT EXISTS idx_media_date_order
+    ON media(CASE WHEN typeof(publication_date) = 'text' THEN publication_date ELSE '' END, name);
+CREATE INDEX IF NOT EXISTS idx_media_author_order
+    ON media(CASE WHEN typeof(author) = 'text' THEN author ELSE '' END, name);
+CREATE INDEX IF NOT EXISTS idx_media_category_date_order
+    ON media(lower(category), CASE WHEN typeof(publication_date) = 'text' THEN publication_date ELSE '' END, name);
+
+-- Row counts kept up to date by triggers, so totals for paged listings don't
+-- need a COUNT(*) scan. Keys: '' (all items), 'borrowed', 'category:<lower>'.
+CREATE TABLE IF NOT EXISTS media_counts (
+    key TEXT PRIMARY KEY,
+    n INTEGER NOT NULL
+);
+CREATE TRIGGER IF NOT EXISTS media_counts_insert AFTER INSERT ON media BEGIN
+    INSERT INTO media_counts (key, n) VALUES ('', 1), ('category:' || lower(coalesce(NEW.category, '')), 1)
+        ON CONFLICT (key) DO UPDATE SET n = n + 1;
+    INSERT INTO media_counts (key, n) SELECT 'borrowed', 1 WHERE NEW.available = 0
+        ON CONFLICT (key) DO UPDATE SET n = n + 1;
+END;
+CREATE TRIGGER IF NOT EXISTS media_counts_delete AFTER DELETE ON media BEGIN
+    UPDATE media_counts SET n = n - 1
+        WHERE key IN ('', 'category:' || lower(coalesce(OLD.category, '')))
+           OR (key = 'borrowed' AND OLD.available = 0);
+END;
+CREATE TRIGGER IF NOT EXISTS media_counts_update AFTER UPDATE OF available, category ON media BEGIN
+    UPDATE media_counts SET n = n - 1
+        WHERE key = 'category:' || lower(coalesce(OLD.category, '')) OR (key = 'borrowed' AND OLD.available = 0);
+    INSERT INTO media_counts (key, n) VALUES ('category:' || lower(coalesce(NEW.category, '')), 1)
+        ON CONFLICT (key) DO UPDATE SET n = n + 1;
+    INSERT INTO media_counts (key, n) SELECT 'borrowed', 1 WHERE NEW.available = 0
+        ON CONFLICT (key) DO UPDATE SET n = n + 1;
+END;
+
+-- One row: the catalog version, bumped by every write transaction (see
+-- StorageBackend.version). The epoch is random per database file.
+CREATE TABLE IF NOT EXISTS media_meta (
+    id INTEGER PRIMARY KEY CHECK (id = 0),
+    epoch TEXT NOT NULL,
+    version INTEGER NOT NULL,
+    modified REAL NOT NULL,
+    next_id INTEGER NOT NULL DEFAULT 1  -- ids below this have been handed out
+);
+INSERT OR IGNORE INTO media_meta (id, epoch, version, modified)
+    VALUES (0, lower(hex(randomblob(4))), 0, (julianday('now') - 2440587.5) * 86400.0);
+
+-- The name each recent version changed (op 'put', 'del' or 'reset'), so
+-- other processes using the file can tell their listeners (see
+-- SqliteBackend.sync). Only the last LOG_SIZE versions are kept.
+CREATE TABLE IF NOT EXISTS media_log (
+    version INTEGER PRIMARY KEY,
+    op TEXT NOT NULL,
+    name TEXT
+);
+"""
+
+LOG_SIZE = 10000
+
+_BUMP_VERSION = "UPDATE media_meta SET version = version + ?, modified = ? WHERE id = 0 RETURNING version"
+_NEXT_ID = "UPDATE media_meta SET next_id = next_id + 1 WHERE id = 0 RETURNING next_id - 1"
+_SEEN_ID = "UPDATE media_meta SET next_id = max(next_id, ? + 1) WHERE id = 0"
+_LOG = "INSERT INTO media_log (version, op, name) VALUES (?, ?, ?)"
+_TRIM_LOG = "DELETE FROM media_log WHERE version <= ?"
+
+# Item ids, for databases created before items had them: the column, filled
+# in from the rowids, and then (for every database) its index and the counter
+# moved past the highest id.
+_ADD_IDS = """
+ALTER TABLE media ADD COLUMN id INTEGER;
+UPDATE media SET id = rowid;
+"""
+_ADD_NEXT_ID = "ALTER TABLE media_meta ADD COLUMN next_id INTEGER NOT NULL DEFAULT 1"
+_INDEX_IDS = """
+CREATE UNIQUE INDEX IF NOT EXISTS idx_media_id ON media(id);
+UPDATE media_meta SET next_id = max(next_id, (SELECT coalesce(max(id), 0) + 1 FROM media)) WHERE id = 0;
+"""
+
+# Recomputes media_counts from scratch, for databases created before it existed.
+_REBUILD_COUNTS = """
+DELETE FROM media_counts;
+INSERT INTO media_counts (key, n) SELECT '', COUNT(*) FROM media;
+INSERT INTO media_counts (key, n) SELECT 'borrowed', COUNT(*) FROM media WHERE available = 0;
+INSERT INTO media_counts (key, n)
+    SELECT 'category:' || lower(coalesce(category, '')), COUNT(*) FROM media GROUP BY 1;
+"""
+
+# the sort key of each SORTS field, as in the indexes above
+_SORT_KEYS = {
+    "name": "name",
+    "publication_date": "CASE WHEN typeof(publication_date) = 'text' THEN publication_date ELSE '' END",
+    "author": "CASE WHEN typeof(author) = 'text' THEN author ELSE '' END",
+}
+
+_SELECT = "SELECT id, name, author, publication_date, category, available, borrowed_by, borrow_date, extra FROM media"
+_RETURNING = " RETURNING id, name, author, publication_date, category, available, borrowed_by, borrow_date, extra"
+_INSERT = ("INSERT INTO media (id, name, author, publication_date, category, available, borrowed_by, borrow_date, extra) "
+           "VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)")
+# an upsert rather than INSERT OR REPLACE: REPLACE deletes without firing the
+# delete trigger, which would leave media_counts wrong
+_UPSERT = _INSERT + " ON CONFLICT (name) DO UPDATE SET " + ", ".join(
+    f"{c} = excluded.{c}" for c in ("author", "publication_date", "category", "available", "borrowed_by",
+                                    "borrow_date", "extra")) + " RETURNING id"
+_UPDATE = ("UPDATE media SET name = ?, author = ?, publication_date = ?, category = ?, available = ?, "
+           "borrowed_by = ?, borrow_date = ?, extra = ? WHERE name = ?")
+
+
+def _to_row(media: Dict[str, Any]) -> tuple:
+    extra = {k: v for k, v in media.items() if k not in COLUMNS}
+    return (
+        media.get("id"),
+        media["name"],
+        media.get("author"),
+        media.get("publication_date"),
+        media.get("category"),
+        1 if media.get("available", True) else 0,
+        media.get("borrowed_by"),
+        media.get("borrow_date"),
+        json.dumps(extra, ensure_ascii=False) if extra else None,
+    )
+
+
+def _to_item(row: tuple) -> Dict[str, Any]:
+    item = dict(zip(COLUMNS, row[:8]))
+    item["available"] = bool(item["available"])
+    if row[8]:
+        item.update(json.loads(row[8]))
+    return item
+
+
+class SqliteBackend(StorageBackend):
+    """Catalog in an SQLite database (WAL mode) with indexed lookups.
+
+    Writes go through ``_write_lock`` so listeners hear about changes in the
+    order they were committed; SQLite allows one writer at a time anyway.
+    A batch is one transaction.
+
+    Other processes may write the same file (``serve.py`` workers). A batch
+    takes SQLite's write lock before its first read, and every write is
+    recorded in ``media_log``; :meth:`sync` (run by :meth:`version` and at
+    the start of each batch) replays the versions this process hasn't
+    told its listeners about.
+    """
+
+    def __init__(self, path: str):
+        super().__init__()
+        self.path = path
+        self._write_lock = threading.Lock()
+        self._local = threading.local()
+        self._conns: List[sqlite3.Connection] = []
+        self._conns_lock = threading.Lock()
+        conn = self._conn()
+        conn.executescript(SCHEMA)
+        if conn.execute("SELECT 1 FROM media_counts WHERE key = ''").fetchone() is None:
+            conn.executescript("BEGIN;" + _REBUILD_COUNTS + "COMMIT;")
+        if "id" not in {c[1] for c in conn.execute("PRAGMA table_info(media)")}:
+            conn.executescript("BEGIN;" + _ADD_IDS + "COMMIT;")
+        if "next_id" not in {c[1] for c in conn.execute("PRAGMA table_info(media_meta)")}:
+            conn.execute(_ADD_NEXT_ID)
+        conn.executescript("BEGIN;" + _INDEX_IDS + "COMMIT;")
+        self._seen = conn.execute("SELECT version FROM media_meta").fetchone()[0]  # last one listeners heard of
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3 connections may not be shared between threads; keep one each
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+            with self._conns_lock:
+                self._conns.append(conn)
+        return conn
+
+    def _query(self, sql: str, params: Iterable[Any] = ()) -> List[Dict[str, Any]]:
+        return [_to_item(row) for row in self._conn().execute(sql, tuple(params))]
+
+    def version(self) -> CatalogVersion:
+        v = CatalogVersion(*self._conn().execute("SELECT epoch, version, modified FROM media_meta").fetchone())
+        if v.version != self._seen and self._listeners:
+            self.sync()
+        return v
+
+    def sync(self) -> None:
+        # searches and idle streams call this all the time: without a new
+        # version, don't queue up behind the writers for the lock
+        if self._conn().execute("SELECT version FROM media_meta").fetchone()[0] == self._seen:
+            return
+        with self._write_lock:
+            with self._conn() as conn:
+                conn.execute("BEGIN")  # one read snapshot for the log and the items
+                self._catch_up(conn)
+
+    def _catch_up(self, conn: sqlite3.Connection) -> None:
+        """Notify what was written since ``_seen`` (by other processes). Caller
+        holds the write lock, inside a transaction."""
+        current = conn.execute("SELECT version FROM media_meta").fetchone()[0]
+        if current == self._seen:
+            return
+        rows = conn.execute("SELECT version, op, name FROM media_log WHERE version > ? ORDER BY version",
+                            (self._seen,)).fetchall() if self._listeners else []
+        if not rows or rows[0][0] != self._seen + 1 or rows[-1][0] != current:
+            self._notify("reset", version=current)  # trimmed from the log (or nobody listens)
+        for version, op, name in rows:
+            item = self.get(name) if op == "put" else None
+            if op == "reset":
+                self._notify("reset", version=version)
+            elif item is None:  # deleted, or renamed away, since
+                self._notify("del", name, version=version)
+            else:
+                self._notify("put", name, item, version)
+        self._seen = current
+
+    def _log(self, conn: sqlite3.Connection, changes: List[tuple], version: int) -> None:
+        """Record ``changes``, which brought the catalog to ``version``, in media_log."""
+        first = version - len(changes) + 1
+        conn.executemany(_LOG, ((first + i, op, name) for i, (op, name, _) in enumerate(changes)))
+        conn.execute(_TRIM_LOG, (version - LOG_SIZE,))
+
+    def _assign_id(self, conn: sqlite3.Connection, media: Dict[str, Any]) -> int:
+        """The id for a new item: the one it carries if no other item has it,
+        else the next new one. Caller holds the write lock."""
+        wanted = media.get("id")
+        if valid_id(wanted) and conn.execute("SELECT 1 FROM media WHERE id = ?", (wanted,)).fetchone() is None:
+            conn.execute(_SEEN_ID, (wanted,))
+            return wanted
+        return conn.execute(_NEXT_ID).fetchone()[0]
+
+    def load_all(self) -> Dict[str, Dict[str, Any]]:
+        return {item["name"]: item for item in self.list_all()}
+
+    def replace_all(self, data: Dict[str, Dict[str, Any]],
+                    on_commit: Optional[Callable[[List[Dict[str, Any]]], None]] = None) -> None:
+        with self._write_lock:
+            with self._conn() as conn:
+                conn.execute("BEGIN IMMEDIATE")
+                self._catch_up(conn)
+                conn.execute("DELETE FROM media")
+                next_id = conn.execute("SELECT next_id FROM media_meta").fetchone()[0]
+                next_id = assign_ids(data.values(), next_id)
+                conn.executemany(_INSERT, (_to_row(m) for m in data.values()))
+                conn.execute("UPDATE media_meta SET next_id = max(next_id, ?) WHERE id = 0", (next_id,))
+                version = conn.execute(_BUMP_VERSION, (1, time.time())).fetchone()[0]
+                self._log(conn, [("reset", None, None)], version)
+                if on_commit is not None:
+                    on_commit(list(data.values()))
+            self._notify("reset", version=version)
+            self._seen = version
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        rows = self._query(_SELECT + " WHERE name = ?", (name,))
+        return rows[0] if rows else None
+
+    def get_by_id(self, item_id: int) -> Optional[Dict[str, Any]]:
+        rows = self._query(_SELECT + " WHERE id = ?", (item_id,))
+        return rows[0] if rows else None
+
+    def list_all(self) -> List[Dict[str, Any]]:
+        return self._query(_SELECT + " ORDER BY name")
+
+    def list_by_category(self, category: str) -> List[Dict[str, Any]]:
+        return self._query(_SELECT + " WHERE lower(category) = lower(?) ORDER BY name", (category,))
+
+    def list_borrowed(self) -> List[Dict[str, Any]]:
+        return self._query(_SELECT + " WHERE available = 0 ORDER BY name")
+
+    def _count(self, key_sql: str, params: Iterable[Any] = ()) -> int:
+        row = self._conn().execute("SELECT n FROM media_counts WHERE key = " + key_sql, tuple(params)).fetchone()
+        return row[0] if row else 0
+
+    def category_counts(self) -> Dict[Any, int]:
+        counts = {}
+        conn = self._conn()
+        rows = conn.execute("SELECT substr(key, 10), n FROM media_counts WHERE key LIKE 'category:%' AND n > 0").fetchall()
+        for key, n in rows:
+            # show the category as it was typed, not the lowercased counter key
+            label = conn.execute("SELECT category FROM media WHERE lower(category) = ? LIMIT 1", (key,)).fetchone()
+            counts[label[0] if label else key] = n
+        return counts
+
+    def page(self, after: Optional[Any], limit: int, category: Optional[str] = None,
+             borrowed: bool = False, offset: int = 0, sort: str = "name", descending: bool = False,
+             published: Optional[Tuple[str, str]] = None) -> Tuple[List[Dict[str, Any]], int]:
+        key, date = _SORT_KEYS[sort], _SORT_KEYS["publication_date"]
+        filters, params = [], []
+        if category is not None:
+            filters.append("lower(category) = lower(?)")
+            params.append(category)
+        if borrowed:
+            filters.append("available = 0")
+        where, where_params = list(filters), list(params)
+        if published is not None:
+            filters.append(f"{date} >= ? AND {date} < ?")
+            params.extend(published)
+        # bounds on the sort key: SQLite seeks the index to one bound per side,
+        # not to the tighter of two, so the date range and cursor make one
+        lo = hi = None
+        if published is not None:
+            if sort == "publication_date":
+                lo, hi = published
+            else:
+                where.append(f"{date} >= ? AND {date} < ?")
+                where_params.extend(published)
+        if after is not None:
+            if sort == "name":
+                where.append("name < ?" if descending else "name > ?")
+                where_params.append(after)
+            else:
+                where.append(f"({key}, name) {'<' if descending else '>'} (?, ?)")
+                where_params.extend(after)
+                if descending:
+                    below = after[0] + "\0"  # the first string above it: "< below" is "<= after[0]"
+                    hi = below if hi is None else min(hi, below)
+                else:
+                    lo = after[0] if lo is None else max(lo, after[0])
+        if lo is not None:
+            where.append(f"{key} >= ?")
+            where_params.append(lo)
+        if hi is not None:
+            where.append(f"{key} < ?")
+            where_params.append(hi)
+        direction = " DESC" if descending else ""
+        order = f"name{direction}" if sort == "name" else f"{key}{direction}, name{direction}"
+        sql = _SELECT + (" WHERE " + " AND ".join(where) if where else "") + f" ORDER BY {order} LIMIT ? OFFSET ?"
+        items = self._query(sql, where_params + [limit, offset])
+        if published is not None or (category is not None and borrowed):
+            # no counter for these; the indexes keep the count to the matching rows
+            total = self._conn().execute("SELECT COUNT(*) FROM media WHERE " + " AND ".join(filters),
+                                         params).fetchone()[0]
+        elif category is not None:
+            # lower() in SQL so the key matches what the triggers wrote
+            total = self._count("'category:' || lower(?)", (category,))
+        else:
+            total = self._count("'borrowed'" if borrowed else "''")
+        return items, total
+
+    def batch(self, ops: List[Op], on_commit: Optional[CommitHook] = None) -> List[bool]:
+        results, changes, applied = [], [], []
+        with self._write_lock:
+            with self._conn() as conn:
+                # the write lock before the first read: another process's
+                # commit can't slip in between a check and its write
+                conn.execute("BEGIN IMMEDIATE")
+                self._catch_up(conn)
+                for op in ops:
+                    kind = op[0]
+                    rows = self._query(_SELECT + " WHERE name = ?", (op_name(op),))
+                    before = rows[0] if rows else None
+                    if kind in ("create", "put"):
+                        media = op[1]
+                        if before and kind == "create":
+                            ok = False
+                        else:
+                            # an overwrite keeps the item's id
+                            media["id"] = before["id"] if before else self._assign_id(conn, media)
+                            ok = conn.execute(_UPSERT, _to_row(media)).fetchone() is not None
+                        change = ("put", media["name"], media)
+                    elif kind == "delete":
+                        ok = conn.execute("DELETE FROM media WHERE name = ?", (op[1],)).rowcount == 1
+                        change = ("del", op[1], None)
+                    elif kind in ("borrow", "return"):
+                        if kind == "borrow":
+                            sql = "UPDATE media SET available = 0, borrowed_by = ?, borrow_date = ? WHERE name = ? AND available = 1"
+                            params = (op[2], op[3], op[1])
+                        else:
+                            sql = "UPDATE media SET available = 1, borrowed_by = NULL, borrow_date = NULL WHERE name = ? AND available = 0"
+                            params = (op[1],)
+                        row = conn.execute(sql + _RETURNING, params).fetchone()
+                        ok = row is not None
+                        change = ("put", op[1], row and _to_item(row))
+                    elif kind == "update":
+                        target = op[2].get("name", op[1])
+                        ok = bool(rows) and (target == op[1] or conn.execute(
+                            "SELECT 1 FROM media WHERE name = ?", (target,)).fetchone() is None)
+                        item = ok and dict(rows[0], **op[2])
+                        if ok:
+                            item["id"] = rows[0]["id"]
+                            conn.execute(_UPDATE, _to_row(item)[1:] + (op[1],))
+                            if target != op[1]:
+                                changes.append(("del", op[1], None))  # a rename; the id stays with the item
+                        change = ("put", target, item)
+                    else:
+                        raise ValueError(f"Unknown op {kind!r}")
+                    results.append(ok)
+                    if ok:
+                        changes.append(change)
+                        applied.append((before, change[2]))
+                if changes:
+                    version = conn.execute(_BUMP_VERSION, (len(changes), time.time())).fetchone()[0]
+                    self._log(conn, changes, version)
+                    if on_commit is not None:
+                        on_commit(applied)  # before COMMIT: if it fails, so does the batch
+            for i, change in enumerate(changes, 1):
+                self._notify(*change, version=version - len(changes) + i)
+            if changes:
+                self._seen = version
+        return results
+
+    def close(self) -> None:
+        with self._conns_lock:
+            for conn in self._conns:
+                conn.close()
+            self._conns.clear()
+        self._local = threading.local()
@@ -0,0 +1,86 @@
+"""Shared helpers for the benchmark scripts in this folder."""
+import os
+import random
+import sys
+import time
+from typing import Any, Callable, Dict, List
+
+# make the top-level modules (app, storage, ...) importable when a script
+# is run as ``python benchmarks/<name>.py`` from the project root
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+if ROOT not in sys.path:
+    sys.path.insert(0, ROOT)
+
+CATEGORIES = ["Book", "Film", "Magazine"]
+WORDS = [
+    "river", "shadow", "garden", "empire", "silent", "ocean", "winter", "golden",
+    "forest", "city", "night", "storm", "secret", "journey", "mirror", "stone",
+    "kingdom", "fire", "glass", "moon", "paper", "letters", "island", "song",
+    "सूरज", "किताब", "café", "señor", "über", "naïve",
+]
+AUTHORS = [
+    "James Clear", "Christopher Nolan", "Premchand", "Toni Morrison", "Haruki Murakami",
+    "Gabriel García Márquez", "Mahasweta Devi", "Ursula K. Le Guin", "Satyajit Ray",
+    "Chimamanda Ngozi Adichie", "Jorge Luis Borges", "Agatha Christie",
+]
+
+
+def _pool(base: List[str], size: int, label: str) -> List[str]:
+    return base[:size] if size <= len(base) else base + [f"{label} {i}" for i in range(len(base), size)]
+
+
+def _picker(rng: random.Random, pool: List[str], skew: float) -> Callable[[], str]:
+    """Draw from ``pool`` uniformly, or Zipf-like (weight 1/rank**skew) if ``skew`` > 0."""
+    if skew <= 0:
+        return lambda: rng.choice(pool)
+    cum, total = [], 0.0
+    for rank in range(1, len(pool) + 1):
+        total += rank ** -skew
+        cum.append(total)
+    return lambda: rng.choices(pool, cum_weights=cum)[0]
+
+
+def make_catalog(n: int, seed: int = 42, categories: int = len(CATEGORIES), authors: int = len(AUTHORS),
+                 skew: float = 0.0) -> Dict[str, Dict[str, Any]]:
+    """Build a synthetic catalog of ``n`` unique items keyed by name.
+
+    ``categories`` and ``authors`` set how many distinct ones there are
+    (beyond the built-in lists they are numbered); ``skew`` > 0 makes a few
+    of them much more common than the rest.
+    """
+    rng = random.Random(seed)
+    category = _picker(rng, _pool(CATEGORIES, categories, "Genre"), skew)
+    author = _picker(rng, _pool(AUTHORS, authors, "Author"), skew)
+    data = {}
+    for i in range(n):
+        words = rng.sample(WORDS, 3)
+        name = f"{' '.join(words).title()} {i}"
+        data[name] = {
+            "name": name,
+            "author": author(),
+            "publication_date": f"{rng.randint(1950, 2024)}-{rng.randint(1, 12):02d}-{rng.randint(1, 28):02d}",
+            "category": category(),
+            "available": rng.random() > 0.1,
+            "borrowed_by": None,
+            "borrow_date": None,
+        }
+    return data
+
+
+def time_calls(fn: Callable[[], Any], reps: int) -> List[float]:
+    """Call ``fn`` ``reps`` times and return each call's duration in seconds."""
+    out = []
+    for _ in range(reps):
+        t0 = time.perf_counter()
+        fn()
+        out.append(time.perf_counter() - t0)
+    return out
+
+
+def fmt_ms(seconds: float) -> str:
+    return f"{seconds * 1000:10.3f} ms"
+
+
+def median(values: List[float]) -> float:
+    values = sorted(values)
+    return values[len(values) // 2]
@@ -0,0 +1,50 @@
+"""Importing items: one ``POST /media`` per item vs. ``POST /media/bulk`` in chunks.
+
+Usage: python benchmarks/bench_bulk.py [--items 20000] [--chunk 5000] [--backend json|sqlite]
+"""
+import argparse
+import os
+import tempfile
+import time
+
+from _common import make_catalog
+
+import storage
+from app import app
+from backends import JsonBackend, SqliteBackend
+
+
+def fresh_backend(kind: str, tmp: str):
+    if kind == "sqlite":
+        return SqliteBackend(os.path.join(tmp, f"media-{time.monotonic_ns()}.db"))
+    return JsonBackend(os.path.join(tmp, f"media-{time.monotonic_ns()}.json"))
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--items", type=int, default=20000)
+    parser.add_argument("--chunk", type=int, default=5000)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    args = parser.parse_args()
+    items = list(make_catalog(args.items).values())
+    client = app.test_client()
+    with tempfile.TemporaryDirectory() as tmp:
+        previous = storage.set_backend(fresh_backend(args.backend, tmp))
+        t0 = time.perf_counter()
+        for item in items:
+            client.post("/media", json=dict(item))
+        single = time.perf_counter() - t0
+
+        storage.set_backend(fresh_backend(args.backend, tmp))
+        t0 = time.perf_counter()
+        for start in range(0, len(items), args.chunk):
+            r = client.post("/media/bulk", json=items[start:start + args.chunk])
+            assert r.get_json()["failed"] == 0
+        bulk = time.perf_counter() - t0
+        storage.set_backend(previous)
+    print(f"{args.items} items ({args.backend})  one by one {single:7.2f} s ({args.items / single:8.0f}/s)"
+          f"  bulk {bulk:7.2f} s ({args.items / bulk:8.0f}/s)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,57 @@
+"""Per-request latency of ``GET /media/<name>`` with and without the catalog cache.
+
+Usage: python benchmarks/bench_cache.py [--sizes 1000,100000,1000000]
+"""
+import argparse
+import json
+import os
+import tempfile
+from urllib.parse import quote
+
+from _common import fmt_ms, make_catalog, median, time_calls
+
+import storage
+from app import app
+from backends import JsonBackend
+
+
+def run(size: int, uncached_reps: int, cached_reps: int) -> None:
+    catalog = make_catalog(size)
+    names = list(catalog)
+    probe = names[len(names) // 2]
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = JsonBackend(os.path.join(tmp, "media_store.json"))
+        with open(backend.path, "w", encoding="utf-8") as f:
+            json.dump(catalog, f, indent=2, ensure_ascii=False)
+        del catalog
+        previous = storage.set_backend(backend)
+        client = app.test_client()
+        url = f"/media/{quote(probe, safe='')}"
+
+        def uncached():
+            # the pre-cache code path: parse the whole file for one lookup
+            backend.invalidate()
+            assert client.get(url).status_code == 200
+
+        def cached():
+            assert client.get(url).status_code == 200
+
+        before = median(time_calls(uncached, uncached_reps))
+        cached()  # warm up
+        after = median(time_calls(cached, cached_reps))
+        storage.set_backend(previous)
+        print(f"{size:>9} items  uncached {fmt_ms(before)}  cached {fmt_ms(after)}  speedup {before / after:8.0f}x")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--uncached-reps", type=int, default=3)
+    parser.add_argument("--cached-reps", type=int, default=500)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.uncached_reps, args.cached_reps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,103 @@
+"""Durable write throughput against the number of concurrent clients: a full
+rewrite per write, one journal fsync per write, and group commit.
+
+Every client borrows and returns its own items in a loop; all writes are
+fsynced before they count.
+
+Usage: python benchmarks/bench_group_commit.py [--size 10000] [--clients 1,4,16,64] [--seconds 2]
+"""
+import argparse
+import os
+import tempfile
+import threading
+import time
+
+from _common import make_catalog
+
+from backends import JsonBackend
+from backends.journal import write_atomic
+
+
+class Rewrite:
+    """What every write used to cost: the whole catalog dumped, fsynced and
+    renamed into place, one writer at a time."""
+
+    def __init__(self, path, catalog):
+        self.path, self.catalog = path, catalog
+        self._lock = threading.Lock()
+
+    def _flip(self, name, available):
+        with self._lock:
+            self.catalog[name] = dict(self.catalog[name], available=available)
+            write_atomic(self.path, self.catalog)
+        return True
+
+    def borrow(self, name, borrower, when):
+        return self._flip(name, False)
+
+    def give_back(self, name):
+        return self._flip(name, True)
+
+    def close(self):
+        pass
+
+
+def throughput(store, names, clients: int, seconds: float) -> float:
+    """Writes per second with ``clients`` threads, each on its own slice of ``names``."""
+    stop = time.perf_counter() + seconds
+    counts = [0] * clients
+
+    def client(i):
+        mine = names[i::clients]
+        n = 0
+        while time.perf_counter() < stop:
+            name = mine[n % len(mine)]
+            store.borrow(name, f"client {i}", "2025-01-01 10:00:00")
+            store.give_back(name)
+            n += 1
+        counts[i] = 2 * n
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return sum(counts) / (time.perf_counter() - started)
+
+
+def run(size: int, clients_list, seconds: float) -> None:
+    catalog = make_catalog(size)
+    for item in catalog.values():
+        item["available"] = True
+    names = list(catalog)[:1000]
+    print(f"{size} items, writes/s (each durable)")
+    print(f"{'clients':>8} {'rewrite':>10} {'fsync each':>11} {'group':>10}")
+    for clients in clients_list:
+        rates = []
+        with tempfile.TemporaryDirectory() as tmp:
+            stores = [
+                lambda: Rewrite(os.path.join(tmp, "rewrite.json"), dict(catalog)),
+                lambda: JsonBackend(os.path.join(tmp, "each.json"), compact_every=10 ** 9, group_commit=False),
+                lambda: JsonBackend(os.path.join(tmp, "group.json"), compact_every=10 ** 9),
+            ]
+            for make in stores:
+                store = make()
+                if isinstance(store, JsonBackend):
+                    store.replace_all(catalog)
+                rates.append(throughput(store, names, clients, seconds))
+                store.close()
+        print(f"{clients:>8} {rates[0]:>10.0f} {rates[1]:>11.0f} {rates[2]:>10.0f}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--size", type=int, default=10000)
+    parser.add_argument("--clients", default="1,4,16,64")
+    parser.add_argument("--seconds", type=float, default=2.0)
+    args = parser.parse_args()
+    run(args.size, [int(c) for c in args.clients.split(",")], args.seconds)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,42 @@
+"""Query latency of the search index behind ``GET /media/search?q=``.
+
+Usage: python benchmarks/bench_search.py [--sizes 1000,100000,1000000]
+"""
+import argparse
+import time
+
+from _common import fmt_ms, make_catalog, median, time_calls
+
+from search import SearchIndex
+
+QUERIES = ["river", "riv", "silent gar", "Gold", "márquez", "gabriel garc", "कित", "naive", "zzz"]
+
+
+def run(size: int, reps: int, limit: int) -> None:
+    items = list(make_catalog(size).values())
+    index = SearchIndex()
+    t0 = time.perf_counter()
+    index.ensure_built(lambda: items)
+    print(f"{size:>9} items  build {time.perf_counter() - t0:7.2f} s")
+    for query in QUERIES:
+        took = median(time_calls(lambda: index.search(query, limit), reps))
+        hits = len(index.search(query, limit))
+        print(f"    {query!r:>16}  {fmt_ms(took)}  ({hits} hits)")
+    extra = {"name": "Benchmark Extra", "author": "Nobody", "category": "Book", "publication_date": "2024-01-01"}
+    took = median(time_calls(lambda: (index.on_change("put", extra["name"], extra),
+                                      index.on_change("del", extra["name"], None)), reps))
+    print(f"    {'add + remove':>16}  {fmt_ms(took)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,100000,1000000")
+    parser.add_argument("--reps", type=int, default=200)
+    parser.add_argument("--limit", type=int, default=10)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.reps, args.limit)
+
+
+if __name__ == "__main__":
+    main()
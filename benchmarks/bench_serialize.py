@@ -0,0 +1,60 @@
+"""Throughput of building a full ``GET /media`` body: ``jsonify`` against the
+per-item encoding cache, plus what gzip adds on top.
+
+Usage: python benchmarks/bench_serialize.py [--sizes 10000,200000] [--reps 5]
+"""
+import argparse
+import gzip
+import os
+import tempfile
+
+from _common import fmt_ms, make_catalog, median, time_calls
+
+import config
+import storage
+from app import app
+from backends import JsonBackend
+from flask import jsonify
+
+
+def run(size: int, reps: int) -> None:
+    with tempfile.TemporaryDirectory() as tmp:
+        backend = JsonBackend(os.path.join(tmp, "media_store.json"), fsync=False)
+        backend.replace_all(make_catalog(size))
+        previous = storage.set_backend(backend)
+        client = app.test_client()
+        items = backend.list_all()
+        cache = storage.item_cache()
+
+        with app.app_context():
+            plain = median(time_calls(lambda: jsonify(items).get_data(), reps))
+        cold = time_calls(lambda: cache.join(items, cache.generation), 1)[0]  # fills the cache
+        warm = median(time_calls(lambda: cache.join(items, cache.generation), reps))
+        body = b"[" + cache.join(items, cache.generation) + b"]"
+        packed = median(time_calls(lambda: gzip.compress(body, compresslevel=config.COMPRESS_LEVEL, mtime=0), reps))
+        request = median(time_calls(lambda: client.get("/media").get_data(), reps))
+        zipped = median(time_calls(lambda: client.get("/media", headers={"Accept-Encoding": "gzip"}).get_data(), reps))
+        size_gz = len(client.get("/media", headers={"Accept-Encoding": "gzip"}).get_data())
+        storage.set_backend(previous)
+        backend.close()
+
+    mb = len(body) / 2**20
+    print(f"{size:>9} items  {mb:7.1f} MB JSON, {size_gz / 2**20:6.1f} MB gzipped")
+    print(f"  jsonify          {fmt_ms(plain)}  {mb / plain:8.0f} MB/s")
+    print(f"  cache, cold      {fmt_ms(cold)}  {mb / cold:8.0f} MB/s")
+    print(f"  cache, warm      {fmt_ms(warm)}  {mb / warm:8.0f} MB/s  ({plain / warm:.1f}x jsonify)")
+    print(f"  gzip level {config.COMPRESS_LEVEL}     {fmt_ms(packed)}  {mb / packed:8.0f} MB/s")
+    print(f"  GET /media       {fmt_ms(request)}   (gzip: {fmt_ms(zipped)})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="10000,200000")
+    parser.add_argument("--reps", type=int, default=5)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.reps)
+
+
+if __name__ == "__main__":
+    main()
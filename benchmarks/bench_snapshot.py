@@ -0,0 +1,59 @@
+"""Opening the JSON store from a JSON snapshot against a binary one: startup
+time, memory held afterwards, one item lookup and one listing page.
+
+Usage: python benchmarks/bench_snapshot.py [--sizes 100000,1000000]
+"""
+import argparse
+import gc
+import os
+import tempfile
+import time
+import tracemalloc
+
+from _common import fmt_ms, make_catalog, median, time_calls
+
+from backends import JsonBackend
+
+
+def run(size: int) -> None:
+    catalog = make_catalog(size)
+    names = sorted(catalog)
+    probes = names[::max(1, size // 1000)]
+    with tempfile.TemporaryDirectory() as tmp:
+        for fmt in ("json", "binary"):
+            path = os.path.join(tmp, f"media_store.{fmt}")
+            writer = JsonBackend(path, fsync=False, snapshot_format=fmt)
+            writer.replace_all(catalog)
+            writer.close()
+            del writer
+        del catalog
+        gc.collect()
+        for fmt in ("json", "binary"):
+            path = os.path.join(tmp, f"media_store.{fmt}")
+            tracemalloc.start()
+            started = time.perf_counter()
+            backend = JsonBackend(path, fsync=False)
+            backend.version()  # the first call reads the files
+            opened = time.perf_counter() - started
+            held = tracemalloc.get_traced_memory()[0]
+            tracemalloc.stop()
+            probe = iter(probes * 100)
+            get = median(time_calls(lambda: backend.get(next(probe)), 1000))
+            page = median(time_calls(lambda: backend.page(probes[len(probes) // 2], 50), 200))
+            print(f"{size:>9} items {fmt:>6}: {os.path.getsize(path) / 1e6:6.0f} MB  open {opened:7.2f} s  "
+                  f"memory {held / 1e6:6.0f} MB  get {fmt_ms(get)}  page of 50 {fmt_ms(page)}")
+            backend.close()
+            del backend
+            gc.collect()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="100000,1000000")
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size)
+
+
+if __name__ == "__main__":
+    main()
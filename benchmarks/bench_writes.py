@@ -0,0 +1,53 @@
+"""Latency of one borrow + return: full-file rewrite vs. the JSON journal.
+
+Usage: python benchmarks/bench_writes.py [--sizes 1000,100000]
+"""
+import argparse
+import json
+import os
+import tempfile
+
+from _common import fmt_ms, make_catalog, median, time_calls
+
+from backends import JsonBackend
+
+
+def run(size: int, reps: int) -> None:
+    catalog = make_catalog(size)
+    name = next(iter(catalog))
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "media_store.json")
+
+        def rewrite():
+            # what every mutation used to cost: dump the whole catalog
+            item = catalog[name]
+            item["available"] = not item["available"]
+            with open(path, "w", encoding="utf-8") as f:
+                json.dump(catalog, f, indent=2, ensure_ascii=False)
+
+        before = median(time_calls(rewrite, reps))
+
+        backend = JsonBackend(path, compact_every=10 ** 9)
+        backend.replace_all(catalog)
+        backend.give_back(name)
+
+        def journaled():
+            backend.borrow(name, "bench", "2025-01-01 10:00:00")
+            backend.give_back(name)
+
+        after = median(time_calls(journaled, reps)) / 2
+        backend.close()
+    print(f"{size:>9} items  rewrite {fmt_ms(before)}  journal {fmt_ms(after)}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--sizes", default="1000,100000")
+    parser.add_argument("--reps", type=int, default=20)
+    args = parser.parse_args()
+    for size in (int(s) for s in args.sizes.split(",")):
+        run(size, args.reps)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Mixed read/write load from many concurrent clients, with throughput and
+p50/p95/p99 latency per route.
+
+Runs in-process through ``app.test_client()`` on a fresh synthetic catalog,
+or with ``--url`` against a running server (``serve.py``). The workload is
+seeded, so two runs with the same options send the same requests; save one
+with ``--out`` and compare a later run against it with ``--compare``.
+
+Each client keeps to its own slice of the catalog for borrows and returns,
+so writes never conflict, and gives back what it still holds at the end.
+
+Usage: python benchmarks/load_test.py [--size 10000] [--clients 16] [--requests 200]
+           [--mix list=30,search=25,get=25,category=10,borrow=10] [--backend json|sqlite]
+           [--categories 3] [--authors 12] [--skew 0] [--seed 42]
+           [--url http://127.0.0.1:5000 [--seed-server]]
+           [--out results.json] [--compare old.json]
+"""
+import argparse
+import json
+import os
+import random
+import subprocess
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List, Tuple
+from urllib.parse import quote
+
+from _common import ROOT, make_catalog
+
+DEFAULT_MIX = "list=30,search=25,get=25,category=10,borrow=10"
+PAGE = 50  # items per listing page
+
+Call = Callable[..., int]  # call(method, path, json=None, data=None) -> HTTP status
+
+
+def parse_mix(text: str) -> List[Tuple[str, float]]:
+    mix = []
+    for part in text.split(","):
+        op, _, weight = part.partition("=")
+        if op not in OPS:
+            raise SystemExit(f"Unknown operation {op!r} in --mix; expected some of {', '.join(OPS)}")
+        mix.append((op, float(weight or 1)))
+    return mix
+
+
+def in_process(backend_kind: str, tmp: str) -> Callable[[], Call]:
+    """A fresh temporary store behind the app; returns a factory of per-client callers."""
+    import storage
+    from app import app
+    from backends import create_backend
+
+    path = os.path.join(tmp, "media_store.db" if backend_kind == "sqlite" else "media_store.json")
+    storage.set_backend(create_backend(backend_kind, path))
+
+    def caller():
+        client = app.test_client()
+        return lambda method, path, json=None, data=None: client.open(path, method=method, json=json,
+                                                                      data=data).status_code
+    return caller
+
+
+def remote(url: str) -> Callable[[], Call]:
+    import requests
+
+    def caller():
+        session = requests.Session()  # per client: kept-alive connections, like a real one
+        return lambda method, path, json=None, data=None: session.request(method, url + path, json=json, data=data,
+                                                                          timeout=60).status_code
+    return caller
+
+
+def seed(call: Call, catalog: Dict[str, Dict[str, Any]]) -> None:
+    """Load ``catalog`` through the import endpoint, every item available."""
+    body = "".join(json.dumps(dict(m, available=True), ensure_ascii=False) + "\n" for m in catalog.values())
+    status = call("POST", "/media/import?replace=true", data=body.encode("utf-8"))
+    if status != 200:
+        raise SystemExit(f"Seeding failed with HTTP {status}")
+
+
+def fetch_targets(url: str) -> Tuple[List[str], List[str]]:
+    """Names of the available items and the categories, read from the target."""
+    if url:
+        import requests
+        items = requests.get(url + "/media?fields=name,category,available", timeout=300).json()
+    else:
+        from app import app
+        items = app.test_client().get("/media?fields=name,category,available").get_json()
+    names = sorted(m["name"] for m in items if m["available"])
+    categories = sorted({m["category"] for m in items})
+    return names, categories
+
+
+class Client:
+    """One simulated user: picks operations from the mix with its own RNG."""
+
+    def __init__(self, index: int, call: Call, names: List[str], mine: List[str], categories: List[str],
+                 mix: List[Tuple[str, float]], seed: int):
+        self.index, self.call = index, call
+        self.names, self.mine, self.categories = names, mine, categories
+        self.ops = [op for op, _ in mix]
+        self.cum = []
+        total = 0.0
+        for _, weight in mix:
+            total += weight
+            self.cum.append(total)
+        self.rng = random.Random(seed * 1000003 + index)
+        self.held: List[str] = []  # borrowed and not yet returned, oldest first
+        self.samples: List[Tuple[str, float, bool]] = []  # (route, seconds, failed)
+
+    def timed(self, route: str, method: str, path: str, json=None) -> None:
+        started = time.perf_counter()
+        try:
+            failed = self.call(method, path, json) >= 400
+        except Exception:
+            failed = True
+        self.samples.append((route, time.perf_counter() - started, failed))
+
+    def step(self) -> None:
+        op = self.rng.choices(self.ops, cum_weights=self.cum)[0]
+        OPS[op](self)
+
+    def give_back_all(self) -> None:
+        for name in self.held:
+            self.call("POST", f"/media/{quote(name, safe='')}/return")
+        self.held.clear()
+
+
+def op_list(c: Client) -> None:
+    offset = c.rng.randrange(max(1, len(c.names) - PAGE))
+    c.timed("list", "GET", f"/media?limit={PAGE}&offset={offset}")
+
+
+def op_search(c: Client) -> None:
+    word = c.rng.choice(c.rng.choice(c.names).split())
+    c.timed("search", "GET", f"/media/search?q={quote(word[:4].lower())}")
+
+
+def op_get(c: Client) -> None:
+    c.timed("get", "GET", f"/media/{quote(c.rng.choice(c.names), safe='')}")
+
+
+def op_category(c: Client) -> None:
+    c.timed("category", "GET", f"/media/category/{quote(c.rng.choice(c.categories), safe='')}?limit={PAGE}")
+
+
+def op_borrow(c: Client) -> None:
+    """Borrow one of the client's items, or as often return the longest held."""
+    if c.held and (c.rng.random() < 0.5 or len(c.held) == len(c.mine)):
+        name = c.held.pop(0)
+        c.timed("return", "POST", f"/media/{quote(name, safe='')}/return")
+    elif c.mine:
+        name = c.rng.choice(c.mine)
+        while name in c.held:
+            name = c.rng.choice(c.mine)
+        c.held.append(name)
+        c.timed("borrow", "POST", f"/media/{quote(name, safe='')}/borrow", {"borrower": f"client {c.index}"})
+
+
+OPS = {"list": op_list, "search": op_search, "get": op_get, "category": op_category, "borrow": op_borrow}
+
+
+def percentile(sorted_values: List[float], p: float) -> float:
+    """Nearest-rank percentile of an ascending list."""
+    rank = max(1, -(-len(sorted_values) * p // 100))
+    return sorted_values[int(rank) - 1]
+
+
+def summarize(samples: List[Tuple[str, float, bool]], seconds: float) -> Dict[str, Dict[str, float]]:
+    by_route: Dict[str, List[Tuple[float, bool]]] = {}
+    for route, took, failed in samples:
+        by_route.setdefault(route, []).append((took, failed))
+    by_route["all"] = [(took, failed) for _, took, failed in samples]
+    report = {}
+    for route, rows in sorted(by_route.items()):
+        times = sorted(t for t, _ in rows)
+        report[route] = {
+            "count": len(rows),
+            "errors": sum(1 for _, failed in rows if failed),
+            "rps": len(rows) / seconds,
+            "p50_ms": percentile(times, 50) * 1000,
+            "p95_ms": percentile(times, 95) * 1000,
+            "p99_ms": percentile(times, 99) * 1000,
+        }
+    return report
+
+
+def git_commit() -> str:
+    try:
+        head = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True,
+                              text=True, check=True).stdout.strip()
+        dirty = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=ROOT,
+                               capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+    return head + ("-dirty" if dirty else "")
+
+
+def run(args: argparse.Namespace, tmp: str) -> Dict[str, Any]:
+    mix = parse_mix(args.mix)
+    make_call = remote(args.url.rstrip("/")) if args.url else in_process(args.backend, tmp)
+    if not args.url or args.seed_server:
+        catalog = make_catalog(args.size, args.seed, args.categories, args.authors, args.skew)
+        seed(make_call(), catalog)
+        del catalog
+    names, categories = fetch_targets(args.url.rstrip("/"))
+    if not names:
+        raise SystemExit("The catalog has no available items to work on")
+
+    clients = [Client(i, make_call(), names, names[i::args.clients], categories, mix, args.seed)
+               for i in range(args.clients)]
+    start = threading.Barrier(args.clients + 1)
+
+    def work(client):
+        start.wait()
+        for _ in range(args.requests):
+            client.step()
+
+    threads = [threading.Thread(target=work, args=(c,)) for c in clients]
+    for t in threads:
+        t.start()
+    start.wait()
+    started = time.perf_counter()
+    for t in threads:
+        t.join()
+    seconds = time.perf_counter() - started
+    for c in clients:
+        c.give_back_all()
+
+    config = {k: v for k, v in vars(args).items() if k not in ("out", "compare")}
+    if args.url:
+        config.pop("backend")
+    return {"commit": git_commit(), "time": time.strftime("%Y-%m-%dT%H:%M:%S"), "config": config,
+            "seconds": seconds, "routes": summarize([s for c in clients for s in c.samples], seconds)}
+
+
+def print_report(result: Dict[str, Any]) -> None:
+    cfg = result["config"]
+    target = cfg.get("url") or f"in-process {cfg['backend']}"
+    print(f"{target}: {cfg['clients']} clients x {cfg['requests']} requests, mix {cfg['mix']} "
+          f"({result['seconds']:.1f}s, commit {result['commit']})")
+    print(f"{'route':<10} {'count':>7} {'errors':>6} {'req/s':>9} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, r in result["routes"].items():
+        print(f"{route:<10} {r['count']:>7} {r['errors']:>6} {r['rps']:>9.0f} "
+              f"{r['p50_ms']:>8.2f} {r['p95_ms']:>8.2f} {r['p99_ms']:>8.2f}")
+
+
+def print_comparison(old: Dict[str, Any], new: Dict[str, Any]) -> None:
+    """Ratios new/old: above 1 is faster for req/s, slower for latencies."""
+    print(f"\nagainst {old['commit']} ({old['time']}), new/old:")
+    print(f"{'route':<10} {'req/s':>8} {'p50':>8} {'p95':>8} {'p99':>8}")
+    for route, r in new["routes"].items():
+        before = old["routes"].get(route)
+        if before is None:
+            continue
+        ratios = [r[k] / before[k] if before[k] else float("nan") for k in ("rps", "p50_ms", "p95_ms", "p99_ms")]
+        print(f"{route:<10} " + " ".join(f"{x:>7.2f}x" for x in ratios))
+    changed = {k for k in new["config"] if old["config"].get(k) != new["config"][k]}
+    if changed:
+        print(f"(options differ: {', '.join(sorted(changed))})")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--size", type=int, default=10000, help="items in the synthetic catalog")
+    parser.add_argument("--categories", type=int, default=3)
+    parser.add_argument("--authors", type=int, default=12)
+    parser.add_argument("--skew", type=float, default=0.0, help="Zipf exponent for categories and authors")
+    parser.add_argument("--clients", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="per client")
+    parser.add_argument("--mix", default=DEFAULT_MIX)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--backend", choices=("json", "sqlite"), default="json")
+    parser.add_argument("--url", default="", help="a running server instead of the in-process app")
+    parser.add_argument("--seed-server", action="store_true",
+                        help="import the synthetic catalog into the server at --url first")
+    parser.add_argument("--out", help="write the results to this JSON file")
+    parser.add_argument("--compare", help="a results file from an earlier run")
+    args = parser.parse_args()
+    parse_mix(args.mix)  # fail early on a typo
+
+    with tempfile.TemporaryDirectory() as tmp:
+        result = run(args, tmp)
+    print_report(result)
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            print_comparison(json.load(f), result)
+    if args.out:
+        with open(args.out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
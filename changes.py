@@ -0,0 +1,169 @@
+"""Recent catalog changes, so clients can sync by delta instead of refetching,
+and live fan-out of new ones as server-sent events."""
+import json
+import threading
+from collections import deque
+from typing import Any, Callable, Dict, Iterator, Optional
+
+RING_SIZE = 10000  # changes kept; a client further behind has to reload
+
+
+class ChangeFeed:
+    """Bounded ring of the latest changes, fed by ``StorageBackend.subscribe``.
+
+    Each entry is ``(version, op, name, item)``. Everything after
+    ``_floor`` is in the ring; asking for changes since an older version
+    (evicted, or from before the feed started listening) or across a
+    catalog reset gets ``None`` and the client reloads.
+    """
+
+    def __init__(self, version: int, size: int = RING_SIZE):
+        self._ring: deque = deque()
+        self._size = size
+        self._floor = version  # changes up to here are not in the ring
+        self._last = version  # version of the newest change seen
+        self._lock = threading.Lock()
+
+    def on_change(self, op: str, name: Optional[str], item: Optional[Dict[str, Any]], version: int = 0) -> None:
+        """Backend listener: remember the change."""
+        with self._lock:
+            if op != "reset" and version <= self._last:
+                return  # already counted when the feed started
+            if op == "reset" or version != self._last + 1:
+                # a replaced catalog, or changes we never heard about (another
+                # process writing the same store): no delta can cover them
+                self._ring.clear()
+                self._floor = version - (op != "reset")
+            if op != "reset":
+                if len(self._ring) == self._size:
+                    self._floor = self._ring.popleft()[0]
+                self._ring.append((version, op, name, item))
+            self._last = version
+
+    def since(self, version: int) -> Optional[Dict[str, Any]]:
+        """Net changes after ``version``, or None if they are no longer known.
+
+        ``{"version": v, "upserts": [item, ...], "deletes": [name, ...]}``,
+        where ``v`` is the version the result brings the client up to. An
+        item changed several times is reported once, as it is now.
+        """
+        with self._lock:
+            if not self._floor <= version <= self._last:
+                return None
+            latest: Dict[str, Optional[Dict[str, Any]]] = {}
+            for v, op, name, item in reversed(self._ring):  # newest first: stop at `version`
+                if v <= version:
+                    break
+                if name not in latest:
+                    latest[name] = item if op == "put" else None
+            last = self._last
+        upserts = [item for item in reversed(latest.values()) if item is not None]
+        deletes = [name for name, item in latest.items() if item is None]
+        return {"version": last, "upserts": upserts, "deletes": deletes}
+
+
+KEEPALIVE = ": keepalive\n\n"  # SSE comment; lets a server notice a closed connection
+
+
+def format_event(event: str, data: Dict[str, Any], event_id: Optional[str] = None) -> str:
+    """One server-sent event."""
+    head = f"id: {event_id}\n" if event_id else ""
+    return f"{head}event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+
+class Subscription:
+    """One live listener's queue of formatted events.
+
+    At most ``size`` events wait; a subscriber that falls further behind is
+    dropped (its stream ends with a ``resync`` event) rather than holding
+    memory or slowing the writers down.
+    """
+
+    def __init__(self, size: int):
+        self.size = size
+        self.after = 0  # skip queued events up to this version (already sent)
+        self.dropped = False
+        self._queue: deque = deque()
+        self._cond = threading.Condition()
+
+    def push(self, version: int, message: str) -> bool:
+        """Queue ``message``; False if the subscriber is too far behind."""
+        with self._cond:
+            if len(self._queue) >= self.size:
+                self.dropped = True
+            else:
+                self._queue.append((version, message))
+            self._cond.notify()
+            return not self.dropped
+
+    def messages(self, keepalive: float, poll: Optional[float] = None,
+                 idle: Optional[Callable[[], None]] = None) -> Iterator[str]:
+        """Yield queued events as they arrive; a keepalive after ``keepalive`` idle seconds.
+
+        With ``idle``, it is called after every ``poll`` seconds without
+        events (to pick up changes made by other processes, which may queue
+        some).
+        """
+        quiet = 0.0
+        while True:
+            with self._cond:
+                if not self._queue and not self.dropped:
+                    self._cond.wait(poll or keepalive)
+                batch = list(self._queue)
+                self._queue.clear()
+                dropped = self.dropped
+            chunk = "".join(message for version, message in batch if version > self.after)
+            if not chunk and not dropped:
+                quiet += poll or keepalive
+                if idle is not None:
+                    idle()
+                if quiet < keepalive:
+                    continue
+                chunk = KEEPALIVE
+            quiet = 0.0
+            yield chunk
+            if dropped:
+                yield format_event("resync", {"reason": "slow consumer"})
+                return
+
+
+class EventHub:
+    """Fans catalog changes out to :class:`Subscription` queues.
+
+    Registered with ``StorageBackend.subscribe``; each change is formatted
+    once (an event in the shape of a :class:`ChangeFeed` delta) and the same
+    string is queued for every subscriber.
+    """
+
+    def __init__(self, epoch: str):
+        self.epoch = epoch
+        self._subscribers: set = set()
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._subscribers)
+
+    def subscribe(self, size: int) -> Subscription:
+        sub = Subscription(size)
+        with self._lock:
+            self._subscribers.add(sub)
+        return sub
+
+    def unsubscribe(self, sub: Subscription) -> None:
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def on_change(self, op: str, name: Optional[str], item: Optional[Dict[str, Any]], version: int = 0) -> None:
+        """Backend listener: queue the change for every subscriber."""
+        if not self._subscribers:
+            return
+        if op == "reset":
+            message = format_event("resync", {"reason": "catalog replaced"}, f"{self.epoch}-{version}")
+        else:
+            data = {"upserts": [item], "deletes": []} if op == "put" else {"upserts": [], "deletes": [name]}
+            message = format_event("change", data, f"{self.epoch}-{version}")
+        with self._lock:
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            if not sub.push(version, message):
+                self.unsubscribe(sub)
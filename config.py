@@ -0,0 +1,56 @@
+"""Runtime settings for the backend, read from the environment."""
+import os
+
+# Which storage engine the API uses: "json" (media_store.json) or "sqlite".
+STORAGE_BACKEND = os.environ.get("PUSTAKLOK_BACKEND", "json").lower()
+
+# Relative paths are taken from this folder, not from wherever the server
+# was started, so every worker (and every way of starting it) uses one store.
+HERE = os.path.dirname(os.path.abspath(__file__))
+DATA_FILE = os.path.join(HERE, os.environ.get("PUSTAKLOK_DATA_FILE", "media_store.json"))
+SQLITE_FILE = os.path.join(HERE, os.environ.get("PUSTAKLOK_SQLITE_FILE", "media_store.db"))
+
+# serve.py and gunicorn.conf.py: address to listen on and number of worker
+# processes (0: one per CPU); under gunicorn, request threads per worker.
+HOST = os.environ.get("PUSTAKLOK_HOST", "127.0.0.1")
+PORT = int(os.environ.get("PUSTAKLOK_PORT", "5000"))
+WORKERS = int(os.environ.get("PUSTAKLOK_WORKERS", "0")) or os.cpu_count() or 1
+THREADS = int(os.environ.get("PUSTAKLOK_THREADS", "8"))
+
+# JSON backend: mutations go to a journal that is folded into the snapshot
+# every JOURNAL_COMPACT_EVERY records. JOURNAL_FSYNC=0 trades durability on
+# power loss for lower write latency.
+JOURNAL_COMPACT_EVERY = int(os.environ.get("PUSTAKLOK_JOURNAL_COMPACT_EVERY", "10000"))
+JOURNAL_FSYNC = os.environ.get("PUSTAKLOK_JOURNAL_FSYNC", "1") != "0"
+
+# JSON backend: format compaction writes the snapshot in, "json" or "binary"
+# (mapped, not parsed, on startup; see backends/snapshot.py). Unset keeps
+# whichever the file has. Either format is read.
+SNAPSHOT_FORMAT = os.environ.get("PUSTAKLOK_SNAPSHOT_FORMAT", "").lower() or None
+
+# Group commit (JSON backend, with fsync): concurrent writes are journaled
+# together, one fsync per group of up to GROUP_COMMIT_MAX batches. The writer
+# waits GROUP_COMMIT_MS after the first one for more to join; 0 groups only
+# what queued up during the previous fsync. GROUP_COMMIT=0 fsyncs each write.
+GROUP_COMMIT = os.environ.get("PUSTAKLOK_GROUP_COMMIT", "1") != "0"
+GROUP_COMMIT_MS = float(os.environ.get("PUSTAKLOK_GROUP_COMMIT_MS", "0"))
+GROUP_COMMIT_MAX = int(os.environ.get("PUSTAKLOK_GROUP_COMMIT_MAX", "256"))
+
+# Loans are due this many days after the item is borrowed (see GET /loans/overdue).
+LOAN_DAYS = int(os.environ.get("PUSTAKLOK_LOAN_DAYS", "14"))
+
+# Listing responses are built from each item's cached JSON encoding; 0 turns
+# the cache off (it costs roughly the size of the JSON catalog in memory).
+RESPONSE_CACHE = os.environ.get("PUSTAKLOK_RESPONSE_CACHE", "1") != "0"
+
+# Responses of at least COMPRESS_MIN_BYTES are gzipped for clients that send
+# Accept-Encoding: gzip; COMPRESS_MIN_BYTES=0 compresses everything, a huge
+# value nothing. COMPRESS_LEVEL is zlib's 1 (fast) .. 9 (small); on catalog
+# JSON level 1 already gets ~9x and is 2-3x faster than the usual 5-6.
+COMPRESS_MIN_BYTES = int(os.environ.get("PUSTAKLOK_COMPRESS_MIN_BYTES", "1024"))
+COMPRESS_LEVEL = int(os.environ.get("PUSTAKLOK_COMPRESS_LEVEL", "1"))
+
+# Per-request profiling: PROFILE_RATE of the requests (0.01 = one in a
+# hundred; 0 = off) run under cProfile and leave a .prof file in PROFILE_DIR.
+PROFILE_RATE = float(os.environ.get("PUSTAKLOK_PROFILE_RATE", "0"))
+PROFILE_DIR = os.path.join(HERE, os.environ.get("PUSTAKLOK_PROFILE_DIR", "profiles"))
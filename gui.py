@@ -1,8 +1,411 @@
+import json
+import queue
+import sys
+import threading
+import time
 import tkinter as tk
+from bisect import bisect_left
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 from tkinter import ttk, messagebox, simpledialog, font
+from urllib.parse import quote
 import requests
+from requests.adapters import HTTPAdapter
+
+from words import fold, tokenize
 
 API_BASE = "http://127.0.0.1:5000"
+PAGE_SIZE = 500  # rows per request as a listing scrolls into view
+PAGE_CACHE = 40  # listing pages kept in memory (least recently used dropped first)
+OVERSCAN = 5  # rows rendered and prefetched past the bottom of the list
+SEARCH_LIMIT = 50
+TYPEAHEAD_MS = 150  # pause in typing before the search box filters the list
+LIVE_POLL_MS = 250  # how often the Tk loop picks up live events
+LIVE_RETRY = 5  # seconds before reconnecting a dropped event stream
+HTTP_WORKERS = 4  # threads (and kept-alive connections) for API calls
+HTTP_POLL_MS = 15  # how often the Tk loop picks up finished calls while any are running
+
+def iter_sse(lines):
+    """``(event, data, id)`` for each server-sent event in ``lines``."""
+    event, data, event_id = "message", [], None
+    for line in lines:
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data)), event_id
+            event, data = "message", []
+        elif line.startswith(":"):
+            continue  # comment / keepalive
+        else:
+            field, _, value = line.partition(":")
+            value = value[1:] if value.startswith(" ") else value
+            if field == "event":
+                event = value
+            elif field == "data":
+                data.append(value)
+            elif field == "id":
+                event_id = value
+
+class Call:
+    """One request submitted to :class:`RequestRunner`."""
+
+    def __init__(self, fn, on_done, on_error):
+        self.fn = fn
+        self.callbacks = [(on_done, on_error)]
+        self.cancelled = threading.Event()
+        self.future = None
+
+    def cancel(self):
+        self.cancelled.set()
+        if self.future is not None:
+            self.future.cancel()
+
+class RequestRunner:
+    """Runs HTTP calls off the Tk thread.
+
+    Calls share one ``requests.Session`` (kept-alive connections instead of
+    a new TCP connection per click) and run on a small thread pool. Results
+    come back through a queue that the Tk loop drains with ``root.after``,
+    so callbacks may touch widgets.
+
+    Every call has a key. A new call with the key of one still running
+    cancels it (a new search supersedes the old one), or with
+    ``coalesce=True`` joins it instead (two quick Refresh clicks make one
+    request).
+    """
+
+    def __init__(self, root, workers=HTTP_WORKERS):
+        self.root = root
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="gui-http")
+        self._calls = {}  # key -> Call in flight
+        self._done = queue.Queue()  # (callback, args) to run on the Tk thread
+        self._polling = False
+
+    def submit(self, key, fn, on_done, on_error=None, coalesce=False):
+        """Run ``fn(session, call)`` on the pool, then ``on_done(result)``
+        (or ``on_error(exception)``) on the Tk thread."""
+        current = self._calls.get(key)
+        if current is not None:
+            if coalesce:
+                current.callbacks.append((on_done, on_error))
+                return current
+            current.cancel()
+        call = self._calls[key] = Call(fn, on_done, on_error)
+        call.future = self._pool.submit(self._run, key, call)
+        self._poll()
+        return call
+
+    def post(self, callback, *args):
+        """Run ``callback(*args)`` on the Tk thread; callable from any thread."""
+        self._done.put((callback, args))
+
+    def busy(self, key):
+        """Whether a call with ``key`` is in flight."""
+        return key in self._calls
+
+    def cancel(self, key):
+        call = self._calls.pop(key, None)
+        if call is not None:
+            call.cancel()
+
+    def _run(self, key, call):
+        if call.cancelled.is_set():
+            return
+        try:
+            result, error = call.fn(self.session, call), None
+        except Exception as e:
+            result, error = None, e
+        self._done.put((self._finish, (key, call, result, error)))
+
+    def _finish(self, key, call, result, error):
+        if self._calls.get(key) is call:
+            del self._calls[key]
+        if call.cancelled.is_set():
+            return
+        for on_done, on_error in call.callbacks:
+            if error is None:
+                on_done(result)
+            elif on_error is not None:
+                on_error(error)
+
+    def _poll(self):
+        if not self._polling:
+            self._polling = True
+            self.root.after(HTTP_POLL_MS, self._deliver)
+
+    def _deliver(self):
+        self._polling = False
+        self._drain()
+        if self._calls or not self._done.empty():
+            self._poll()
+
+    def _drain(self):
+        while True:
+            try:
+                callback, args = self._done.get_nowait()
+            except queue.Empty:
+                return
+            callback(*args)
+
+    def wait(self, timeout=5):
+        """Block until the calls in flight finish and run their callbacks now
+        (for tests and shutdown; the Tk loop does this by itself)."""
+        deadline = time.monotonic() + timeout
+        while self._calls and time.monotonic() < deadline:
+            wait_futures([c.future for c in self._calls.values()], timeout=deadline - time.monotonic())
+            self._drain()
+        self._drain()
+
+    def close(self):
+        for key in list(self._calls):
+            self.cancel(key)
+        self._pool.shutdown(wait=False, cancel_futures=True)
+        self.session.close()
+
+class RowSource:
+    """List rows held in memory: search results, or a listing from a server
+    without paging."""
+
+    def __init__(self, items):
+        self.rows = list(items)
+
+    @property
+    def count(self):
+        return len(self.rows)
+
+    def item(self, i):
+        return self.rows[i]
+
+    def apply(self, upserts, deletes, in_view):
+        """Apply a delta. ``in_view(item)`` says whether an item belongs in the
+        list; with None only the rows already there are updated."""
+        gone, changed = set(deletes), {m.get("name"): m for m in upserts}
+        rows = []
+        for m in self.rows:
+            name = m.get("name")
+            if name in gone:
+                continue
+            m = changed.pop(name, m)
+            if in_view is None or in_view(m):
+                rows.append(m)
+        if in_view is not None:
+            rows.extend(m for m in changed.values() if in_view(m))
+        self.rows = rows
+
+class PagedSource:
+    """Rows of a server listing, fetched a page at a time as they scroll into view.
+
+    Pages live in ``cache``, an LRU shared by all listings: ``(path, page
+    number) -> [etag, items, total]``. A source only trusts the pages it
+    fetched or revalidated itself (``loaded``); ``item()`` returns None for
+    a row whose page isn't loaded and calls ``fetch(path, page)`` for it.
+    """
+
+    def __init__(self, path, count, cache, fetch):
+        self.path = path
+        self.count = count
+        self.cache = cache
+        self.fetch = fetch
+        self.loaded = set()
+
+    def _page(self, k):
+        entry = self.cache.get((self.path, k)) if k in self.loaded else None
+        if entry is None:
+            return None
+        self.cache.move_to_end((self.path, k))
+        return entry[1]
+
+    def item(self, i):
+        k, j = divmod(i, PAGE_SIZE)
+        items = self._page(k)
+        if items is not None and j < len(items):
+            return items[j]
+        self.fetch(self.path, k)
+        return None
+
+    def store(self, k, entry):
+        """Keep a page fetched from the server."""
+        etag, items, total = entry
+        self.cache[(self.path, k)] = entry
+        self.cache.move_to_end((self.path, k))
+        self.loaded.add(k)
+        # a short page is the last one, whatever the total said
+        self.count = total if len(items) == PAGE_SIZE else min(total, k * PAGE_SIZE + len(items))
+        while len(self.cache) > PAGE_CACHE:
+            (path, old), _ = self.cache.popitem(last=False)
+            if path == self.path:
+                self.loaded.discard(old)
+
+    def _loaded_pages(self):
+        for k in sorted(self.loaded):
+            entry = self.cache.get((self.path, k))
+            if entry is not None:
+                yield k, entry[1]
+
+    def _shift_after(self, name):
+        """Forget pages past ``name``: a row added or removed there moves them."""
+        for k, items in list(self._loaded_pages()):
+            if items and items[0].get("name", "") > name:
+                self.loaded.discard(k)
+
+    def apply(self, upserts, deletes, in_view):
+        """Apply a delta to the loaded pages.
+
+        An item changed in place is updated where it is; a row added to or
+        removed from a loaded page is applied there, and the pages after it
+        are dropped (their rows moved) to be fetched again when shown.
+        """
+        for name in deletes:
+            self._remove(name)
+        for item in upserts:
+            name = item.get("name", "")
+            keep = in_view(item)
+            for k, items in self._loaded_pages():
+                if not items or items[-1].get("name", "") < name:
+                    continue  # belongs after this page
+                i = bisect_left([m.get("name", "") for m in items], name)
+                if i < len(items) and items[i].get("name") == name:
+                    if keep:
+                        items[i] = item
+                    else:
+                        self._remove(name)
+                elif keep and (i > 0 or k == 0):
+                    items.insert(i, item)
+                    self.count += 1
+                    self._shift_after(name)
+                elif keep:
+                    self._shift_after(name)  # between pages: somewhere not loaded
+                break
+            else:
+                if keep:
+                    self._shift_after(name)
+
+    def _remove(self, name):
+        for k, items in self._loaded_pages():
+            for i, m in enumerate(items):
+                if m.get("name") == name:
+                    del items[i]
+                    self.count -= 1
+                    self._shift_after(name)
+                    return
+        self._shift_after(name)
+
+class PrefixTrie:
+    """Folded words -> names of the items containing them, looked up by prefix.
+
+    Every node keeps the names of all words passing through it, so a
+    prefix lookup is one walk down the trie, however many words it covers.
+    """
+
+    def __init__(self):
+        self.root = {}  # char -> child node; a node's names are under None
+
+    def add(self, words, name):
+        for word in words:
+            node = self.root
+            for ch in word:
+                node = node.setdefault(ch, {})
+                node.setdefault(None, set()).add(name)
+
+    def discard(self, words, name):
+        """Forget ``name``; ``words`` must be all the words it was added with."""
+        for word in words:
+            node = self.root
+            for ch in word:
+                child = node.get(ch)
+                if child is None:
+                    break
+                child[None].discard(name)
+                if not child[None]:
+                    del node[ch]  # nothing left below either
+                    break
+                node = child
+
+    def find(self, prefix):
+        node = self.root
+        for ch in prefix:
+            node = node.get(ch)
+            if node is None:
+                return set()
+        return node.get(None, set())
+
+class LocalCatalog:
+    """The whole catalog, kept on the client so the category filter and the
+    search box work without a round-trip.
+
+    Only ``complete`` once a full listing has been loaded (a server that
+    pages a big catalog never sends one); until then callers ask the
+    server. Deltas keep it current like the shown list.
+    """
+
+    def __init__(self):
+        self.clear()
+
+    def clear(self):
+        self.complete = False
+        self.items = {}  # name -> item
+        self.titles = PrefixTrie()
+        self.authors = PrefixTrie()
+        self.categories = {}  # lower(category) -> names
+
+    def load(self, items):
+        self.clear()
+        for item in items:
+            self._add(item)
+        self.complete = True
+
+    def _add(self, item):
+        name = item.get("name")
+        self._remove(name)
+        self.items[name] = item
+        self.titles.add(set(tokenize(name)), name)
+        self.authors.add(set(tokenize(item.get("author"))), name)
+        self.categories.setdefault(str(item.get("category", "")).lower(), set()).add(name)
+
+    def _remove(self, name):
+        item = self.items.pop(name, None)
+        if item is None:
+            return
+        self.titles.discard(set(tokenize(name)), name)
+        self.authors.discard(set(tokenize(item.get("author"))), name)
+        key = str(item.get("category", "")).lower()
+        self.categories[key].discard(name)
+        if not self.categories[key]:
+            del self.categories[key]
+
+    def apply(self, upserts, deletes):
+        if not self.complete:
+            return
+        for name in deletes:
+            self._remove(name)
+        for item in upserts:
+            self._add(item)
+
+    def _sorted(self, names):
+        return [self.items[n] for n in sorted(names)]
+
+    def all(self):
+        return self._sorted(self.items)
+
+    def category(self, category):
+        """Items in ``category`` (case-insensitive), by name."""
+        return self._sorted(self.categories.get(category.lower(), ()))
+
+    def search(self, query):
+        """Items matching ``query`` the way /media/search ranks them: titles
+        starting with the query, then titles with every query word as a word
+        prefix, then items matching every word in the title or author."""
+        terms = tokenize(query)
+        if not terms:
+            return []
+        in_title = set.intersection(*(self.titles.find(t) for t in terms))
+        anywhere = set.intersection(*(self.titles.find(t) | self.authors.find(t) for t in terms))
+        folded = " ".join(fold(query).split())
+        first = {n for n in in_title if fold(n).startswith(folded)}
+        return self._sorted(first) + self._sorted(in_title - first) + self._sorted(anywhere - in_title)
 
 class LibraryGUI:
     def __init__(self, root):
@@ -10,6 +413,18 @@ class LibraryGUI:
         root.title("📚 Pustaklok")
         root.geometry("1000x750")
         root.minsize(800, 600)
+        self.runner = RequestRunner(root)
+        root.protocol("WM_DELETE_WINDOW", self.close)
+        self.page_cache = OrderedDict()  # see PagedSource
+        self.source = RowSource([])  # the rows of the list; only a window of them is in the Listbox
+        self.first = 0  # row shown at the top of the Listbox
+        self.visible = 18  # rows the Listbox has room for
+        self.selected = None  # selected row
+        self.row_items = []  # item record of each Listbox row (None: not loaded yet)
+        self.view = None  # "all", ("category", name) or "search"
+        self.sync_version = None  # catalog version the list is current to
+        self.local = LocalCatalog()
+        self._typeahead = None  # pending filter after a keystroke
         
         # Configure colors - Modern dark theme
         self.bg_color = "#0f0f1e"
@@ -80,7 +495,7 @@ class LibraryGUI:
         ttk.Button(btn_container, text="🔄 Load All", command=self.load_all, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_container, text="➕ Add Item", command=self.create_new, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_container, text="🗑️  Remove", command=self.delete_selected, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
-        ttk.Button(btn_container, text="🔄 Refresh", command=self.load_all, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
+        ttk.Button(btn_container, text="🔄 Refresh", command=self.refresh, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_container, text="📤 Borrow", command=self.borrow_item, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
         ttk.Button(btn_container, text="📥 Return", command=self.return_item, style='Accent.TButton').pack(side=tk.LEFT, padx=5)
         
@@ -106,6 +521,7 @@ class LibraryGUI:
         search_entry = ttk.Entry(search_frame, textvariable=self.search_var, width=20)
         search_entry.pack(side=tk.LEFT, padx=(0, 8))
         search_entry.bind('<Return>', lambda e: self.search_name())
+        self.search_var.trace_add("write", self._on_search_typed)
         
         ttk.Button(search_frame, text="🔍 Search", command=self.search_name).pack(side=tk.LEFT)
         
@@ -123,8 +539,9 @@ class LibraryGUI:
         results_frame = ttk.Frame(content_frame)
         results_frame.pack(fill=tk.BOTH, expand=True, pady=(0, 15))
         
-        scrollbar = ttk.Scrollbar(results_frame)
-        scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
+        # the Listbox only holds the rows on screen; the scrollbar spans the whole source
+        self.scrollbar = ttk.Scrollbar(results_frame, command=self._on_scrollbar)
+        self.scrollbar.pack(side=tk.RIGHT, fill=tk.Y)
         
         self.listbox = tk.Listbox(results_frame, 
                                   width=120, 
@@ -132,14 +549,22 @@ class LibraryGUI:
                                   bg=self.list_bg,
                                   fg=self.text_color,
                                   font=('Consolas', 10),
-                                  yscrollcommand=scrollbar.set,
                                   activestyle='none',
                                   selectmode=tk.SINGLE,
                                   highlightthickness=0,
                                   relief=tk.FLAT,
                                   borderwidth=0)
         self.listbox.pack(fill=tk.BOTH, expand=True)
-        scrollbar.config(command=self.listbox.yview)
+        self.row_height = font.Font(font=self.listbox.cget("font")).metrics("linespace") + 1
+        self.listbox.bind("<Configure>", self._on_resize)
+        self.listbox.bind("<<ListboxSelect>>", self._on_select)
+        self.listbox.bind("<MouseWheel>", self._on_wheel)
+        self.listbox.bind("<Button-4>", self._on_wheel)
+        self.listbox.bind("<Button-5>", self._on_wheel)
+        self.listbox.bind("<Up>", lambda e: self._move_selection(-1))
+        self.listbox.bind("<Down>", lambda e: self._move_selection(1))
+        self.listbox.bind("<Prior>", lambda e: self._move_selection(-self.visible))
+        self.listbox.bind("<Next>", lambda e: self._move_selection(self.visible))
         self.listbox.bind("<Double-Button-1>", self.show_metadata)
         self.listbox.bind("<Delete>", lambda e: self.delete_selected())
         
@@ -153,89 +578,336 @@ class LibraryGUI:
         self.info_label = ttk.Label(status_frame, text="", foreground=self.accent_color, font=('Segoe UI', 9))
         self.info_label.pack(side=tk.RIGHT)
     
+    def close(self):
+        self.runner.close()
+        self.root.destroy()
+
     def setup_bindings(self):
         """Setup keyboard shortcuts"""
         self.root.bind('<Control-l>', lambda e: self.load_all())
         self.root.bind('<Control-n>', lambda e: self.create_new())
         self.root.bind('<Control-f>', lambda e: self.search_var.focus())
 
-    def load_all(self):
-        try:
-            self.status_label.config(text="🔄 Loading all items...")
-            self.root.update()
-            r = requests.get(f"{API_BASE}/media", timeout=3)
-            r.raise_for_status()
-            items = r.json()
-            self.populate_list(items)
-            count = len(items)
-            self.status_label.config(text=f"🟢 Ready", foreground=self.success_color)
-            self.count_label.config(text=f"Total: {count} items")
-        except Exception as e:
+    def _get_page(self, session, path, k, entry):
+        """GET page ``k`` of a listing (worker thread); ``(entry, paged)``.
+
+        ``entry`` is the page's cache entry, if any, looked up on the Tk
+        thread: only that thread touches the cache. It is revalidated with
+        its ETag and reused on 304. ``paged`` is False for a server that
+        ignores paging and sends the whole listing as a plain array.
+        """
+        headers = {"If-None-Match": entry[0]} if entry and entry[0] else {}
+        r = session.get(f"{API_BASE}{path}", params={"offset": k * PAGE_SIZE, "limit": PAGE_SIZE},
+                        headers=headers, timeout=3)
+        if r.status_code == 304 and entry:
+            return entry, True
+        r.raise_for_status()
+        page = r.json()
+        if isinstance(page, list):
+            return [None, page, len(page)], False
+        return [r.headers.get("ETag"), page["items"], page["total"]], True
+
+    def fetch_page(self, path, k):
+        """Load a page of the current listing in the background, then redraw."""
+        key = ("page", path, k)
+        if self.runner.busy(key):
+            return
+
+        def done(result):
+            entry, _ = result
+            if isinstance(self.source, PagedSource) and self.source.path == path:
+                self.source.store(k, entry)
+                self.render_rows()
+
+        def failed(e):
+            self.status_label.config(text="🔴 Error loading items", foreground=self.error_color)
+            self.info_label.config(text=f"Connection failed: {str(e)[:50]}")
+
+        entry = self.page_cache.get((path, k))
+        self.runner.submit(key, lambda session, call: self._get_page(session, path, k, entry), done, failed)
+
+    def _load_listing(self, path, view, loaded_text, error_title):
+        """Open ``path`` as ``view``: fetch its first page and the row count;
+        the rest is fetched as it scrolls into view."""
+        def done(result):
+            entry, paged = result
+            etag, items, total = entry
+            self.sync_version = etag.removeprefix("W/").strip('"') if etag else None
+            self.view = view
+            if view == "all":
+                if len(items) >= total:
+                    self.local.load(items)  # the whole catalog: filter it here from now on
+                else:
+                    self.local.clear()
+            if paged:
+                source = PagedSource(path, total, self.page_cache, self.fetch_page)
+                source.store(0, entry)
+                self.show_source(source)
+            else:
+                self.populate_list(items)
+            self.status_label.config(text="🟢 Ready", foreground=self.success_color)
+            self.count_label.config(text=loaded_text(self.source.count))
+
+        def failed(e):
             self.status_label.config(text="🔴 Error loading items", foreground=self.error_color)
             self.info_label.config(text=f"Connection failed: {str(e)[:50]}")
-            messagebox.showerror("Connection Error", f"Could not connect to server:\n{e}")
+            messagebox.showerror(error_title, f"Could not load items:\n{e}")
+
+        # one key for every way of filling the list: the latest request wins
+        entry = self.page_cache.get((path, 0))
+        self.runner.submit("view", lambda session, call: self._get_page(session, path, 0, entry), done, failed)
+
+    def load_all(self):
+        self.status_label.config(text="🔄 Loading all items...")
+        self._load_listing("/media", "all", lambda n: f"Total: {n} items", "Connection Error")
+
+    def load_categories(self):
+        """Fill the category filter from the server's per-category counts."""
+        def fetch(session, call):
+            r = session.get(f"{API_BASE}/media/category", timeout=3)
+            r.raise_for_status()
+            return r.json()
+
+        def done(counts):
+            categories = [c["category"] for c in counts if isinstance(c, dict) and c.get("category")]
+            if categories:
+                self.category_combo.config(values=categories)
+
+        # on error keep the built-in Book/Film/Magazine list
+        self.runner.submit("categories", fetch, done, coalesce=True)
 
     def load_category(self):
         cat = self.category_var.get().strip()
         if not cat:
             messagebox.showwarning("Warning","Please select a category first")
             return
-        try:
-            self.status_label.config(text=f"🔄 Loading {cat}...")
-            self.root.update()
-            r = requests.get(f"{API_BASE}/media/category/{cat}", timeout=3)
-            r.raise_for_status()
-            items = r.json()
-            self.populate_list(items)
-            count = len(items)
-            self.status_label.config(text=f"🟢 Ready", foreground=self.success_color)
-            self.count_label.config(text=f"Filtered: {count} items in {cat}")
-        except Exception as e:
-            self.status_label.config(text="🔴 Filter error", foreground=self.error_color)
-            messagebox.showerror("Error", f"Could not load category: {e}")
+        if self.local.complete:
+            self.view = ("category", cat)
+            self.populate_list(self.local.category(cat))
+            self.status_label.config(text="🟢 Ready", foreground=self.success_color)
+            self.count_label.config(text=f"Filtered: {self.source.count} items in {cat}")
+            return
+        self.status_label.config(text=f"🔄 Loading {cat}...")
+        self._load_listing(f"/media/category/{quote(cat, safe='')}", ("category", cat),
+                           lambda n: f"Filtered: {n} items in {cat}", "Error")
 
     def search_name(self):
         name = self.search_var.get().strip()
         if not name:
             messagebox.showwarning("Warning","Enter a title to search")
             return
-        try:
-            self.status_label.config(text=f"🔄 Searching for '{name}'...")
-            self.root.update()
-            r = requests.get(f"{API_BASE}/media/search", params={"name":name}, timeout=3)
+
+        def fetch(session, call):
+            r = session.get(f"{API_BASE}/media/search", params={"q":name, "limit":SEARCH_LIMIT}, timeout=3)
             if r.status_code == 404:
+                return []
+            r.raise_for_status()
+            return r.json()
+
+        def done(items):
+            self.view = "search"
+            if not items:
                 self.status_label.config(text="🟡 Not found", foreground=self.accent_color)
                 self.count_label.config(text="0 results")
+                self.source, self.first, self.selected = RowSource([]), 0, None
+                self.row_items = [None]
                 self.listbox.delete(0, tk.END)
                 self.listbox.insert(tk.END, f"  No items found matching: '{name}'")
                 return
-            r.raise_for_status()
-            item = r.json()
-            self.populate_list([item])
+            self.populate_list(items)
             self.status_label.config(text="🟢 Ready", foreground=self.success_color)
-            self.count_label.config(text="1 result found")
-        except Exception as e:
+            self.count_label.config(text=f"{len(items)} result{'s' if len(items) != 1 else ''} found")
+
+        def failed(e):
             self.status_label.config(text="🔴 Search error", foreground=self.error_color)
             messagebox.showerror("Error", f"Search failed: {e}")
 
+        if self.local.complete:
+            return done(self.local.search(name))
+        self.status_label.config(text=f"🔄 Searching for '{name}'...")
+        self.runner.submit("view", fetch, done, failed)
+
+    def _on_search_typed(self, *args):
+        if self._typeahead is not None:
+            self.root.after_cancel(self._typeahead)
+        self._typeahead = self.root.after(TYPEAHEAD_MS, self._run_typeahead)
+
+    def _run_typeahead(self):
+        """Narrow the list to what is typed so far; the server is only asked
+        when the catalog isn't all here."""
+        self._typeahead = None
+        if self.search_var.get().strip():
+            self.search_name()
+        elif self.view == "search" and self.local.complete:
+            self.view = "all"
+            self.populate_list(self.local.all())
+            self.status_label.config(text="🟢 Ready", foreground=self.success_color)
+            self.count_label.config(text=f"Total: {self.source.count} items")
+
+    def start_live_updates(self):
+        """Follow /media/stream in a background thread so rows change as other desks act.
+
+        The thread only reads the network and queues events; the Tk loop
+        applies them (Tk must only be touched from its own thread).
+        """
+        self._events = queue.Queue()
+        threading.Thread(target=self._listen, daemon=True).start()
+        self.root.after(LIVE_POLL_MS, self._drain_events)
+
+    def _listen(self):
+        last_id = None
+        while True:
+            # resume after the last event, or after the version the list was loaded at
+            since = last_id or self.sync_version
+            try:
+                headers = {"Last-Event-ID": since} if since else {}
+                with requests.get(f"{API_BASE}/media/stream", headers=headers, stream=True, timeout=(3, 60)) as r:
+                    r.raise_for_status()
+                    for event, data, event_id in iter_sse(r.iter_lines(decode_unicode=True)):
+                        last_id = event_id or last_id
+                        self._events.put((event, data, event_id))
+            except Exception:
+                pass
+            time.sleep(LIVE_RETRY)
+
+    def _drain_events(self):
+        try:
+            while True:
+                event, data, event_id = self._events.get_nowait()
+                if event == "resync":
+                    if self.view is not None:
+                        self.reload_view()
+                elif event == "change":
+                    self.apply_changes(data.get("upserts", []), data.get("deletes", []))
+                    if event_id:
+                        self.sync_version = event_id
+        except queue.Empty:
+            pass
+        self.root.after(LIVE_POLL_MS, self._drain_events)
+
+    def refresh(self):
+        """Bring the shown list up to date by fetching only what changed."""
+        if self.view is None or not self.sync_version:
+            return self.reload_view()
+        since = self.sync_version
+
+        def fetch(session, call):
+            r = session.get(f"{API_BASE}/media/changes", params={"since": since}, timeout=3)
+            r.raise_for_status()
+            return r.json()
+
+        def done(delta):
+            if delta.get("resync"):
+                return self.reload_view()
+            self.apply_changes(delta.get("upserts", []), delta.get("deletes", []))
+            self.sync_version = delta.get("version")
+            self.status_label.config(text="🟢 Ready", foreground=self.success_color)
+
+        self.runner.submit("refresh", fetch, done, lambda e: self.reload_view(), coalesce=True)
+
+    def reload_view(self):
+        self.local.clear()  # out of date too; the next full listing rebuilds it
+        if isinstance(self.view, tuple):
+            self.category_var.set(self.view[1])
+            self.load_category()
+        elif self.view == "search":
+            self.search_name()
+        else:
+            self.load_all()
+
+    def _in_view(self, item):
+        if self.view == "all":
+            return True
+        if isinstance(self.view, tuple):
+            return str(item.get("category", "")).lower() == self.view[1].lower()
+        return False  # search results: only update the rows already shown
+
+    def apply_changes(self, upserts, deletes):
+        """Apply a delta from /media/changes (or the event stream) to the list."""
+        self.local.apply(upserts, deletes)
+        self.source.apply(upserts, deletes, None if self.view == "search" else self._in_view)
+        self.render_rows()
+        if self.view == "all":
+            self.count_label.config(text=f"Total: {self.source.count} items")
+
     def populate_list(self, items):
+        self.show_source(RowSource(items))
+
+    def show_source(self, source):
+        self.source, self.first, self.selected = source, 0, None
+        self.render_rows()
+
+    def render_rows(self):
+        """Put the rows from ``self.first`` down (plus OVERSCAN) into the Listbox."""
+        count = self.source.count
+        self.first = max(0, min(self.first, count - self.visible))
         self.listbox.delete(0, tk.END)
-        if not items:
+        if not count:
+            self.row_items = [None]
             self.listbox.insert(tk.END, "  ℹ️  No results found. Try another search or load all items.")
+            self.scrollbar.set(0, 1)
             return
-        for idx, it in enumerate(items, 1):
-            name = it.get('name', 'N/A')
-            category = it.get('category', 'N/A')
-            author = it.get('author', 'N/A')
-            date = it.get('publication_date', 'N/A')
-            available = it.get('available', True)
-            borrowed_by = it.get('borrowed_by')
-            
-            # Color-coded by category
-            emoji = self._get_category_emoji(category)
-            status = "✓ Available" if available else f"✗ Borrowed by {borrowed_by}"
-            display = f"{idx:3d}. {emoji} {name[:28]:<28} • {author[:18]:<18} • {date} [{status}]"
-            self.listbox.insert(tk.END, display)
+        end = min(count, self.first + self.visible + OVERSCAN)
+        self.row_items = [self.source.item(i) for i in range(self.first, end)]
+        rows = [self._row_text(i, item) if item is not None else f"{i:3d}.  … loading"
+                for i, item in enumerate(self.row_items, self.first + 1)]
+        self.listbox.insert(tk.END, *rows)
+        if self.selected is not None and self.first <= self.selected < end:
+            self.listbox.selection_set(self.selected - self.first)
+        self.scrollbar.set(self.first / count, min(1.0, (self.first + self.visible) / count))
+
+    def scroll_to(self, first):
+        first = max(0, min(first, self.source.count - self.visible))
+        if first != self.first:
+            self.first = first
+            self.render_rows()
+
+    def _on_scrollbar(self, action, amount, unit=None):
+        if action == "moveto":
+            self.scroll_to(int(float(amount) * self.source.count))
+        else:
+            self.scroll_to(self.first + int(amount) * (self.visible if unit == "pages" else 1))
+
+    def _on_wheel(self, event):
+        up = event.num == 4 or getattr(event, "delta", 0) > 0
+        self.scroll_to(self.first + (-3 if up else 3))
+        return "break"
+
+    def _on_resize(self, event):
+        visible = max(1, event.height // self.row_height)
+        if visible != self.visible:
+            self.visible = visible
+            self.render_rows()
+
+    def _on_select(self, event=None):
+        sel = self.listbox.curselection()
+        if sel:
+            self.selected = self.first + sel[0]
+
+    def _move_selection(self, delta):
+        count = self.source.count
+        if count:
+            row = 0 if self.selected is None else max(0, min(count - 1, self.selected + delta))
+            self.selected = row
+            if row < self.first:
+                self.first = row
+            elif row >= self.first + self.visible:
+                self.first = row - self.visible + 1
+            self.render_rows()
+        return "break"
+
+    def _row_text(self, idx, it):
+        name = it.get('name', 'N/A')
+        category = it.get('category', 'N/A')
+        author = it.get('author', 'N/A')
+        date = it.get('publication_date', 'N/A')
+        available = it.get('available', True)
+        borrowed_by = it.get('borrowed_by')
+
+        # Color-coded by category
+        emoji = self._get_category_emoji(category)
+        status = "✓ Available" if available else f"✗ Borrowed by {borrowed_by}"
+        return f"{idx:3d}. {emoji} {name[:28]:<28} • {author[:18]:<18} • {date} [{status}]"
     
     def _get_category_emoji(self, category):
         """Return emoji based on category"""
@@ -284,57 +956,54 @@ class LibraryGUI:
                 return
 
             payload = {"name": name, "author": author, "publication_date": pub, "category": cat}
-            try:
-                self.status_label.config(text="🔄 Creating item...")
-                self.root.update()
-                r = requests.post(f"{API_BASE}/media", json=payload, timeout=3)
+
+            def done(r):
                 if r.status_code == 201:
                     messagebox.showinfo("✓ Success", f"Item '{name}' added to library!")
                     dialog.destroy()
-                    self.load_all()
+                    self.refresh()
+                    self.load_categories()
                 else:
                     messagebox.showerror("Error", f"Could not create item:\n{r.text}")
                     self.status_label.config(text="🔴 Creation failed", foreground=self.error_color)
-            except Exception as e:
+
+            def failed(e):
                 messagebox.showerror("Error", f"Failed to create item:\n{e}")
                 self.status_label.config(text="🔴 Creation failed", foreground=self.error_color)
 
+            self.status_label.config(text="🔄 Creating item...")
+            self.runner.submit(("create", name), lambda session, call: session.post(f"{API_BASE}/media", json=payload, timeout=3),
+                               done, failed)
+
         ttk.Button(btn_frame, text="✅ Save", command=save, style='Accent.TButton').pack(side=tk.LEFT, padx=6)
         ttk.Button(btn_frame, text="❌ Cancel", command=dialog.destroy).pack(side=tk.LEFT)
 
-    def get_selected_name(self):
+    def get_selected_item(self):
+        """The record of the selected row, or None (nothing selected, or not loaded yet)."""
         sel = self.listbox.curselection()
-        if not sel:
+        if not sel or sel[0] >= len(self.row_items):
             return None
-        text = self.listbox.get(sel[0])
-        # Extract name from format: "idx. emoji name • author • date [status]"
-        # Split by " • " to get parts
-        parts = text.split(" • ")
-        if len(parts) > 0:
-            first_part = parts[0]  # Contains "idx. emoji name"
-            # Remove leading numbers, dots, spaces, and emoji
-            name_start = 0
-            for i, char in enumerate(first_part):
-                if char.isalpha():  # First alphabetic character marks start of name
-                    name_start = i
-                    break
-            return first_part[name_start:].strip()
-        return None
+        return self.row_items[sel[0]]
+
+    def get_selected_name(self):
+        item = self.get_selected_item()
+        return item.get("name") if item else None
+
+    def _item_url(self, item):
+        """API URL of an item: by id, which survives renames and needs no escaping."""
+        if item.get("id") is not None:
+            return f"{API_BASE}/media/id/{item['id']}"
+        return f"{API_BASE}/media/{quote(item['name'], safe='')}"  # a server without ids
 
     def show_metadata(self, event=None):
-        name = self.get_selected_name()
-        if not name:
+        # the row's record is current (deltas keep it so); no need to ask the server
+        item = self.get_selected_item()
+        if not item:
             return
-        try:
-            r = requests.get(f"{API_BASE}/media/{name}", timeout=3)
-            if r.status_code == 404:
-                messagebox.showinfo("Not found", "No metadata found for this item")
-                return
-            r.raise_for_status()
-            item = r.json()
-            
-            # Format detailed info
-            info_text = f"""
+        name = item.get('name', 'N/A')
+
+        # Format detailed info
+        info_text = f"""
 ╔══════════════════════════════════════╗
 ║          ITEM DETAILS                ║
 ╚══════════════════════════════════════╝
@@ -343,17 +1012,15 @@ Title:             {item.get('name', 'N/A')}
 Author:            {item.get('author', 'N/A')}
 Category:          {item.get('category', 'N/A')}
 Publication Date:  {item.get('publication_date', 'N/A')}
-            """
-            
-            messagebox.showinfo(f"📋 Details: {name}", info_text)
-            self.status_label.config(text=f"🟢 Ready", foreground=self.success_color)
-            self.info_label.config(text=f"Viewing: {name}")
-        except Exception as e:
-            self.status_label.config(text="🔴 Error fetching metadata", foreground=self.error_color)
-            messagebox.showerror("Error", f"Could not fetch metadata: {e}")
+        """
+
+        messagebox.showinfo(f"📋 Details: {name}", info_text)
+        self.status_label.config(text=f"🟢 Ready", foreground=self.success_color)
+        self.info_label.config(text=f"Viewing: {name}")
 
     def delete_selected(self):
-        name = self.get_selected_name()
+        item = self.get_selected_item()
+        name = item and item.get("name")
         if not name:
             messagebox.showwarning("Warning","Select an item to delete")
             return
@@ -361,87 +1028,93 @@ Publication Date:  {item.get('publication_date', 'N/A')}
         if not messagebox.askyesno("⚠️ Confirm Delete", f"Are you sure you want to delete:\n\n'{name}'?\n\nThis cannot be undone."):
             return
         
-        try:
-            self.status_label.config(text="🔄 Deleting item...")
-            self.root.update()
-            r = requests.delete(f"{API_BASE}/media/{name}", timeout=3)
+        def done(r):
             if r.status_code == 200:
                 self.status_label.config(text="🟢 Ready", foreground=self.success_color)
                 messagebox.showinfo("✓ Deleted",f"Item '{name}' has been removed")
-                self.load_all()
+                self.refresh()
             else:
                 self.status_label.config(text="🔴 Delete error", foreground=self.error_color)
                 messagebox.showerror("Error", f"Could not delete: {r.text}")
-        except Exception as e:
+
+        def failed(e):
             self.status_label.config(text="🔴 Error deleting", foreground=self.error_color)
             messagebox.showerror("Error", f"Delete failed: {e}")
 
+        self.status_label.config(text="🔄 Deleting item...")
+        url = self._item_url(item)
+        self.runner.submit(("delete", name), lambda session, call: session.delete(url, timeout=3), done, failed)
+
     def borrow_item(self):
         """Borrow a selected item."""
-        name = self.get_selected_name()
+        item = self.get_selected_item()
+        name = item and item.get("name")
         if not name:
             messagebox.showwarning("Warning", "Select an item to borrow")
             return
         
-        name = name.strip()  # Ensure no trailing spaces
-        
         borrower = simpledialog.askstring("👤 Borrow Item", f"Who is borrowing '{name}'?\n\nEnter name:")
         if not borrower:
             return
         
         borrower = borrower.strip()
         
-        try:
-            self.status_label.config(text="🔄 Borrowing item...")
-            self.root.update()
-            payload = {"borrower": borrower}
-            # URL encode the name to handle special characters
-            from urllib.parse import quote
-            encoded_name = quote(name, safe='')
-            r = requests.post(f"{API_BASE}/media/{encoded_name}/borrow", json=payload, timeout=3)
+        payload = {"borrower": borrower}
+        url = self._item_url(item)
+
+        def done(r):
             if r.status_code == 200:
                 self.status_label.config(text="🟢 Ready", foreground=self.success_color)
                 messagebox.showinfo("✓ Borrowed", f"'{name}' borrowed by {borrower}")
-                self.load_all()
+                self.refresh()
             else:
                 self.status_label.config(text="🔴 Borrow error", foreground=self.error_color)
                 error_msg = r.json().get("error", r.text) if r.status_code != 500 else r.text
                 messagebox.showerror("Error", f"Could not borrow: {error_msg}")
-        except Exception as e:
+
+        def failed(e):
             self.status_label.config(text="🔴 Error borrowing", foreground=self.error_color)
             messagebox.showerror("Error", f"Borrow failed: {str(e)}")
 
+        self.status_label.config(text="🔄 Borrowing item...")
+        self.runner.submit(("borrow", name), lambda session, call: session.post(
+            f"{url}/borrow", json=payload, timeout=3), done, failed)
+
     def return_item(self):
         """Return a borrowed item."""
-        name = self.get_selected_name()
+        item = self.get_selected_item()
+        name = item and item.get("name")
         if not name:
             messagebox.showwarning("Warning", "Select an item to return")
             return
         
-        name = name.strip()  # Ensure no trailing spaces
-        
         if not messagebox.askyesno("📥 Return Item", f"Return '{name}' to the library?"):
             return
         
-        try:
-            self.status_label.config(text="🔄 Returning item...")
-            self.root.update()
-            from urllib.parse import quote
-            encoded_name = quote(name, safe='')
-            r = requests.post(f"{API_BASE}/media/{encoded_name}/return", timeout=3)
+        url = self._item_url(item)
+
+        def done(r):
             if r.status_code == 200:
                 self.status_label.config(text="🟢 Ready", foreground=self.success_color)
                 messagebox.showinfo("✓ Returned", f"'{name}' has been returned")
-                self.load_all()
+                self.refresh()
             else:
                 self.status_label.config(text="🔴 Return error", foreground=self.error_color)
                 error_msg = r.json().get("error", r.text) if r.status_code != 500 else r.text
                 messagebox.showerror("Error", f"Could not return: {error_msg}")
-        except Exception as e:
+
+        def failed(e):
             self.status_label.config(text="🔴 Error returning", foreground=self.error_color)
             messagebox.showerror("Error", f"Return failed: {str(e)}")
 
+        self.status_label.config(text="🔄 Returning item...")
+        self.runner.submit(("return", name), lambda session, call: session.post(
+            f"{url}/return", timeout=3), done, failed)
+
 if __name__ == "__main__":
     root = tk.Tk()
     app = LibraryGUI(root)
+    app.load_categories()
+    if "--live" in sys.argv:
+        app.start_live_updates()
     root.mainloop()
@@ -0,0 +1,40 @@
+"""Production serving: the API under gunicorn.
+
+    pip install gunicorn
+    PUSTAKLOK_WORKERS=4 PUSTAKLOK_HOST=0.0.0.0 gunicorn app:app
+
+gunicorn reads this file from the current directory (or pass ``-c
+gunicorn.conf.py``). Bind address and worker count come from the same
+settings as ``serve.py``; each worker runs ``PUSTAKLOK_THREADS`` request
+threads. The hooks do per worker what ``serve.py`` does: the worker opens
+its own store files, reports its metrics to a directory the others read,
+and builds its search index in the background.
+"""
+import shutil
+import tempfile
+
+import config
+
+bind = f"{config.HOST}:{config.PORT}"
+workers = config.WORKERS
+worker_class = "gthread"
+threads = config.THREADS
+timeout = 30
+graceful_timeout = 30
+keepalive = 5
+preload_app = True  # load the code once, before forking
+
+_metrics_dir = tempfile.mkdtemp(prefix="pustaklok-metrics-")
+
+
+def post_fork(server, worker):
+    import metrics
+    import storage
+    # files, locks and threads of an engine opened before the fork are not this worker's
+    storage.set_backend(None)
+    metrics.REGISTRY.share(_metrics_dir)  # so /metrics on any worker covers all of them
+    storage.start_search_index()
+
+
+def on_exit(server):
+    shutil.rmtree(_metrics_dir, ignore_errors=True)
@@ -0,0 +1,122 @@
+"""Loan history: every borrow and return in an append-only JSON-lines ledger,
+indexed for the overdue report and per-borrower lookups."""
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+from backends.journal import FileLock, Journal
+from backends.sorted_index import SortedKeys
+
+DAY = 86400
+
+
+class LoanLedger:
+    """Loans kept in ``path``, one record per line, never rewritten.
+
+    ``{"op": "out", "loan": n, "item": id, "name": ..., "borrower": ...,
+    "at": t, "due": t}`` opens loan ``n`` and ``{"op": "in", "loan": n,
+    "at": t}`` closes it. Times are whole seconds since the epoch.
+
+    Open loans are also kept as ``(due, loan)`` in a :class:`SortedKeys`,
+    so the overdue ones are its first keys: the report costs
+    O(log n + k) for k overdue loans. Each borrower's loans are listed in
+    the order they were made.
+
+    Like the JSON store, the ledger may be shared by several processes:
+    appends hold a :class:`FileLock`, and every call first reads what
+    others appended.
+    """
+
+    def __init__(self, path: str, fsync: bool = True):
+        self.path = path
+        self.journal = Journal(path, fsync=fsync)
+        self._lock = FileLock(path + ".lock")
+        self._loans: List[Dict[str, Any]] = []  # loan n is _loans[n - 1]
+        self._open: Dict[int, int] = {}  # item id -> its open loan
+        self._due = SortedKeys()  # (due, loan) of every open loan
+        self._by_borrower: Dict[str, List[int]] = {}
+
+    def _refresh(self) -> None:
+        """Apply what was appended since we last looked. Caller holds the lock."""
+        if self.journal.size() > self.journal.offset:
+            records, _ = self.journal.read_from(self.journal.offset)
+            self._apply(records)
+
+    def _apply(self, records: Iterable[Dict[str, Any]]) -> None:
+        for rec in records:
+            if rec["op"] == "out":
+                loan = {"loan": rec["loan"], "item_id": rec["item"], "name": rec["name"], "borrower": rec["borrower"],
+                        "borrowed_at": rec["at"], "due_at": rec["due"], "returned_at": None}
+                self._loans.append(loan)
+                self._open[rec["item"]] = rec["loan"]
+                self._due.add((rec["due"], rec["loan"]))
+                self._by_borrower.setdefault(rec["borrower"], []).append(rec["loan"])
+            else:
+                loan = self._loans[rec["loan"] - 1]
+                loan["returned_at"] = rec["at"]
+                self._due.discard((loan["due_at"], loan["loan"]))
+                if self._open.get(loan["item_id"]) == loan["loan"]:
+                    del self._open[loan["item_id"]]
+
+    def _close_records(self, item_ids: Iterable[int], at: int) -> List[Dict[str, Any]]:
+        records, seen = [], set()
+        for item_id in item_ids:
+            loan = self._open.get(item_id)
+            if loan is not None and loan not in seen:
+                seen.add(loan)
+                records.append({"op": "in", "loan": loan, "at": at})
+        return records
+
+    def lend(self, loans: List[Tuple[Dict[str, Any], str]], at: int, days: int) -> None:
+        """Open a loan for each ``(item, borrower)``, due ``days`` after ``at``."""
+        with self._lock:
+            self._refresh()
+            # an item still on loan here was returned without the ledger hearing of it
+            records = self._close_records((item["id"] for item, _ in loans), at)
+            for n, (item, borrower) in enumerate(loans, len(self._loans) + 1):
+                records.append({"op": "out", "loan": n, "item": item["id"], "name": item["name"],
+                                "borrower": borrower, "at": at, "due": at + days * DAY})
+            self.journal.append(records)
+            self._apply(records)
+
+    def give_back(self, item_ids: List[int], at: int) -> None:
+        """Close the open loans of ``item_ids`` (returned, or deleted while out)."""
+        with self._lock:
+            self._refresh()
+            records = self._close_records(item_ids, at)
+            if records:
+                self.journal.append(records)
+                self._apply(records)
+
+    def settle(self, items: Iterable[Dict[str, Any]], at: int) -> None:
+        """Close the open loans not matched by an item of ``items`` (the whole
+        catalog, after it was replaced) that is out to the same borrower."""
+        out = {item["id"]: item.get("borrowed_by") for item in items if not item.get("available", True)}
+        with self._lock:
+            self._refresh()
+            ended = [item_id for item_id, n in self._open.items()
+                     if item_id not in out or out[item_id] != self._loans[n - 1]["borrower"]]
+            records = self._close_records(ended, at)
+            if records:
+                self.journal.append(records)
+                self._apply(records)
+
+    def overdue(self, now: int, limit: Optional[int] = None) -> List[Dict[str, Any]]:
+        """Open loans due before ``now``, the longest overdue first."""
+        with self._lock:
+            self._refresh()
+            found = []
+            for due, n in self._due.iter_after(None):
+                if due >= now or len(found) == limit:
+                    break
+                found.append(dict(self._loans[n - 1]))
+        return found
+
+    def for_borrower(self, borrower: str, open_only: bool = False) -> List[Dict[str, Any]]:
+        """``borrower``'s loans, the latest first."""
+        with self._lock:
+            self._refresh()
+            loans = (self._loans[n - 1] for n in reversed(self._by_borrower.get(borrower, ())))
+            return [dict(loan) for loan in loans if not open_only or loan["returned_at"] is None]
+
+    def close(self) -> None:
+        self.journal.close()
+        self._lock.close()
@@ -0,0 +1,216 @@
+"""Request and storage metrics in the Prometheus text format, and sampled
+per-request profiling.
+
+Counters and histograms live in :data:`REGISTRY`, one per process. Under
+``serve.py`` every worker also writes its numbers to a shared folder
+(:meth:`Registry.share`), so ``GET /metrics`` on any worker adds up all of
+them.
+"""
+import bisect
+import cProfile
+import functools
+import json
+import logging
+import os
+import random
+import re
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+import config
+
+log = logging.getLogger(__name__)
+
+# seconds; the upper bounds of the histogram buckets (+Inf is implied)
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SHARE_EVERY = 5.0  # seconds between a worker's writes to the shared folder
+
+Key = Tuple[str, Tuple[Tuple[str, str], ...]]  # (metric name, ((label, value), ...))
+
+
+class Registry:
+    """Counters and histograms by name and labels.
+
+    A histogram is kept as ``[count per bucket..., +Inf count, sum]``, not
+    cumulative; :meth:`render` adds the buckets up.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._kinds: Dict[str, Tuple[str, str]] = {}  # name -> (type, help)
+        self._counters: Dict[Key, float] = {}
+        self._histograms: Dict[Key, List[float]] = {}
+        self._share_dir: Optional[str] = None
+
+    def describe(self, name: str, kind: str, help: str) -> None:
+        self._kinds[name] = (kind, help)
+
+    def inc(self, name: str, amount: float = 1, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+
+    def observe(self, name: str, seconds: float, **labels: str) -> None:
+        key = (name, tuple(sorted(labels.items())))
+        slot = bisect.bisect_left(BUCKETS, seconds)
+        with self._lock:
+            hist = self._histograms.get(key)
+            if hist is None:
+                hist = self._histograms[key] = [0] * (len(BUCKETS) + 2)
+            hist[slot] += 1
+            hist[-1] += seconds
+
+    def snapshot(self) -> Dict[str, Any]:
+        """The numbers so far, as plain JSON-able data."""
+        with self._lock:
+            return {"counters": [[n, [list(l) for l in labels], v] for (n, labels), v in self._counters.items()],
+                    "histograms": [[n, [list(l) for l in labels], list(h)] for (n, labels), h in self._histograms.items()]}
+
+    def share(self, directory: str) -> None:
+        """Write :meth:`snapshot` to ``directory/<pid>.json`` every SHARE_EVERY
+        seconds, and count the other files there in :meth:`render`."""
+        self._share_dir = directory
+        thread = threading.Thread(target=self._share_loop, name="metrics-share", daemon=True)
+        thread.start()
+
+    def _share_loop(self) -> None:
+        path = os.path.join(self._share_dir, f"{os.getpid()}.json")
+        while True:
+            time.sleep(SHARE_EVERY)
+            try:
+                with open(path + ".tmp", "w", encoding="utf-8") as f:
+                    json.dump(self.snapshot(), f)
+                os.replace(path + ".tmp", path)
+            except OSError as e:
+                log.warning("Can't share metrics in %s: %s", self._share_dir, e)
+
+    def _peer_snapshots(self) -> Iterator[Dict[str, Any]]:
+        if self._share_dir is None:
+            return
+        own = f"{os.getpid()}.json"
+        for entry in os.listdir(self._share_dir):
+            if entry.endswith(".json") and entry != own:  # our own numbers are read live
+                try:
+                    with open(os.path.join(self._share_dir, entry), encoding="utf-8") as f:
+                        yield json.load(f)
+                except (OSError, ValueError):
+                    continue  # a worker that is just starting
+
+    def render(self) -> str:
+        """Everything in the Prometheus text exposition format."""
+        counters: Dict[Key, float] = {}
+        histograms: Dict[Key, List[float]] = {}
+        for snap in [self.snapshot(), *self._peer_snapshots()]:
+            for name, labels, value in snap["counters"]:
+                key = (name, tuple(map(tuple, labels)))
+                counters[key] = counters.get(key, 0) + value
+            for name, labels, hist in snap["histograms"]:
+                key = (name, tuple(map(tuple, labels)))
+                total = histograms.setdefault(key, [0] * len(hist))
+                for i, v in enumerate(hist):
+                    total[i] += v
+        lines = []
+        for name in sorted({n for n, _ in counters} | {n for n, _ in histograms}):
+            kind, help = self._kinds.get(name, ("untyped", ""))
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for (n, labels), value in sorted(counters.items()):
+                if n == name:
+                    lines.append(f"{name}{_labels(labels)} {_number(value)}")
+            for (n, labels), hist in sorted(histograms.items()):
+                if n != name:
+                    continue
+                running = 0
+                for bound, count in zip(BUCKETS + (float("inf"),), hist[:-1]):
+                    running += count
+                    le = "+Inf" if bound == float("inf") else repr(bound)
+                    lines.append(f"{name}_bucket{_labels(labels + (('le', le),))} {_number(running)}")
+                lines.append(f"{name}_sum{_labels(labels)} {hist[-1]!r}")
+                lines.append(f"{name}_count{_labels(labels)} {_number(running)}")
+        return "\n".join(lines) + "\n"
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(labels: Tuple[Tuple[str, str], ...]) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(str(v))}"' for k, v in labels) + "}"
+
+
+def _number(value: float) -> str:
+    return str(int(value)) if float(value).is_integer() else repr(value)
+
+
+REGISTRY = Registry()
+REGISTRY.describe("pustaklok_requests_total", "counter", "HTTP requests by route, method and status.")
+REGISTRY.describe("pustaklok_request_errors_total", "counter", "HTTP requests answered with a 5xx status.")
+REGISTRY.describe("pustaklok_request_seconds", "histogram",
+                  "Time from receiving a request to its response headers, by route.")
+REGISTRY.describe("pustaklok_storage_seconds", "histogram", "Time spent in storage operations, by operation.")
+
+
+def record_request(method: str, route: str, status: int, seconds: float) -> None:
+    REGISTRY.inc("pustaklok_requests_total", method=method, route=route, status=str(status))
+    REGISTRY.observe("pustaklok_request_seconds", seconds, method=method, route=route)
+    if status >= 500:
+        REGISTRY.inc("pustaklok_request_errors_total", method=method, route=route)
+
+
+@contextmanager
+def storage_timer(op: str) -> Iterator[None]:
+    """Time the block as storage operation ``op``."""
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        REGISTRY.observe("pustaklok_storage_seconds", time.perf_counter() - started, op=op)
+
+
+def timed(op: str) -> Callable[[Callable], Callable]:
+    """Decorator: time every call as storage operation ``op``."""
+    def wrap(fn):
+        @functools.wraps(fn)
+        def timed_call(*args, **kwargs):
+            with storage_timer(op):
+                return fn(*args, **kwargs)
+        return timed_call
+    return wrap
+
+
+# cProfile can't profile two requests of one process at once (3.12 refuses a
+# second active profiler), so a sampled request that finds it busy goes unprofiled
+_profiling = threading.Lock()
+
+
+def start_profile() -> Optional[cProfile.Profile]:
+    """A running profiler for this request, for PROFILE_RATE of the requests."""
+    if config.PROFILE_RATE <= 0 or random.random() >= config.PROFILE_RATE:
+        return None
+    if not _profiling.acquire(blocking=False):
+        return None
+    profile = cProfile.Profile()
+    try:
+        profile.enable()
+    except ValueError:  # another profiler (a debugger, say) is active
+        _profiling.release()
+        return None
+    return profile
+
+
+def stop_profile(profile: cProfile.Profile, label: str) -> str:
+    """Stop ``profile`` and write its stats to PROFILE_DIR; returns the file.
+
+    Read one with ``python -m pstats <file>`` (or snakeviz).
+    """
+    profile.disable()
+    _profiling.release()
+    os.makedirs(config.PROFILE_DIR, exist_ok=True)
+    safe = re.sub(r"\W+", "_", label).strip("_")
+    path = os.path.join(config.PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{os.getpid()}-{safe}.prof")
+    profile.dump_stats(path)
+    return path
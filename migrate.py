@@ -0,0 +1,49 @@
+"""One-shot copy of a JSON catalog into an SQLite database, or into a
+snapshot of the other format.
+
+Usage: python migrate.py [media_store.json] [media_store.db]
+Then start the backend with PUSTAKLOK_BACKEND=sqlite.
+
+       python migrate.py --to binary [media_store.json] [media_store.snap]
+Then start the backend with PUSTAKLOK_DATA_FILE=media_store.snap. A binary
+snapshot converts back with ``--to json``.
+"""
+import argparse
+import os
+
+import config
+from backends import JsonBackend, SqliteBackend, migrate
+
+
+def _default_target(source: str, to: str) -> str:
+    if to == "sqlite":
+        return config.SQLITE_FILE
+    return os.path.splitext(source)[0] + (".snap" if to == "binary" else ".json")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Copy media_store.json into an SQLite database or a binary snapshot.")
+    parser.add_argument("source", nargs="?", default=config.DATA_FILE,
+                        help="catalog to read (a JSON or binary snapshot and its journal)")
+    parser.add_argument("target", nargs="?", help="SQLite database or snapshot to (re)fill")
+    parser.add_argument("--to", choices=("sqlite", "binary", "json"), default="sqlite",
+                        help="what to write (default: sqlite)")
+    args = parser.parse_args()
+    target_path = args.target or _default_target(args.source, args.to)
+    if os.path.abspath(target_path) == os.path.abspath(args.source):
+        parser.error("the target is the source; name another file")
+    if args.to == "sqlite":
+        target = SqliteBackend(target_path)
+    else:
+        target = JsonBackend(target_path, snapshot_format=args.to)
+    source = JsonBackend(args.source)
+    try:
+        count = migrate(source, target)
+    finally:
+        source.close()
+        target.close()
+    print(f"Migrated {count} items from {args.source} to {target_path}")
+
+
+if __name__ == "__main__":
+    main()
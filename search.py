@@ -0,0 +1,267 @@
+"""In-process full-text and prefix search over item names and authors."""
+import gc
+import logging
+import threading
+from collections import defaultdict
+from heapq import merge
+from itertools import takewhile
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from backends.sorted_index import SortedKeys
+from words import fold, split, tokenize
+
+log = logging.getLogger(__name__)
+
+FIELDS = ("name", "author")
+
+
+class _Reset:
+    pass
+
+
+class SearchIndex:
+    """Inverted index from folded words to the names of the items containing them.
+
+    Each field keeps its own postings (word -> sorted names) and a sorted
+    vocabulary, so the words starting with a prefix are one contiguous run
+    and every posting list can be read in name order. Results come in tiers:
+
+    1. titles that start with the whole query ("the sil" -> "The Silent Sea"),
+    2. titles containing every query word as a word prefix,
+    3. items matching every query word in the title or the author.
+
+    Within a tier results are in name order, and each tier is read lazily,
+    so a query stops as soon as ``limit`` results are found instead of
+    scoring every candidate.
+
+    The index follows the catalog through :meth:`on_change`, registered with
+    ``StorageBackend.subscribe``. It is built by :meth:`ensure_built`, or
+    kept built on a background thread by :meth:`keep_built`; until then
+    :func:`scan` gives the same answers by looking at every item.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._build_lock = threading.Lock()
+        self._built = False
+        self._pending: Optional[Any] = None  # changes seen while a build is loading
+        self._build: Optional[Callable[[], None]] = None  # see keep_built
+        self._builder: Optional[threading.Thread] = None
+        self._resets = 0
+        self._clear()
+
+    def _clear(self) -> None:
+        self._docs: Dict[str, Tuple[Tuple[str, ...], Tuple[str, ...]]] = {}
+        self._postings: Dict[str, Dict[str, SortedKeys]] = {f: {} for f in FIELDS}
+        self._vocab: Dict[str, SortedKeys] = {f: SortedKeys() for f in FIELDS}
+        self._titles = SortedKeys()  # (folded name, name)
+
+    @property
+    def built(self) -> bool:
+        return self._built
+
+    def ensure_built(self, load: Callable[[], Iterable[Dict[str, Any]]]) -> None:
+        """Build the index from ``load()`` unless it is already up to date."""
+        with self._build_lock:
+            while not self._built:
+                with self._lock:
+                    self._pending = []
+                # load without holding _lock: the backend may call on_change meanwhile
+                items = load()
+                with self._lock:
+                    pending, self._pending = self._pending, None
+                    if isinstance(pending, _Reset):
+                        continue
+                    # millions of small tuples and lists: skip the collector's
+                    # repeated passes over them while they are being created
+                    gc_was_enabled = gc.isenabled()
+                    gc.disable()
+                    try:
+                        self._bulk_load(items)
+                    finally:
+                        if gc_was_enabled:
+                            gc.enable()
+                    for op, name, item in pending:
+                        self._apply(op, name, item)
+                    self._built = True
+
+    def keep_built(self, build: Callable[[], None]) -> None:
+        """Run ``build`` (which calls :meth:`ensure_built`) on a daemon thread
+        now and again after every reset, so queries never wait for a build."""
+        with self._lock:
+            self._build = build
+            self._start_build()
+
+    def _start_build(self) -> None:
+        """Caller holds ``_lock``."""
+        if self._build is None or self._built or self._builder is not None:
+            return
+        self._builder = threading.Thread(target=self._run_build, name="search-index", daemon=True)
+        self._builder.start()
+
+    def _run_build(self) -> None:
+        resets, ok = self._resets, False
+        try:
+            self._build()
+            ok = True
+        except Exception:
+            log.exception("Building the search index failed; searches scan the catalog")
+        finally:
+            with self._lock:
+                self._builder = None
+                if ok and self._resets != resets:
+                    self._start_build()  # reset while this build ran
+
+    def _bulk_load(self, items: Iterable[Dict[str, Any]]) -> None:
+        self._clear()
+        postings = {f: defaultdict(list) for f in FIELDS}
+        titles = []
+        # in name order, so every posting list comes out sorted without a sort each
+        docs = self._docs
+        name_postings, author_postings = postings["name"], postings["author"]
+        for item in sorted(items, key=lambda m: m["name"]):
+            name = item["name"]
+            title = fold(name)
+            doc = docs[name] = (tuple(split(title)), tuple(tokenize(item.get("author"))))
+            for token in set(doc[0]):
+                name_postings[token].append(name)
+            for token in set(doc[1]):
+                author_postings[token].append(name)
+            titles.append((title, name))
+        for field in FIELDS:
+            self._postings[field] = {t: SortedKeys.from_sorted(names) for t, names in postings[field].items()}
+            self._vocab[field] = SortedKeys(self._postings[field])
+        self._titles = SortedKeys(titles)
+
+    def _add(self, item: Dict[str, Any]) -> None:
+        name = item["name"]
+        doc = (tuple(tokenize(name)), tuple(tokenize(item.get("author"))))
+        old = self._docs.get(name)
+        if old == doc:
+            return  # borrow/return: nothing searchable changed
+        if old is not None:
+            self._remove(name)
+        self._docs[name] = doc
+        for field, tokens in zip(FIELDS, doc):
+            for token in set(tokens):
+                names = self._postings[field].get(token)
+                if names is None:
+                    names = self._postings[field][token] = SortedKeys()
+                    self._vocab[field].add(token)
+                names.add(name)
+        self._titles.add((fold(name), name))
+
+    def _remove(self, name: str) -> None:
+        doc = self._docs.pop(name, None)
+        if doc is None:
+            return
+        for field, tokens in zip(FIELDS, doc):
+            for token in set(tokens):
+                names = self._postings[field][token]
+                names.discard(name)
+                if not len(names):
+                    del self._postings[field][token]
+                    self._vocab[field].discard(token)
+        self._titles.discard((fold(name), name))
+
+    def _apply(self, op: str, name: Optional[str], item: Optional[Dict[str, Any]]) -> None:
+        if op == "put":
+            self._add(item)
+        elif op == "del":
+            self._remove(name)
+
+    def on_change(self, op: str, name: Optional[str], item: Optional[Dict[str, Any]], version: int = 0) -> None:
+        """Backend listener: keep the index in step with catalog changes."""
+        with self._lock:
+            if op == "reset":
+                self._clear()
+                self._built = False
+                self._resets += 1
+                if self._pending is not None:
+                    self._pending = _Reset()
+                self._start_build()
+            elif self._built:
+                self._apply(op, name, item)
+            elif isinstance(self._pending, list):
+                self._pending.append((op, name, item))
+
+    def search(self, query: str, limit: int = 10) -> List[str]:
+        """Names of the items matching ``query``, best first."""
+        terms = tokenize(query)
+        if not terms or limit <= 0:
+            return []
+        folded = " ".join(fold(query).split())
+        results: List[str] = []
+        seen = set()
+        with self._lock:
+            tiers = (
+                (n for _, n in takewhile(lambda t: t[0].startswith(folded), self._titles.iter_from((folded,)))),
+                self._match(terms, ("name",)),
+                self._match(terms, FIELDS),
+            )
+            for tier in tiers:
+                for name in tier:
+                    if name not in seen:
+                        seen.add(name)
+                        results.append(name)
+                        if len(results) == limit:
+                            return results
+        return results
+
+    def _postings_for(self, term: str, fields: Tuple[str, ...]) -> List[SortedKeys]:
+        lists = []
+        for field in fields:
+            postings = self._postings[field]
+            for token in takewhile(lambda t: t.startswith(term), self._vocab[field].iter_from(term)):
+                lists.append(postings[token])
+        return lists
+
+    def _match(self, terms: List[str], fields: Tuple[str, ...]) -> Iterator[str]:
+        """Names (in order) where every term prefixes some word of ``fields``."""
+        candidates = []
+        for term in terms:
+            lists = self._postings_for(term, fields)
+            candidates.append((sum(map(len, lists)), term, lists))
+        _, driver, lists = min(candidates, key=lambda c: c[0])
+        others = [t for t in terms if t != driver]
+        previous = None
+        # walk the rarest term's postings and check the rest against each doc
+        for name in merge(*lists):
+            if name == previous:
+                continue
+            previous = name
+            doc = self._docs[name]
+            words = doc[0] if fields == ("name",) else doc[0] + doc[1]
+            if all(any(w.startswith(t) for w in words) for t in others):
+                yield name
+
+
+def scan(items: Iterable[Dict[str, Any]], query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """The items :meth:`SearchIndex.search` finds for ``query``, in its order,
+    found by looking at every item: the answer while an index is built."""
+    terms = tokenize(query)
+    if not terms or limit <= 0:
+        return []
+    folded = " ".join(fold(query).split())
+    starts, in_title, anywhere = [], [], []
+    for item in items:
+        name = item["name"]
+        title = fold(name)
+        author = item.get("author")
+        text = title + "\n" + fold(author) if isinstance(author, str) else title
+        if not all(t in text for t in terms):  # cheap: most items stop here
+            continue
+        words = split(title)
+        if title.startswith(folded):
+            starts.append((title, name, item))
+        elif all(any(w.startswith(t) for w in words) for t in terms):
+            in_title.append((name, item))
+        else:
+            words += tokenize(author)
+            if all(any(w.startswith(t) for w in words) for t in terms):
+                anywhere.append((name, item))
+    starts.sort(key=lambda m: m[:2])
+    in_title.sort(key=lambda m: m[0])
+    anywhere.sort(key=lambda m: m[0])
+    found = [m[-1] for m in starts] + [m[-1] for m in in_title] + [m[-1] for m in anywhere]
+    return found[:limit]
@@ -0,0 +1,79 @@
+"""Pre-encoded JSON for catalog items, so a big listing is joined from bytes
+instead of serialized item by item on every request."""
+import json
+import threading
+from typing import Any, Dict, Iterable, Optional
+
+
+# one encoder for every call: json.dumps would build a new one each time
+_encode = json.JSONEncoder(separators=(",", ":"), sort_keys=True).encode
+
+
+def encode(value: Any) -> bytes:
+    """Compact JSON as ``jsonify`` writes it outside debug mode (sorted keys, ASCII)."""
+    return _encode(value).encode("ascii")
+
+
+class EncodedItems:
+    """The encoded bytes of each item, by name, dropped when the item changes.
+
+    Follows the catalog through :meth:`on_change`, registered with
+    ``StorageBackend.subscribe``. A change leaves the generation it happened
+    at in place of the bytes. A reader takes :attr:`generation` *before*
+    reading items from the engine and hands it to :meth:`join`; an item
+    changed after that may have been read in its old state, so its encoding
+    is used for that response but not kept.
+
+    A delete drops the name instead, so names deleted or renamed away don't
+    pile up; in exchange, a read from before the latest delete fills no
+    empty slot, as it could hold the deleted item.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries: Dict[str, Any] = {}  # name -> bytes, or the generation of its last change
+        self._generation = 0
+        self._floor = 0  # generation of the last reset; older reads are never kept
+        self._deleted = 0  # generation of the last delete; older reads don't add names
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def on_change(self, op: str, name: Optional[str], item: Optional[Dict[str, Any]], version: int = 0) -> None:
+        """Backend listener: forget what changed."""
+        with self._lock:
+            self._generation += 1
+            if op == "reset":
+                self._entries.clear()
+                self._floor = self._generation
+            elif op == "del":
+                self._entries.pop(name, None)
+                self._deleted = self._generation
+            else:
+                self._entries[name] = self._generation
+
+    def join(self, items: Iterable[Dict[str, Any]], generation: int) -> bytes:
+        """``items`` encoded and joined with commas (a JSON array without brackets)."""
+        entries = self._entries
+        parts, fresh = [], []
+        for item in items:
+            data = entries.get(item["name"])
+            if data.__class__ is not bytes:
+                data = encode(item)
+                fresh.append((item["name"], data))
+            parts.append(data)
+        if fresh and generation >= self._floor:
+            with self._lock:
+                if generation >= self._floor:
+                    for name, data in fresh:
+                        seen = entries.get(name)
+                        if seen is None:
+                            if generation >= self._deleted:
+                                entries[name] = data
+                        elif seen.__class__ is int and seen <= generation:
+                            entries[name] = data
+        return b",".join(parts)
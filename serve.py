@@ -0,0 +1,91 @@
+"""Development and test launcher: the API on a pool of worker processes.
+
+    PUSTAKLOK_WORKERS=4 PUSTAKLOK_HOST=0.0.0.0 python serve.py
+
+The parent binds the socket and forks the workers; each runs werkzeug's
+threaded development server on the shared socket and the kernel hands every new connection
+to one of them. Workers share no memory: writes are serialized through the
+store's file lock (JSON) or database lock (SQLite), and each worker's
+caches follow what the others write (see ``StorageBackend.sync``). A worker
+that dies is replaced; SIGTERM or Ctrl-C stops them all.
+
+It is for trying out several workers on one machine (the load tests use
+it), not for production: werkzeug's server has no request timeouts and
+starts a thread per connection. Production runs ``app:app`` under
+gunicorn with ``gunicorn.conf.py``.
+
+``app.py`` run directly is still the single-process debug server.
+"""
+import logging
+import os
+import shutil
+import signal
+import socket
+import tempfile
+
+from werkzeug.serving import make_server
+
+import config
+import metrics
+import storage
+from app import app  # imported before forking, so workers share the loaded code
+
+log = logging.getLogger("serve")
+
+
+def _worker(sock: socket.socket, metrics_dir: str) -> None:
+    signal.signal(signal.SIGINT, signal.SIG_IGN)  # the parent decides when to stop
+    signal.signal(signal.SIGTERM, lambda *_: os._exit(0))
+    metrics.REGISTRY.share(metrics_dir)  # so /metrics on any worker covers all of them
+    storage.start_search_index()  # threads don't survive the fork: each worker builds its own
+    server = make_server(config.HOST, config.PORT, app, threaded=True, fd=sock.fileno())
+    server.serve_forever()
+
+
+def _spawn(sock: socket.socket, metrics_dir: str) -> int:
+    pid = os.fork()
+    if pid == 0:
+        try:
+            _worker(sock, metrics_dir)
+        finally:
+            os._exit(1)
+    return pid
+
+
+def main() -> None:
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s %(name)s[%(process)d] %(message)s")
+    if not hasattr(os, "fork") or config.WORKERS == 1:
+        log.info("Serving on http://%s:%d (1 process)", config.HOST, config.PORT)
+        storage.start_search_index()
+        make_server(config.HOST, config.PORT, app, threaded=True).serve_forever()
+        return
+    sock = socket.create_server((config.HOST, config.PORT), backlog=128)
+    sock.set_inheritable(True)
+    metrics_dir = tempfile.mkdtemp(prefix="pustaklok-metrics-")
+    workers = {_spawn(sock, metrics_dir) for _ in range(config.WORKERS)}
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+        for pid in list(workers):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    log.info("Serving on http://%s:%d (%d workers)", config.HOST, config.PORT, config.WORKERS)
+    while workers:
+        pid, status = os.wait()
+        workers.discard(pid)
+        if not stopping:
+            log.warning("Worker %d exited (status %d); starting another", pid, status)
+            workers.add(_spawn(sock, metrics_dir))
+    sock.close()
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,89 +1,439 @@
+import base64
+import binascii
 import json
+import sys
 import threading
-from typing import Dict, Any, List
+import time
+import weakref
+from datetime import datetime
+from typing import Dict, Any, Iterator, List, Optional, Tuple
 
-DATA_FILE = "media_store.json"
-_LOCK = threading.Lock()
+import config
+from backends import SORTS, CommitHook, Op, StorageBackend, create_backend, published_range, sort_key
+from changes import ChangeFeed, EventHub, format_event
+from loans import LoanLedger
+from metrics import storage_timer, timed
+from search import SearchIndex, scan
+from serialize import EncodedItems
 
+_backend: Optional[StorageBackend] = None
+_backend_lock = threading.Lock()
+# one search index per engine, following it through StorageBackend.subscribe
+_search_indexes: "weakref.WeakKeyDictionary[StorageBackend, SearchIndex]" = weakref.WeakKeyDictionary()
+# and one change feed, started the first time a client learns a version
+_change_feeds: "weakref.WeakKeyDictionary[StorageBackend, ChangeFeed]" = weakref.WeakKeyDictionary()
+# and one hub for live (server-sent event) subscribers
+_event_hubs: "weakref.WeakKeyDictionary[StorageBackend, EventHub]" = weakref.WeakKeyDictionary()
+# and the encoded JSON of its items, for listing responses
+_item_caches: "weakref.WeakKeyDictionary[StorageBackend, EncodedItems]" = weakref.WeakKeyDictionary()
+# and the ledger of its loans, next to its files
+_ledgers: "weakref.WeakKeyDictionary[StorageBackend, LoanLedger]" = weakref.WeakKeyDictionary()
+
+STREAM_QUEUE = 1000  # events a live subscriber may fall behind before it is dropped
+STREAM_KEEPALIVE = 15.0  # seconds between keepalives on an idle stream
+STREAM_POLL = 1.0  # seconds between looks for other processes' writes on an idle stream
+
+def get_backend() -> StorageBackend:
+    """Return the configured storage engine, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = _backend_from_config()
+    return _backend
+
+def _backend_from_config() -> StorageBackend:
+    if config.STORAGE_BACKEND == "sqlite":
+        return create_backend("sqlite", config.SQLITE_FILE)
+    return create_backend(config.STORAGE_BACKEND, config.DATA_FILE,
+                          compact_every=config.JOURNAL_COMPACT_EVERY, fsync=config.JOURNAL_FSYNC,
+                          group_commit=config.GROUP_COMMIT, group_window=config.GROUP_COMMIT_MS / 1000,
+                          group_max=config.GROUP_COMMIT_MAX, snapshot_format=config.SNAPSHOT_FORMAT)
+
+def set_backend(backend: StorageBackend) -> Optional[StorageBackend]:
+    """Swap the storage engine (tests, benchmarks); returns the previous one."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+@timed("load")
 def _load_all() -> Dict[str, Dict[str, Any]]:
-    try:
-        with open(DATA_FILE, "r", encoding="utf-8") as f:
-            return json.load(f)
-    except FileNotFoundError:
-        return {}
-    except json.JSONDecodeError:
-        # corrupted file -> start fresh (could also backup)
-        return {}
+    return get_backend().load_all()
 
+@timed("save")
 def _save_all(data: Dict[str, Dict[str, Any]]) -> None:
-    with _LOCK:
-        with open(DATA_FILE, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=2, ensure_ascii=False)
+    """Replace the catalog; loans of items that are not out to the same borrower after it are closed."""
+    backend = get_backend()
+    ledger = _ledger(backend)  # not from the hook: see _ledger
+    def settle(items: List[Dict[str, Any]]) -> None:
+        with storage_timer("loans"):
+            ledger.settle(items, int(time.time()))
+    backend.replace_all(data, settle)
 
+@timed("list")
 def list_all() -> List[Dict[str, Any]]:
-    return list(_load_all().values())
+    return get_backend().list_all()
+
+@timed("version")
+def catalog_state() -> Tuple[str, float]:
+    """``(etag, last_modified)`` for the catalog as it is now.
+
+    The tag changes with every write, so a response built from the catalog
+    can be revalidated by comparing tags instead of resending the body. It
+    is also the ``since`` token for :func:`changes_since`.
+    """
+    backend = get_backend()
+    _change_feed(backend)  # start recording before anyone holds a token
+    v = backend.version()
+    return f"{v.epoch}-{v.version}", v.modified
+
+def _change_feed(backend: StorageBackend) -> ChangeFeed:
+    feed = _change_feeds.get(backend)
+    if feed is None:
+        # version() may wait for the engine's write lock, so not under
+        # _backend_lock; a write in between is a gap the feed notices
+        version = backend.version().version
+        with _backend_lock:
+            feed = _change_feeds.get(backend)
+            if feed is None:
+                feed = _change_feeds[backend] = ChangeFeed(version)
+                backend.subscribe(feed.on_change)
+    return feed
+
+def _event_hub(backend: StorageBackend) -> EventHub:
+    hub = _event_hubs.get(backend)
+    if hub is None:
+        epoch = backend.version().epoch  # outside _backend_lock, as in _change_feed
+        with _backend_lock:
+            hub = _event_hubs.get(backend)
+            if hub is None:
+                hub = _event_hubs[backend] = EventHub(epoch)
+                backend.subscribe(hub.on_change)
+    return hub
+
+def item_cache() -> EncodedItems:
+    """Encoded JSON of the configured engine's items, kept up to date with it."""
+    backend = get_backend()
+    cache = _item_caches.get(backend)
+    if cache is None:
+        with _backend_lock:
+            cache = _item_caches.get(backend)
+            if cache is None:
+                cache = _item_caches[backend] = EncodedItems()
+                backend.subscribe(cache.on_change)
+    return cache
+
+def stream_changes(since: Optional[str] = None) -> Iterator[str]:
+    """Server-sent events for every change from now on.
+
+    Each ``change`` event carries ``{"upserts": [...], "deletes": [...]}``
+    and the catalog version as its id. With ``since`` (a version, e.g. the
+    id of the last event seen before reconnecting) the changes after it
+    come first, as one event, or a ``resync`` event if they are gone.
+    """
+    backend = get_backend()
+    hub = _event_hub(backend)
+    sub = hub.subscribe(STREAM_QUEUE)  # before reading the delta, so nothing falls in between
+    try:
+        if since:
+            try:
+                delta = changes_since(since)
+            except ValueError:
+                delta = {"resync": True, "version": None}
+            version = delta.pop("version")
+            if delta.pop("resync", False):
+                yield format_event("resync", {"reason": "too far behind"}, version)
+            else:
+                sub.after = int(version.rpartition("-")[2])
+                yield format_event("change", delta, version)
+        else:
+            yield ": connected\n\n"
+        yield from sub.messages(STREAM_KEEPALIVE, STREAM_POLL, backend.sync)
+    finally:
+        hub.unsubscribe(sub)
+
+@timed("changes")
+def changes_since(token: str) -> Dict[str, Any]:
+    """What changed after the catalog state ``token`` (an ETag value).
 
+    ``{"version": token, "upserts": [...], "deletes": [...]}``, or
+    ``{"version": token, "resync": True}`` when the changes are no longer
+    known and the client has to reload. Raises ValueError on a bad token.
+    """
+    epoch, sep, number = token.rpartition("-")
+    if not sep or not number.isdigit():
+        raise ValueError(f"Invalid version: {token!r}")
+    backend = get_backend()
+    feed = _change_feed(backend)
+    current = backend.version()
+    delta = feed.since(int(number)) if epoch == current.epoch else None
+    if delta is None:
+        return {"version": f"{current.epoch}-{current.version}", "resync": True}
+    delta["version"] = f"{current.epoch}-{delta['version']}"
+    return delta
+
+@timed("list")
 def list_by_category(category: str) -> List[Dict[str, Any]]:
-    return [m for m in _load_all().values() if m.get("category","").lower() == category.lower()]
+    return get_backend().list_by_category(category)
+
+@timed("categories")
+def category_counts() -> List[Dict[str, Any]]:
+    """``[{"category": ..., "count": n}]`` for every category in use, by name."""
+    counts = get_backend().category_counts()
+    return [{"category": c, "count": counts[c]} for c in sorted(counts, key=lambda c: str(c).lower())]
+
+def encode_cursor(name: str) -> str:
+    return base64.urlsafe_b64encode(name.encode("utf-8")).decode("ascii").rstrip("=")
+
+def decode_cursor(cursor: str) -> str:
+    """Inverse of :func:`encode_cursor`; raises ValueError on garbage."""
+    try:
+        return base64.b64decode(cursor + "=" * (-len(cursor) % 4), altchars=b"-_", validate=True).decode("utf-8")
+    except (binascii.Error, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def _parse_sort(sort: str) -> Tuple[str, bool]:
+    """``"-publication_date"`` -> ``("publication_date", True)``; ValueError if not a SORTS field."""
+    field = sort.removeprefix("-")
+    if field not in SORTS:
+        raise ValueError(f"Unknown sort {sort!r}")
+    return field, sort.startswith("-")
+
+def _sort_cursor(field: str, item: Dict[str, Any]) -> str:
+    """Cursor after ``item`` in ``field`` order: the name alone for name order, as it always was."""
+    if field == "name":
+        return encode_cursor(item["name"])
+    return encode_cursor(json.dumps([field, sort_key(item.get(field)), item["name"]], ensure_ascii=False))
+
+def _sort_after(field: str, cursor: str) -> Any:
+    """The backend's ``after`` for a cursor from :func:`_sort_cursor`; ValueError if it
+    is garbage or from another order."""
+    text = decode_cursor(cursor)
+    if field == "name":
+        return text
+    try:
+        cursor_field, key, name = json.loads(text)
+    except ValueError as e:  # garbage, or not three values
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+    if cursor_field != field or not isinstance(key, str) or not isinstance(name, str):
+        raise ValueError(f"Invalid cursor: {cursor!r}")
+    return key, name
+
+@timed("page")
+def list_page(limit: int, cursor: Optional[str] = None, category: Optional[str] = None,
+              borrowed: bool = False, offset: int = 0, sort: str = "name",
+              published_from: Optional[str] = None, published_to: Optional[str] = None) -> Dict[str, Any]:
+    """One page of items, plus the total and the cursor of the next page.
+
+    Items are in name order, or by ``sort``: a SORTS field, ``-`` first for
+    descending (``-publication_date``: newest first); ties go by name.
+    ``published_from``/``published_to`` keep the items published in that
+    range (see ``backends.published_range``). ``offset`` skips that many
+    items (after the cursor, if any), so a client can jump to any row
+    without walking the pages before it. Raises ValueError on a bad
+    ``sort`` or a cursor that isn't from this order.
+    """
+    field, descending = _parse_sort(sort)
+    after = _sort_after(field, cursor) if cursor else None
+    published = None
+    if published_from is not None or published_to is not None:
+        published = published_range(published_from, published_to)
+    items, total = get_backend().page(after, limit + 1, category=category, borrowed=borrowed, offset=offset,
+                                      sort=field, descending=descending, published=published)
+    more = len(items) > limit
+    items = items[:limit]
+    return {
+        "items": items,
+        "total": total,
+        "next_cursor": _sort_cursor(field, items[-1]) if more else None,
+    }
 
+def list_sorted(category: Optional[str] = None, borrowed: bool = False, sort: str = "name",
+                published_from: Optional[str] = None, published_to: Optional[str] = None) -> List[Dict[str, Any]]:
+    """Every matching item in ``sort`` order, for listings asked for an order
+    or a date range without paging (see :func:`list_page`)."""
+    return list_page(sys.maxsize - 1, category=category, borrowed=borrowed, sort=sort,
+                     published_from=published_from, published_to=published_to)["items"]
+
+def iter_items(category: Optional[str] = None, available: Optional[bool] = None,
+               chunk: int = 1000) -> Iterator[Dict[str, Any]]:
+    """Every item in name order, read ``chunk`` at a time (constant memory)."""
+    backend, after = get_backend(), None
+    while True:
+        items, _ = backend.page(after, chunk, category=category, borrowed=available is False)
+        for m in items:
+            if available is None or m.get("available", True) == available:
+                yield m
+        if len(items) < chunk:
+            return
+        after = items[-1]["name"]
+
+@timed("get")
 def find_by_name_exact(name: str):
-    return _load_all().get(name)
+    return get_backend().get(name)
+
+@timed("get")
+def get_by_id(item_id: int) -> Optional[Dict[str, Any]]:
+    return get_backend().get_by_id(item_id)
+
+def _search_index(backend: StorageBackend) -> SearchIndex:
+    with _backend_lock:
+        index = _search_indexes.get(backend)
+        if index is None:
+            index = _search_indexes[backend] = SearchIndex()
+            backend.subscribe(index.on_change)
+            ref = weakref.ref(backend)  # the index must not keep its backend alive
+
+            def build():
+                backend = ref()
+                if backend is not None:
+                    with storage_timer("index_build"):
+                        index.ensure_built(backend.list_all)
+            index.keep_built(build)
+    return index
+
+def start_search_index() -> None:
+    """Start building the search index in the background (servers call this
+    at startup, so the first search doesn't wait for it)."""
+    _search_index(get_backend())
+
+@timed("search")
+def search_media(query: str, limit: int = 10) -> List[Dict[str, Any]]:
+    """Items whose title or author words start with the words of ``query``, best first."""
+    backend = get_backend()
+    index = _search_index(backend)
+    backend.sync()
+    if not index.built:  # still being built: look at every item meanwhile
+        return scan(backend.list_all(), query, limit)
+    items = (backend.get(name) for name in index.search(query, limit))
+    return [m for m in items if m is not None]
 
 def get_metadata(name: str):
     return find_by_name_exact(name)
 
-def create_media(media: Dict[str, Any]) -> bool:
-    data = _load_all()
+def _create_op(media: Dict[str, Any]) -> Optional[Op]:
     name = media.get("name")
-    if not name or name in data:
-        return False
+    if not name or not isinstance(name, str):
+        return None
+    media.pop("id", None)  # the engine numbers new items
     # Add borrow/return fields
     media["available"] = True
     media["borrowed_by"] = None
     media["borrow_date"] = None
-    data[name] = media
-    _save_all(data)
-    return True
+    return ("create", media)
+
+def _borrow_date(now: int) -> str:
+    return datetime.fromtimestamp(now).strftime("%Y-%m-%d %H:%M:%S")
+
+def _ledger(backend: StorageBackend) -> LoanLedger:
+    """The engine's loan ledger. Writers get it before they commit: their
+    hooks run under the engine's write lock, which must never be held while
+    waiting for _backend_lock (_change_feed holds that one while reading)."""
+    ledger = _ledgers.get(backend)
+    if ledger is None:
+        with _backend_lock:
+            ledger = _ledgers.get(backend)
+            if ledger is None:
+                ledger = _ledgers[backend] = LoanLedger(backend.path + ".loans", fsync=config.JOURNAL_FSYNC)
+    return ledger
+
+@timed("write")
+def _run(ops: List[Optional[Op]], on_commit: Optional[CommitHook] = None) -> List[bool]:
+    """Apply the ops as one backend batch; ``None`` entries (invalid input) report False."""
+    valid = [op for op in ops if op is not None]
+    done = iter(get_backend().batch(valid, on_commit) if valid else [])
+    return [op is not None and next(done) for op in ops]
+
+def _out(item: Optional[Dict[str, Any]]) -> bool:
+    return item is not None and not item.get("available", True)
+
+def _close_loans(ledger: LoanLedger) -> CommitHook:
+    """``on_commit`` for writes that can end loans: close the loans of the
+    items that were out and no longer are, or are out to someone else."""
+    def close(changes: list) -> None:
+        ended = [before["id"] for before, after in changes if _out(before) and not (
+            _out(after) and after["id"] == before["id"] and after.get("borrowed_by") == before.get("borrowed_by"))]
+        if ended:
+            with storage_timer("loans"):
+                ledger.give_back(ended, int(time.time()))
+    return close
+
+def create_media(media: Dict[str, Any]) -> bool:
+    return _run([_create_op(media)])[0]
 
 def delete_media(name: str) -> bool:
-    data = _load_all()
-    if name in data:
-        del data[name]
-        _save_all(data)
-        return True
-    return False
+    return delete_many([name])[0]
+
+@timed("write")
+def update_media(name: str, changes: Dict[str, Any]) -> bool:
+    """Change fields of an item; a new ``name`` renames it, keeping its id.
+
+    False if the item is missing or the new name is taken.
+    """
+    return get_backend().update(name, changes)
 
 def borrow_media(name: str, borrower: str) -> bool:
     """Mark an item as borrowed by a person."""
-    data = _load_all()
-    if name not in data:
-        return False
-    item = data[name]
-    if not item.get("available", True):
-        return False  # Already borrowed
-    
-    from datetime import datetime
-    item["available"] = False
-    item["borrowed_by"] = borrower
-    item["borrow_date"] = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-    _save_all(data)
-    return True
+    return borrow_many([(name, borrower)])[0]
 
 def return_media(name: str) -> bool:
     """Mark a borrowed item as returned."""
-    data = _load_all()
-    if name not in data:
-        return False
-    item = data[name]
-    if item.get("available", True):
-        return False  # Not borrowed
-    
-    item["available"] = True
-    item["borrowed_by"] = None
-    item["borrow_date"] = None
-    _save_all(data)
-    return True
+    return return_many([name])[0]
+
+def import_many(items: List[Dict[str, Any]], replace: bool = False) -> List[bool]:
+    """Restore exported items, keeping their borrow state.
+
+    Existing names are skipped, or overwritten when ``replace`` is true.
+    """
+    ops = []
+    for media in items:
+        name = media.get("name")
+        if not name or not isinstance(name, str):
+            ops.append(None)
+            continue
+        media.setdefault("available", True)
+        media.setdefault("borrowed_by", None)
+        media.setdefault("borrow_date", None)
+        ops.append(("put" if replace else "create", media))
+    return _run(ops, _close_loans(_ledger(get_backend())))
+
+def create_many(items: List[Dict[str, Any]]) -> List[bool]:
+    """Create several items in one transaction; one success flag per item."""
+    return _run([_create_op(m) for m in items])
+
+def delete_many(names: List[str]) -> List[bool]:
+    """Delete several items in one transaction; loans of deleted items that were out are closed."""
+    return _run([("delete", n) for n in names], _close_loans(_ledger(get_backend())))
+
+def borrow_many(loans: List[Tuple[str, str]]) -> List[bool]:
+    """Borrow several ``(name, borrower)`` pairs in one transaction.
+
+    Each loan is also entered in the loan ledger, due LOAN_DAYS from now.
+    """
+    now = int(time.time())
+    when = _borrow_date(now)
+    ledger = _ledger(get_backend())
+    def lend(changes: list) -> None:
+        with storage_timer("loans"):
+            ledger.lend([(item, item["borrowed_by"]) for _, item in changes], now, config.LOAN_DAYS)
+    return _run([("borrow", name, borrower, when) for name, borrower in loans], lend)
+
+def return_many(names: List[str]) -> List[bool]:
+    """Return several items in one transaction, closing their loans."""
+    return _run([("return", n) for n in names], _close_loans(_ledger(get_backend())))
+
+@timed("loans")
+def overdue_loans(limit: int, now: Optional[int] = None) -> List[Dict[str, Any]]:
+    """Open loans past their due date, the longest overdue first."""
+    return _ledger(get_backend()).overdue(int(time.time()) if now is None else now, limit)
+
+@timed("loans")
+def borrower_loans(borrower: str, open_only: bool = False) -> List[Dict[str, Any]]:
+    """Everything ``borrower`` has borrowed, the latest first."""
+    return _ledger(get_backend()).for_borrower(borrower, open_only)
 
+@timed("list")
 def get_borrowed_items() -> List[Dict[str, Any]]:
     """Get all currently borrowed items."""
-    return [m for m in _load_all().values() if not m.get("available", True)]
+    return get_backend().list_borrowed()
@@ -1,11 +1,30 @@
 import unittest
+import gzip
 import os
 import json
+import pstats
+from unittest.mock import patch
+import tempfile
+import threading
+import time
 from app import app
+import config
+import storage
 from storage import _save_all, _load_all
+from backends import JsonBackend, SqliteBackend, migrate
+from changes import ChangeFeed, EventHub
+from loans import LoanLedger
+from search import SearchIndex, scan
+from serialize import EncodedItems
 
 class BackendTests(unittest.TestCase):
     def setUp(self):
+        # the configured engine, on files of its own rather than the repo's media_store.json
+        self.tmp = tempfile.TemporaryDirectory()
+        with patch.multiple(config, DATA_FILE=os.path.join(self.tmp.name, "media_store.json"),
+                            SQLITE_FILE=os.path.join(self.tmp.name, "media_store.db")):
+            self.backend = storage._backend_from_config()
+        self.previous = storage.set_backend(self.backend)
         self.client = app.test_client()
         # start with known dataset
         sample = {
@@ -15,8 +34,9 @@ class BackendTests(unittest.TestCase):
         _save_all(sample)
 
     def tearDown(self):
-        # clear file
-        _save_all({})
+        storage.set_backend(self.previous)
+        self.backend.close()
+        self.tmp.cleanup()
 
     def test_list_all(self):
         r = self.client.get("/media")
@@ -31,6 +51,35 @@ class BackendTests(unittest.TestCase):
         data = r.get_json()
         self.assertEqual(data["author"], "A")
 
+    def test_loans_closed_when_items_are_replaced(self):
+        for name in ("Alpha", "Beta"):
+            self.client.post(f"/media/{name}/borrow", json={"borrower":"Madhav"})
+        open_loans = lambda: [l["name"] for l in self.client.get("/borrowers/Madhav/loans?open=1").get_json()]
+        alpha = {"name":"Alpha","publication_date":"2020-01-01","author":"A","category":"Book","available":True}
+        r = self.client.post("/media/import?replace=true", data=json.dumps(alpha), content_type="application/x-ndjson")
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual(open_loans(), ["Beta"])  # back on the shelf: its loan is closed
+        _save_all({"Beta": storage.get_backend().get("Beta")})
+        self.assertEqual(open_loans(), ["Beta"])  # still out to Madhav
+        _save_all({})
+        self.assertEqual(open_loans(), [])
+
+    def test_borrow_races_first_catalog_state(self):
+        fsync = os.fsync
+        def slow_fsync(fd):  # keeps the borrow inside the engine's write lock for a while
+            time.sleep(0.2)
+            fsync(fd)
+        with patch("os.fsync", slow_fsync):
+            borrow = threading.Thread(target=storage.borrow_media, args=("Alpha", "Madhav"), daemon=True)
+            state = threading.Thread(target=storage.catalog_state, daemon=True)
+            borrow.start()
+            time.sleep(0.05)
+            state.start()
+            borrow.join(5)
+            state.join(5)
+        self.assertFalse(borrow.is_alive() or state.is_alive(), "deadlocked")
+        self.assertEqual([l["name"] for l in storage.borrower_loans("Madhav", open_only=True)], ["Alpha"])
+
     def test_create_and_delete(self):
         new = {"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Magazine"}
         r = self.client.post("/media", json=new)
@@ -38,5 +87,665 @@ class BackendTests(unittest.TestCase):
         r = self.client.delete("/media/Gamma")
         self.assertEqual(r.status_code, 200)
 
+    def test_paged_listing(self):
+        r = self.client.get("/media?limit=1&fields=name,author")
+        page = r.get_json()
+        self.assertEqual(page["items"], [{"name":"Alpha","author":"A"}])
+        self.assertEqual(page["total"], 2)
+        page = self.client.get(f"/media?limit=1&cursor={page['next_cursor']}").get_json()
+        self.assertEqual([x["name"] for x in page["items"]], ["Beta"])
+        self.assertIsNone(page["next_cursor"])
+        page = self.client.get("/media/category/FILM?limit=5").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["total"]), (["Beta"], 1))
+        self.client.post("/media/Beta/borrow", json={"borrower":"Madhav"})
+        page = self.client.get("/media/borrowed/list?limit=5&fields=name").get_json()
+        self.assertEqual(page, {"items":[{"name":"Beta"}], "total":1, "next_cursor":None})
+        self.assertEqual(self.client.get("/media?limit=0").status_code, 400)
+        self.assertEqual(self.client.get("/media?cursor=%%%").status_code, 400)
+        page = self.client.get("/media?offset=1&limit=5").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["total"]), (["Beta"], 2))
+        page = self.client.get("/media/category/film?offset=0&limit=5&fields=name").get_json()
+        self.assertEqual(page["items"], [{"name":"Beta"}])
+        self.assertEqual(self.client.get("/media?offset=-1").status_code, 400)
+
+    def test_sorted_and_date_range_listing(self):
+        for name, date, author in [("Gamma","2005-07-01","C"), ("Delta","2010","A"), ("Eps","2011-01-01","B")]:
+            self.client.post("/media", json={"name":name,"publication_date":date,"author":author,"category":"film"})
+        r = self.client.get("/media/category/Film?published_from=2000&published_to=2010&sort=-publication_date")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Delta", "Gamma"])
+        r = self.client.get("/media?sort=author&fields=name")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Alpha", "Delta", "Beta", "Eps", "Gamma"])
+        page = self.client.get("/media?sort=-publication_date&published_from=2011&limit=2").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["total"]), (["Beta", "Alpha"], 3))
+        page = self.client.get(f"/media?sort=-publication_date&published_from=2011&limit=2&cursor={page['next_cursor']}").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["next_cursor"]), (["Eps"], None))
+        self.client.delete("/media/Gamma")
+        r = self.client.get("/media?published_to=2020&sort=publication_date")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Delta", "Eps", "Alpha"])
+        self.assertEqual(self.client.get("/media?sort=isbn").status_code, 400)
+        self.assertEqual(self.client.get("/media?sort=author&limit=1&cursor=QmV0YQ").status_code, 400)  # a name cursor
+
+    def test_item_ids_and_rename(self):
+        r = self.client.post("/media", json={"name":"Gamma/Δ","publication_date":"2022-02-02","author":"C","category":"Book","id":1})
+        gamma = r.get_json()["id"]
+        self.assertNotIn(gamma, [m["id"] for m in self.client.get("/media").get_json() if m["name"] != "Gamma/Δ"])
+        self.assertEqual(self.client.get(f"/media/id/{gamma}").get_json()["name"], "Gamma/Δ")
+        self.assertEqual(self.client.post(f"/media/id/{gamma}/borrow", json={"borrower":"Madhav"}).status_code, 200)
+        r = self.client.patch(f"/media/id/{gamma}", json={"name":"Gamma", "author":"C2"})
+        self.assertEqual(r.status_code, 200)
+        self.assertEqual((r.get_json()["id"], r.get_json()["author"], r.get_json()["borrowed_by"]), (gamma, "C2", "Madhav"))
+        self.assertEqual(self.client.get("/media/search?name=Gamma/Δ").status_code, 404)
+        self.assertEqual(self.client.patch("/media/Gamma", json={"name":"Alpha"}).status_code, 409)
+        self.assertEqual(self.client.patch("/media/Gamma", json={"available":True}).status_code, 400)
+        self.assertEqual(self.client.patch("/media/Nope", json={"author":"X"}).status_code, 404)
+        self.assertEqual(self.client.delete(f"/media/id/{gamma}").status_code, 200)
+        self.assertEqual(self.client.get(f"/media/id/{gamma}").status_code, 404)
+        r = self.client.post("/media", json={"name":"Delta","publication_date":"2023-03-03","author":"D","category":"Book"})
+        self.assertGreater(r.get_json()["id"], gamma)  # ids are not reused
+
+    def test_category_counts_follow_mutations(self):
+        self.client.post("/media", json={"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"film"})
+        self.assertEqual(self.client.get("/media/category").get_json(),
+                         [{"category":"Book","count":1}, {"category":"Film","count":2}])
+        self.assertEqual([x["name"] for x in self.client.get("/media/category/FILM").get_json()], ["Beta", "Gamma"])
+        self.client.delete("/media/Alpha")
+        self.assertEqual(self.client.get("/media/category").get_json(), [{"category":"Film","count":2}])
+        self.assertEqual(self.client.get("/media/category/book").get_json(), [])
+
+    def test_conditional_get(self):
+        r = self.client.get("/media")
+        etag = r.headers["ETag"]
+        self.assertTrue(etag.startswith('W/"'))
+        self.assertNotIn("Last-Modified", r.headers)  # written this second: more writes may share the date
+        r = self.client.get("/media", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 304)
+        self.assertEqual(r.data, b"")
+        self.assertEqual(self.client.get("/media/Alpha", headers={"If-None-Match": etag}).status_code, 304)
+        self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        r = self.client.get("/media", headers={"If-None-Match": etag})
+        self.assertEqual(r.status_code, 200)
+        self.assertNotEqual(r.headers["ETag"], etag)
+        self.assertNotIn("ETag", self.client.get("/media/Nope").headers)
+        with patch("time.time", return_value=time.time() + 1):  # the second of the borrow is over
+            modified = self.client.get("/media").headers["Last-Modified"]
+            self.assertEqual(self.client.get("/media", headers={"If-Modified-Since": modified}).status_code, 304)
+
+    def test_listing_cache_and_gzip(self):
+        self.assertEqual(self.client.get("/media").get_json()[0]["available"], True)
+        self.assertEqual(len(storage.item_cache()), 2)
+        self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        self.assertEqual(self.client.get("/media").get_json()[0]["borrowed_by"], "Madhav")  # cache dropped it
+        page = self.client.get("/media?limit=1").get_json()
+        self.assertEqual((page["items"][0]["name"], page["total"]), ("Alpha", 2))
+        plain = self.client.get("/media")
+        self.assertNotIn("Content-Encoding", plain.headers)  # below the threshold
+        with patch("config.COMPRESS_MIN_BYTES", 0):
+            r = self.client.get("/media", headers={"Accept-Encoding": "gzip"})
+        self.assertEqual((r.headers["Content-Encoding"], r.headers["Vary"]), ("gzip", "Accept-Encoding"))
+        self.assertEqual(json.loads(gzip.decompress(r.data)), plain.get_json())
+        # an item read before a change is served but not cached
+        cache = EncodedItems()
+        generation = cache.generation
+        cache.on_change("put", "X", {"name":"X"})
+        cache.join([{"name":"X", "v":1}], generation)
+        self.assertIn(b'"v":2', cache.join([{"name":"X", "v":2}], cache.generation))
+        # a delete drops the name, and a read from before it can't bring the item back
+        cache.on_change("del", "X", None)
+        self.assertEqual(len(cache), 0)
+        cache.join([{"name":"X", "v":2}], generation)
+        self.assertEqual(len(cache), 0)
+        cache.join([{"name":"Y", "v":1}], cache.generation)
+        self.assertEqual(len(cache), 1)
+
+    def test_metrics_and_profiling(self):
+        self.client.get("/media/Alpha")
+        self.client.get("/media/Nope")
+        text = self.client.get("/metrics").get_data(as_text=True)
+        self.assertRegex(text, r'pustaklok_requests_total\{method="GET",route="/media/<name>",status="404"\} [1-9]')
+        self.assertIn('pustaklok_request_seconds_bucket{method="GET",route="/media/<name>",le="+Inf"}', text)
+        self.assertRegex(text, r'pustaklok_storage_seconds_count\{op="get"\} [1-9]')
+        with tempfile.TemporaryDirectory() as tmp, patch("config.PROFILE_RATE", 1.0), patch("config.PROFILE_DIR", tmp):
+            self.client.get("/media")
+            [name] = os.listdir(tmp)
+            self.assertIn("GET_media", name)
+            pstats.Stats(os.path.join(tmp, name))  # a readable stats file
+
+    def test_change_feed(self):
+        etag = self.client.get("/media").headers["ETag"]
+        self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        self.client.post("/media", json={"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Film"})
+        self.client.delete("/media/Gamma")
+        self.client.delete("/media/Beta")
+        delta = self.client.get("/media/changes", query_string={"since": etag}).get_json()
+        self.assertEqual([m["name"] for m in delta["upserts"]], ["Alpha"])
+        self.assertFalse(delta["upserts"][0]["available"])
+        self.assertEqual(sorted(delta["deletes"]), ["Beta", "Gamma"])
+        self.assertEqual(f'W/"{delta["version"]}"', self.client.get("/media").headers["ETag"])
+        again = self.client.get("/media/changes", query_string={"since": delta["version"]}).get_json()
+        self.assertEqual((again["upserts"], again["deletes"]), ([], []))
+        self.assertTrue(self.client.get("/media/changes?since=other-1").get_json()["resync"])
+        self.assertEqual(self.client.get("/media/changes?since=x").status_code, 400)
+        feed = ChangeFeed(0, size=2)
+        for v in (1, 2, 3):
+            feed.on_change("put", f"n{v}", {"name": f"n{v}"}, v)
+        self.assertIsNone(feed.since(0))  # change 1 was evicted
+        self.assertEqual(feed.since(1)["upserts"], [{"name": "n2"}, {"name": "n3"}])
+
+    def test_event_stream(self):
+        etag = self.client.get("/media").headers["ETag"]
+        self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        r = self.client.get("/media/stream", headers={"Last-Event-ID": etag}, buffered=False)
+        events = iter(r.response)
+        first = next(events).decode()  # the change made before connecting
+        self.assertIn("event: change", first)
+        self.assertIn('"borrowed_by": "Madhav"', first)
+        self.client.delete("/media/Beta")
+        self.assertIn('"deletes": ["Beta"]', next(events).decode())
+        r.close()
+        self.assertEqual(len(storage._event_hub(storage.get_backend())), 0)
+        hub = EventHub("e")
+        slow = hub.subscribe(2)
+        for v in (1, 2, 3):
+            hub.on_change("del", f"n{v}", None, v)
+        self.assertEqual(len(hub), 0)  # dropped on the third event
+        messages = list(slow.messages(0))
+        self.assertEqual(messages[0].count("event: change"), 2)
+        self.assertIn("event: resync", messages[1])
+
+    def test_names_of_media_endpoints_are_reserved(self):
+        item = lambda n: {"name":n,"publication_date":"2022-02-02","author":"C","category":"Book"}
+        for name in ["changes", "stream", "export", "category", "bulk", "search"]:
+            self.assertEqual(self.client.post("/media", json=item(name)).status_code, 400)
+            self.assertEqual(self.client.patch("/media/Alpha", json={"name":name}).status_code, 400)
+            r = self.client.post("/media/bulk", json=[item(name)])
+            self.assertEqual(r.get_json()["failed"], 1)
+            r = self.client.post("/media/import", data=json.dumps(item(name)), content_type="application/x-ndjson")
+            self.assertEqual(r.get_json()["failed"], 1)
+        # a POST-only endpoint leaves the item routes free
+        self.assertEqual(self.client.post("/media", json=item("import")).status_code, 201)
+        self.assertEqual(self.client.get("/media/import").get_json()["name"], "import")
+        self.assertEqual(self.client.post("/media/import/borrow", json={"borrower":"Madhav"}).status_code, 200)
+        self.assertEqual(self.client.delete("/media/import").status_code, 200)
+
+    def test_bulk_create_and_circulation(self):
+        r = self.client.post("/media/bulk", json=[
+            {"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Book"},
+            {"name":"Alpha","publication_date":"2020-01-01","author":"A","category":"Book"},
+            {"name":"Delta"},
+            {"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Book"},
+        ])
+        self.assertEqual(r.status_code, 200)
+        body = r.get_json()
+        self.assertEqual([x["status"] for x in body["results"]], ["created", "error", "error", "error"])
+        self.assertEqual((body["succeeded"], body["failed"]), (1, 3))
+        lines = "\n".join(json.dumps({"name":n,"publication_date":"2023-01-01","author":"E","category":"Film"}) for n in ["Eps", "Zeta"])
+        r = self.client.post("/media/bulk", data=lines, content_type="application/x-ndjson")
+        self.assertEqual(r.get_json()["succeeded"], 2)
+        r = self.client.post("/media/bulk/borrow", json=[{"name":"Eps","borrower":"X"}, {"name":"Eps","borrower":"Y"}, {"name":"Zeta"}])
+        self.assertEqual([x["status"] for x in r.get_json()["results"]], ["borrowed", "error", "error"])
+        self.assertEqual(self.client.get("/media/Eps").get_json()["borrowed_by"], "X")
+        r = self.client.post("/media/bulk/return", json=["Eps", {"name":"Zeta"}])
+        self.assertEqual([x["status"] for x in r.get_json()["results"]], ["returned", "error"])
+        r = self.client.post("/media/bulk/delete", json=["Eps", "Zeta", "Nope", 5])
+        self.assertEqual([x["status"] for x in r.get_json()["results"]], ["deleted", "deleted", "error", "error"])
+        self.assertEqual(sorted(x["name"] for x in self.client.get("/media").get_json()), ["Alpha", "Beta", "Gamma"])
+        self.assertEqual(self.client.post("/media/bulk", json={"name":"x"}).status_code, 400)
+
+    def test_export_and_import_ndjson(self):
+        self.client.post("/media/Beta/borrow", json={"borrower":"Madhav"})
+        r = self.client.get("/media/export?format=ndjson")
+        self.assertEqual(r.mimetype, "application/x-ndjson")
+        exported = r.get_data(as_text=True)
+        self.assertEqual([json.loads(l)["name"] for l in exported.splitlines()], ["Alpha", "Beta"])
+        r = self.client.get("/media/export?available=false&category=film")
+        self.assertEqual([json.loads(l)["name"] for l in r.get_data(as_text=True).splitlines()], ["Beta"])
+        self.assertEqual(self.client.get("/media/export?format=csv").status_code, 400)
+
+        _save_all({"Alpha": {"name":"Alpha","publication_date":"1999-01-01","author":"Old","category":"Book"}})
+        body = exported + "not json\n" + json.dumps({"name":"Gamma"}) + "\n"
+        r = self.client.post("/media/import", data=body, content_type="application/x-ndjson")
+        result = r.get_json()
+        self.assertEqual((result["imported"], result["failed"]), (1, 3))
+        self.assertEqual([e["line"] for e in result["errors"]], [1, 3, 4])
+        self.assertEqual(self.client.get("/media/Alpha").get_json()["author"], "Old")
+        self.assertEqual(self.client.get("/media/Beta").get_json()["borrowed_by"], "Madhav")
+        r = self.client.post("/media/import?replace=true", data=exported, content_type="application/x-ndjson")
+        self.assertEqual(r.get_json()["imported"], 2)
+        self.assertEqual(self.client.get("/media/Alpha").get_json()["author"], "A")
+        self.assertEqual(self.client.get("/media/borrowed/list?limit=10").get_json()["total"], 1)
+
+    def test_search_ranks_and_folds(self):
+        for name, author in [("Alpha Centauri","E"), ("The Alpha Code","F"), ("Zeta","Alpha Writer"),
+                             ("Café Société","Woody Allen"), ("सूर्य किताब","G")]:
+            self.client.post("/media", json={"name":name,"publication_date":"2022-02-02","author":author,"category":"Book"})
+        search = lambda q, **kw: [x["name"] for x in self.client.get("/media/search", query_string=dict(q=q, **kw)).get_json()]
+        self.assertEqual(search("alpha"), ["Alpha", "Alpha Centauri", "The Alpha Code", "Zeta"])
+        self.assertEqual(search("ALP", limit=2), ["Alpha", "Alpha Centauri"])
+        self.assertEqual(search("cafe soc"), ["Café Société"])
+        self.assertEqual(search("woody"), ["Café Société"])
+        self.assertEqual(search("कित"), ["सूर्य किताब"])
+        self.client.delete("/media/Zeta")
+        self.assertEqual(search("writer"), [])
+        self.assertEqual(self.client.get("/media/search?q=a&limit=x").status_code, 400)
+
+    def test_search_answers_while_index_builds(self):
+        for name, author in [("Alpha Centauri","E"), ("The Alpha Code","F"), ("Zeta","Alpha Writer"), ("Café","Ålpha")]:
+            self.client.post("/media", json={"name":name,"publication_date":"2022-02-02","author":author,"category":"Book"})
+        items = storage.get_backend().list_all()
+        built = SearchIndex()
+        built.ensure_built(lambda: items)
+        for q in ["alpha", "ALP", "the al", "alpha wri", "caf", "zz"]:
+            self.assertEqual([m["name"] for m in scan(items, q, 3)], built.search(q, 3))
+        with patch.object(SearchIndex, "keep_built"):  # never built: every search scans
+            r = self.client.get("/media/search?q=alpha&limit=2")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Alpha", "Alpha Centauri"])
+        index, release = SearchIndex(), threading.Event()
+        index.keep_built(lambda: release.wait() and index.ensure_built(lambda: items))
+        self.assertFalse(index.built)
+        for _ in range(2):  # built in the background, and again after a reset
+            release.set()
+            for _ in range(500):
+                if index.built:
+                    break
+                time.sleep(0.01)
+            self.assertEqual(index.search("alpha", 1), ["Alpha"])
+            index.on_change("reset", None, None)
+
+    @unittest.skipIf(config.STORAGE_BACKEND == "sqlite", "JSON backend only")
+    def test_cache_picks_up_external_write(self):
+        self.assertEqual(self.client.get("/media/Alpha").status_code, 200)
+        # another process rewrites the file behind our back
+        with open(storage.get_backend().path, "w", encoding="utf-8") as f:
+            json.dump({"Delta": {"name":"Delta","publication_date":"2023-03-03","author":"D","category":"Book"}}, f)
+        self.assertEqual(self.client.get("/media/Alpha").status_code, 404)
+        self.assertEqual(self.client.get("/media/Delta").status_code, 200)
+
+class JournalTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmp.name, "store.json")
+        self.backend = JsonBackend(self.path, fsync=False)
+        self.backend.replace_all({"Alpha": {"name":"Alpha","publication_date":"2020-01-01","author":"A","category":"Book","available":True}})
+
+    def tearDown(self):
+        self.backend.close()
+        self.tmp.cleanup()
+
+    def reopen(self, **options):
+        self.backend.close()
+        self.backend = JsonBackend(self.path, fsync=False, **options)
+        return self.backend
+
+    def test_borrowed_in_category_pages_and_totals(self):
+        backend = self.backend
+        for i in range(10):
+            backend.create({"name":f"F{i}","publication_date":f"20{i:02d}-01-01","author":f"A{9 - i}",
+                            "category":"Film" if i % 2 else "film"})
+        for name in ["F1", "F2", "F5", "F8", "Alpha"]:
+            backend.borrow(name, "X", "2025-01-01 10:00:00")
+        backend.batch([("return", "F8")])
+        for _ in range(2):  # as writes keep the indexes, then as read from a binary snapshot
+            items, total = backend.page(None, 2, category="FILM", borrowed=True)
+            self.assertEqual(([m["name"] for m in items], total), (["F1", "F2"], 3))
+            items, total = backend.page("F2", 2, category="FILM", borrowed=True)
+            self.assertEqual(([m["name"] for m in items], total), (["F5"], 3))
+            for sort in ("author", "publication_date"):
+                items, total = backend.page(None, 5, category="film", borrowed=True, sort=sort)
+                self.assertEqual(total, 3)
+                self.assertEqual([m["name"] for m in items], ["F5", "F2", "F1"] if sort == "author" else ["F1", "F2", "F5"])
+            backend.batch([("delete", "F5")])
+            self.assertEqual(backend.page(None, 5, category="film", borrowed=True)[1], 2)
+            backend.batch([("put", {"name":"F5","publication_date":"2005-01-01","author":"A4","category":"Film",
+                                    "available":False,"borrowed_by":"X","borrow_date":"2025-01-01 10:00:00"})])
+            backend.compact()
+            backend = self.reopen(snapshot_format="binary")  # the indexes as read back from a snapshot
+            backend.compact()
+            backend = self.reopen()
+
+    def test_mutations_replayed_from_journal(self):
+        self.backend.create({"name":"Beta","publication_date":"2021-05-03","author":"B","category":"Film","available":True})
+        self.backend.borrow("Alpha", "Madhav", "2025-01-01 10:00:00")
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(list(json.load(f)), ["Alpha"])  # snapshot not rewritten
+        backend = self.reopen()
+        self.assertEqual(backend.get("Alpha")["borrowed_by"], "Madhav")
+        self.assertIsNotNone(backend.get("Beta"))
+
+    def test_journal_kept_when_snapshot_touched_and_set_aside_when_replaced(self):
+        self.backend.create({"name":"Beta","publication_date":"2021-05-03","author":"B","category":"Film"})
+        self.backend.borrow("Alpha", "Madhav", "2025-01-01 10:00:00")
+        os.utime(self.path, ns=(1, 1))  # touched, copied back, restored as it was: same content
+        backend = self.reopen()
+        self.assertEqual(backend.get("Alpha")["borrowed_by"], "Madhav")
+        self.assertIsNotNone(backend.get("Beta"))
+        with open(self.path, "w", encoding="utf-8") as f:
+            json.dump({"Old": {"name":"Old","publication_date":"2019","author":"O","category":"Book"}}, f)
+        with self.assertLogs("backends.json_backend", "ERROR"):
+            self.assertEqual([m["name"] for m in self.reopen().list_all()], ["Old"])
+        orphans = [f for f in os.listdir(self.tmp.name) if f.startswith("store.json.journal.orphan-")]
+        self.assertEqual(len(orphans), 1)
+        with open(os.path.join(self.tmp.name, orphans[0]), encoding="utf-8") as f:
+            self.assertIn("Madhav", f.read())  # the writes are still there
+
+    def test_ids_survive_reopen(self):
+        alpha = self.backend.get("Alpha")["id"]
+        self.backend.create({"name":"Beta","publication_date":"2021-05-03","author":"B","category":"Film"})
+        beta = self.backend.get("Beta")["id"]
+        self.backend.delete("Beta")
+        backend = self.reopen()
+        self.assertEqual(backend.get_by_id(alpha)["name"], "Alpha")
+        backend.create({"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Book"})
+        self.assertGreater(backend.get("Gamma")["id"], beta)
+        backend.compact()
+        self.assertEqual(self.reopen().get("Gamma")["id"], backend.get("Gamma")["id"])
+
+    def test_processes_share_the_store(self):
+        other = JsonBackend(self.path, fsync=False)  # as another worker process would open it
+        heard = []
+        other.subscribe(lambda op, name, item, version: heard.append((op, name)))
+        self.assertEqual(other.get("Alpha")["name"], "Alpha")
+        plan, raced = other._plan, []
+        def racing_plan(ops, data):
+            if not raced:  # this process borrows while the other is checking its ops
+                raced.append(self.backend.borrow("Alpha", "X", "2025-01-01 10:00:00"))
+            return plan(ops, data)
+        with patch.object(other, "_plan", racing_plan):
+            self.assertFalse(other.borrow("Alpha", "Y", "2025-01-01 10:00:01"))  # checked again, and lost
+        other.close()
+        self.assertIn(("put", "Alpha"), heard)  # the other process's write reached its listeners
+        self.assertEqual(self.reopen().get("Alpha")["borrowed_by"], "X")
+
+    def test_other_process_follows_compaction_without_reset(self):
+        for snapshot_format in ("json", "binary"):
+            backend = self.reopen(compact_every=3, snapshot_format=snapshot_format)
+            backend.compact()
+            other = JsonBackend(self.path, fsync=False)
+            other.get("Alpha")
+            heard = []
+            other.subscribe(lambda op, name, item, version: heard.append((op, version)))
+            item = lambda n: {"name":n,"publication_date":"2024-01-01","author":"A","category":"Book"}
+            start = backend.version().version
+            for i in range(4):  # compacted after the third, which the other never saw journaled
+                backend.create(item(f"{snapshot_format}{i}"))
+            self.assertEqual(other.load_all(), backend.load_all())
+            self.assertEqual(heard, [("put", v) for v in range(start + 1, start + 5)])
+            for i in range(4, 10):  # two compactions while the other wasn't looking: it reloads
+                backend.create(item(f"{snapshot_format}{i}"))
+            self.assertEqual(other.load_all(), backend.load_all())
+            self.assertIn("reset", [op for op, _ in heard[4:]])
+            other.close()
+
+    def test_batch_is_one_journal_write(self):
+        with open(self.backend.journal.path, "rb") as f:
+            before = len(f.read().splitlines())
+        ops = [("create", {"name":f"N{i}","publication_date":"2024-01-01","author":"A","category":"Book"}) for i in range(3)]
+        self.assertEqual(self.backend.batch(ops + [("borrow", "N1", "X", "2025-01-01 10:00:00"), ("delete", "N9")]),
+                         [True, True, True, True, False])
+        with open(self.backend.journal.path, "rb") as f:
+            self.assertEqual(len(f.read().splitlines()), before + 4)
+        self.assertEqual(self.reopen().get("N1")["borrowed_by"], "X")
+
+    def test_group_commit_shares_fsyncs(self):
+        self.backend.close()
+        self.backend = backend = JsonBackend(self.path)  # fsync on
+        names = [f"N{i}" for i in range(40)]
+        backend.batch([("create", {"name":n,"publication_date":"2024-01-01","author":"A","category":"Book"}) for n in names])
+        fsyncs = []
+        def slow_fsync(fd):
+            fsyncs.append(fd)
+            time.sleep(0.005)  # a disk's worth of latency, for the others to queue up behind
+        with patch("backends.journal.os.fsync", slow_fsync):
+            threads = [threading.Thread(target=backend.borrow, args=(n, "X", "2025-01-01 10:00:00")) for n in names]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        self.assertLess(len(fsyncs), len(names) // 2)
+        self.assertEqual(len(self.reopen().list_borrowed()), len(names))  # all of them made it to disk
+
+    def test_torn_append_is_dropped_not_fatal(self):
+        self.backend.delete("Alpha")
+        with open(self.backend.journal.path, "ab") as f:
+            f.write(b'{"op":"put","item":{"name":"Ha')  # crash mid-append
+        backend = self.reopen()
+        self.assertEqual(backend.list_all(), [])
+        self.assertTrue(backend.create({"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Book"}))
+        self.assertEqual([m["name"] for m in self.reopen().list_all()], ["Gamma"])
+
+    def test_compaction_folds_journal_into_snapshot(self):
+        backend = self.reopen(compact_every=2)
+        backend.borrow("Alpha", "Madhav", "2025-01-01 10:00:00")
+        backend.give_back("Alpha")
+        with open(self.path, encoding="utf-8") as f:
+            self.assertIs(json.load(f)["Alpha"]["available"], True)
+        with open(backend.journal.path, encoding="utf-8") as f:
+            self.assertEqual(len(f.readlines()), 1)  # just the base record
+        self.assertIs(self.reopen().get("Alpha")["available"], True)
+
+    def test_binary_snapshot_round_trip(self):
+        self.backend.batch([
+            ("create", {"name":"Beta","publication_date":"2021-05-03","author":"B","category":"book","isbn":"42"}),
+            ("create", {"name":"Gamma","publication_date":"2022-02-02","author":None,"category":None}),
+            ("borrow", "Alpha", "Madhav", "2025-01-01 10:00:00"),
+        ])
+        before = self.backend.load_all()
+        self.reopen(snapshot_format="binary").compact()
+        with open(self.path, "rb") as f:
+            self.assertEqual(f.read(8), b"PKSNAP1\n")
+        backend = self.reopen()  # the format is read from the file
+        self.assertEqual(backend.load_all(), before)
+        self.assertEqual(backend.category_counts(), {"Book": 2, None: 1})
+        self.assertEqual([m["name"] for m in backend.list_borrowed()], ["Alpha"])
+        self.assertEqual(backend.get_by_id(before["Beta"]["id"])["isbn"], "42")
+        backend.give_back("Alpha")
+        backend.update("Beta", {"name": "Delta"})
+        backend.delete("Gamma")
+        after = backend.load_all()
+        self.assertEqual(self.reopen().load_all(), after)  # journal replayed over the binary snapshot
+        self.backend.compact()  # still binary
+        self.assertEqual(self.reopen().load_all(), after)
+        self.reopen(snapshot_format="json").compact()
+        with open(self.path, encoding="utf-8") as f:
+            self.assertEqual(set(json.load(f)), {"Alpha", "Delta"})
+        self.assertEqual(self.reopen().load_all(), after)
+
+class ConcurrencyStressTests(unittest.TestCase):
+    THREADS = 16
+    ROUNDS = 120
+    ITEMS = 8
+
+    def run_stress(self, backend, reopen):
+        previous = storage.set_backend(backend)
+        try:
+            names = [f"Item {i}" for i in range(self.ITEMS)]
+            _save_all({n: {"name":n,"publication_date":"2020-01-01","author":"A","category":"Book","available":True}
+                       for n in names})
+            holders = {}
+            guard = threading.Lock()
+            errors, counts = [], {"borrowed": 0, "returned": 0, "created": 0}
+
+            def worker(tid):
+                client = app.test_client()
+                me = f"reader-{tid}"
+                for i in range(self.ROUNDS):
+                    name = names[(tid + i) % self.ITEMS]
+                    if client.post(f"/media/{name}/borrow", json={"borrower": me}).status_code == 200:
+                        with guard:
+                            if holders.get(name):
+                                errors.append(f"{name} lent to {holders[name]} and {me}")
+                            holders[name] = me
+                            counts["borrowed"] += 1
+                        with guard:
+                            holders[name] = None  # released before the return request goes out
+                        if client.post(f"/media/{name}/return").status_code != 200:
+                            errors.append(f"{me} could not return {name}")
+                        else:
+                            with guard:
+                                counts["returned"] += 1
+                    if i % 4 == 0:
+                        new = {"name":f"New {tid}-{i}","publication_date":"2024-01-01","author":me,"category":"Film"}
+                        if client.post("/media", json=new).status_code == 201:
+                            with guard:
+                                counts["created"] += 1
+
+            threads = [threading.Thread(target=worker, args=(t,)) for t in range(self.THREADS)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+
+            self.assertEqual(errors, [])
+            self.assertGreater(counts["borrowed"], 0)
+            self.assertEqual(counts["borrowed"], counts["returned"])
+            self.assertEqual(counts["created"], self.THREADS * len(range(0, self.ROUNDS, 4)))
+            expected = self.ITEMS + counts["created"]
+            self.assertEqual(len(storage.list_all()), expected)
+            self.assertEqual(storage.get_borrowed_items(), [])
+            # everything made it to disk, not just into memory
+            fresh = reopen()
+            self.assertEqual(len(fresh.load_all()), expected)
+            fresh.close()
+        finally:
+            storage.set_backend(previous)
+            backend.close()
+
+    def test_json_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "store.json")
+            self.run_stress(JsonBackend(path, fsync=False), lambda: JsonBackend(path))
+
+    def test_sqlite_backend(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "media.db")
+            self.run_stress(SqliteBackend(path), lambda: SqliteBackend(path))
+
+class SqliteBackendTests(unittest.TestCase):
+    def setUp(self):
+        self.tmp = tempfile.TemporaryDirectory()
+        self.backend = SqliteBackend(os.path.join(self.tmp.name, "media.db"))
+        self.previous = storage.set_backend(self.backend)
+        self.client = app.test_client()
+        _save_all({
+            "Alpha": {"name":"Alpha","publication_date":"2020-01-01","author":"A","category":"Book"},
+            "Beta": {"name":"Beta","publication_date":"2021-05-03","author":"B","category":"Film","isbn":"123"}
+        })
+
+    def tearDown(self):
+        storage.set_backend(self.previous)
+        self.backend.close()
+        self.tmp.cleanup()
+
+    def test_category_and_borrowed_lists(self):
+        r = self.client.get("/media/category/film")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Beta"])
+        self.assertEqual(r.get_json()[0]["isbn"], "123")
+        r = self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        self.assertEqual(r.status_code, 200)
+        r = self.client.post("/media/Alpha/borrow", json={"borrower":"Other"})
+        self.assertEqual(r.status_code, 400)
+        borrowed = self.client.get("/media/borrowed/list").get_json()
+        self.assertEqual([(x["name"], x["borrowed_by"]) for x in borrowed], [("Alpha", "Madhav")])
+        self.assertEqual(self.client.post("/media/Alpha/return").status_code, 200)
+        self.assertEqual(self.client.get("/media/borrowed/list").get_json(), [])
+
+    def test_paging_totals_follow_mutations(self):
+        self.client.post("/media", json={"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"film"})
+        self.client.post("/media/Beta/borrow", json={"borrower":"Madhav"})
+        self.assertEqual(self.client.get("/media?limit=1").get_json()["total"], 3)
+        page = self.client.get("/media/category/Film?limit=1").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["total"]), (["Beta"], 2))
+        page = self.client.get(f"/media/category/Film?limit=1&cursor={page['next_cursor']}").get_json()
+        self.assertEqual([x["name"] for x in page["items"]], ["Gamma"])
+        self.assertEqual(self.client.get("/media/borrowed/list?limit=10").get_json()["total"], 1)
+        self.client.delete("/media/Beta")
+        self.assertEqual(self.client.get("/media/borrowed/list?limit=10").get_json()["total"], 0)
+        self.assertEqual(self.client.get("/media/category/film?limit=10").get_json()["total"], 1)
+
+    def test_sorted_listing_by_date(self):
+        self.client.post("/media", json={"name":"Gamma","publication_date":"2020-06","author":"C","category":"book"})
+        r = self.client.get("/media/category/book?published_from=2020&published_to=2020&sort=-publication_date")
+        self.assertEqual([x["name"] for x in r.get_json()], ["Gamma", "Alpha"])
+        page = self.client.get("/media?sort=publication_date&limit=2").get_json()
+        self.assertEqual(([x["name"] for x in page["items"]], page["total"]), (["Alpha", "Gamma"], 3))
+        page = self.client.get(f"/media?sort=publication_date&limit=2&cursor={page['next_cursor']}").get_json()
+        self.assertEqual([x["name"] for x in page["items"]], ["Beta"])
+
+    def test_rename_keeps_id(self):
+        beta = self.backend.get("Beta")["id"]
+        self.assertTrue(self.backend.update("Beta", {"name":"Beta 2"}))
+        self.assertEqual(self.backend.get_by_id(beta)["name"], "Beta 2")
+        self.assertEqual(self.backend.get_by_id(beta)["isbn"], "123")
+        self.assertFalse(self.backend.update("Beta 2", {"name":"Alpha"}))
+        self.assertEqual(self.client.get("/media/category/film?limit=5").get_json()["total"], 1)
+
+    def test_listeners_follow_other_process(self):
+        other = SqliteBackend(self.backend.path)
+        heard = []
+        self.backend.subscribe(lambda op, name, item, version: heard.append((op, name, version)))
+        other.borrow("Alpha", "Madhav", "2025-01-01 10:00:00")
+        other.update("Beta", {"name":"Beta 2"})
+        other.close()
+        v = self.backend.version().version  # notices the writes and replays them
+        self.assertEqual(heard, [("put", "Alpha", v - 2), ("del", "Beta", v - 1), ("put", "Beta 2", v)])
+        self.assertEqual(self.client.get("/media/search?q=beta").get_json()[0]["name"], "Beta 2")
+
+    def test_unpaged_listings_in_name_order_on_both_engines(self):
+        json_backend = JsonBackend(os.path.join(self.tmp.name, "store.json"), fsync=False)
+        json_backend.replace_all(self.backend.load_all())
+        for backend in (self.backend, json_backend):
+            for name in ["Zeta", "Delta", "Eta"]:  # not in name order, nor after the setUp items
+                backend.create({"name":name,"publication_date":"2022-01-01","author":"Z","category":"Film"})
+                backend.borrow(name, "Madhav", "2025-01-01 10:00:00")
+            backend.borrow("Beta", "Madhav", "2025-01-01 10:00:00")
+            names = lambda items: [m["name"] for m in items]
+            self.assertEqual(names(backend.list_all()), ["Alpha", "Beta", "Delta", "Eta", "Zeta"])
+            self.assertEqual(names(backend.list_by_category("film")), ["Beta", "Delta", "Eta", "Zeta"])
+            self.assertEqual(names(backend.list_borrowed()), ["Beta", "Delta", "Eta", "Zeta"])
+        json_backend.close()
+
+    def test_sync_without_news_skips_the_write_lock(self):
+        self.backend.sync()
+        with self.backend._write_lock:  # a long write in progress
+            reader = threading.Thread(target=self.backend.sync, daemon=True)
+            reader.start()
+            reader.join(2)
+            self.assertFalse(reader.is_alive())
+
+    def test_loan_ledger(self):
+        with patch("config.LOAN_DAYS", -1):  # due yesterday
+            self.client.post("/media/Alpha/borrow", json={"borrower":"Madhav"})
+        beta = self.backend.get("Beta")["id"]
+        self.client.post(f"/media/id/{beta}/borrow", json={"borrower":"Madhav"})
+        overdue = self.client.get("/loans/overdue").get_json()
+        self.assertEqual([(l["name"], l["borrower"]) for l in overdue], [("Alpha", "Madhav")])
+        self.assertIsInstance(overdue[0]["due_at"], int)
+        self.client.post("/media/Alpha/return")
+        self.assertEqual(self.client.get("/loans/overdue").get_json(), [])
+        loans = self.client.get("/borrowers/Madhav/loans").get_json()
+        self.assertEqual([(l["name"], l["returned_at"] is None) for l in loans], [("Beta", True), ("Alpha", False)])
+        self.client.delete("/media/Beta")  # while out: the loan is closed
+        self.assertEqual(self.client.get("/borrowers/Madhav/loans?open=1").get_json(), [])
+        reopened = LoanLedger(self.backend.path + ".loans")
+        self.assertEqual(len(reopened.for_borrower("Madhav")), 2)
+        reopened.close()
+
+    def test_migrate_from_json(self):
+        path = os.path.join(self.tmp.name, "store.json")
+        with open(path, "w", encoding="utf-8") as f:
+            json.dump({"Gamma": {"name":"Gamma","publication_date":"2022-02-02","author":"C","category":"Magazine",
+                                 "available": False, "borrowed_by": "X", "borrow_date": "2024-01-01 10:00:00"}}, f)
+        source = JsonBackend(path)
+        ledger = LoanLedger(path + ".loans")
+        ledger.lend([(source.get("Gamma"), "X")], 1704103200, -1)
+        ledger.close()
+        self.assertEqual(migrate(source, self.backend), 1)
+        item = self.client.get("/media/Gamma").get_json()
+        self.assertFalse(item["available"])
+        self.assertEqual(item["borrowed_by"], "X")
+        # the loan came along, still tied to the item by its id
+        self.assertEqual([(l["item_id"], l["borrower"]) for l in self.client.get("/loans/overdue").get_json()],
+                         [(item["id"], "X")])
+        self.assertEqual(self.client.get("/media/Alpha").status_code, 404)
+
 if __name__=="__main__":
     unittest.main()
@@ -1,3 +1,5 @@
+import queue
+import threading
 import unittest
 from unittest.mock import patch, MagicMock
 import gui
@@ -11,15 +13,159 @@ class FrontendTests(unittest.TestCase):
         self.app = gui.LibraryGUI(self.root)
 
     def tearDown(self):
+        self.app.runner.close()
         self.root.destroy()
 
-    @patch("gui.requests.get")
+    @patch("gui.requests.Session.get")
     def test_load_all_populates(self, mock_get):
         mock_get.return_value = MagicMock(status_code=200, json=lambda: [{"name":"X","author":"A","publication_date":"2020","category":"Book"}])
         self.app.load_all()
+        self.app.runner.wait()
         self.assertEqual(self.app.listbox.size(), 1)
 
-    @patch("gui.requests.get")
+    @patch("gui.PAGE_CACHE", 5)
+    @patch("gui.PAGE_SIZE", 2)
+    @patch("gui.requests.Session.get")
+    def test_load_all_fetches_pages_on_demand(self, mock_get):
+        names = [f"Item {i:03d}" for i in range(100)]
+        def server(url, params, headers, timeout):
+            items = [{"name":n,"author":"A","publication_date":"2020","category":"Book"}
+                     for n in names[params["offset"]:params["offset"] + params["limit"]]]
+            return MagicMock(status_code=200, json=lambda: {"items":items, "total":len(names), "next_cursor":None})
+        mock_get.side_effect = server
+        self.app.visible = 3
+        self.app.load_all()
+        self.app.runner.wait()
+        self.app.runner.wait()  # pages for the overscan rows
+        self.assertEqual(self.app.listbox.size(), 3 + gui.OVERSCAN)  # only the window is rendered
+        self.app.scroll_to(90)
+        self.app.runner.wait()
+        self.assertIn("Item 090", self.app.listbox.get(0))
+        offsets = sorted(c.kwargs["params"]["offset"] for c in mock_get.call_args_list)
+        self.assertEqual(offsets, [0, 2, 4, 6, 90, 92, 94, 96])  # no walking through the pages between
+        self.assertLessEqual(len(self.app.page_cache), 5)
+
+    @patch("gui.requests.Session.get")
+    def test_load_all_reuses_listing_on_304(self, mock_get):
+        page = {"items":[{"name":"X","author":"A","publication_date":"2020","category":"Book"}], "total":1, "next_cursor":None}
+        mock_get.side_effect = [MagicMock(status_code=200, json=lambda: page, headers={"ETag": 'W/"ab-1"'}),
+                                MagicMock(status_code=304)]
+        self.app.load_all()
+        self.app.runner.wait()
+        self.app.load_all()
+        self.app.runner.wait()
+        self.assertEqual(self.app.listbox.size(), 1)
+        self.assertEqual(mock_get.call_args.kwargs["headers"], {"If-None-Match": 'W/"ab-1"'})
+
+    @patch("gui.requests.Session.get")
+    def test_refresh_applies_delta(self, mock_get):
+        page = {"items":[{"name":"X","author":"A","publication_date":"2020","category":"Book"},
+                         {"name":"Y","author":"B","publication_date":"2021","category":"Film"}], "total":2, "next_cursor":None}
+        delta = {"version":"ab-3", "upserts":[{"name":"X","author":"A","publication_date":"2020","category":"Book",
+                                               "available":False,"borrowed_by":"Q"}], "deletes":["Y"]}
+        mock_get.side_effect = [MagicMock(status_code=200, json=lambda: page, headers={"ETag": 'W/"ab-1"'}),
+                                MagicMock(status_code=200, json=lambda: delta)]
+        self.app.load_all()
+        self.app.runner.wait()
+        self.app.refresh()
+        self.app.runner.wait()
+        self.assertEqual(mock_get.call_args.kwargs["params"], {"since": "ab-1"})
+        self.assertEqual(self.app.listbox.size(), 1)
+        self.assertIn("Borrowed by Q", self.app.listbox.get(0))
+        self.assertEqual(self.app.sync_version, "ab-3")
+
+    def test_live_event_updates_row(self):
+        self.app.view = "all"
+        self.app.populate_list([{"name":"X","author":"A","publication_date":"2020","category":"Book"}])
+        lines = ["id: ab-2", "event: change",
+                 'data: {"upserts": [{"name":"X","author":"A","publication_date":"2020","category":"Book","available":false,"borrowed_by":"Q"}], "deletes": []}',
+                 "", ": keepalive", ""]
+        self.app._events = queue.Queue()
+        for event in gui.iter_sse(lines):
+            self.app._events.put(event)
+        self.app._drain_events()
+        self.assertIn("Borrowed by Q", self.app.listbox.get(0))
+        self.assertEqual(self.app.sync_version, "ab-2")
+
+    @patch("gui.messagebox.showinfo")
+    @patch("gui.requests.Session.get")
+    def test_selection_resolves_to_record(self, mock_get, mock_info):
+        name = "2001: A Space Odyssey (Director's Cut)  "  # digits first, longer than the column
+        self.app.populate_list([{"name":"Other","author":"A","publication_date":"2020","category":"Book"},
+                                {"name":name,"author":"Clarke","publication_date":"1968","category":"Film"}])
+        self.app.listbox.selection_set(1)
+        self.assertEqual(self.app.get_selected_name(), name)
+        self.app.show_metadata()
+        mock_get.assert_not_called()  # details come from the row's record
+        self.assertIn("Clarke", mock_info.call_args.args[1])
+
+    @patch("gui.messagebox.showinfo")
+    @patch("gui.simpledialog.askstring", return_value="Madhav")
+    @patch("gui.requests.Session.post")
+    def test_borrow_addresses_item_by_id(self, mock_post, mock_ask, mock_info):
+        mock_post.return_value = MagicMock(status_code=200)
+        self.app.populate_list([{"id":7,"name":"AC/DC: Live","author":"A","publication_date":"2020","category":"Film"}])
+        self.app.listbox.selection_set(0)
+        with patch.object(self.app, "refresh"):
+            self.app.borrow_item()
+            self.app.runner.wait()
+        self.assertEqual(mock_post.call_args.args[0], f"{gui.API_BASE}/media/id/7/borrow")
+
+    @patch("gui.requests.Session.get")
+    def test_typeahead_filters_loaded_catalog(self, mock_get):
+        items = [{"name":"The Silent Sea","author":"Ana Ruiz","publication_date":"2020","category":"Book"},
+                 {"name":"Sea Stories","author":"B","publication_date":"2021","category":"Film"},
+                 {"name":"Other","author":"Silvia","publication_date":"2022","category":"Book"}]
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: items)
+        self.app.load_all()
+        self.app.runner.wait()
+        self.app.search_var.set("sil")
+        self.app._run_typeahead()  # what the debounce timer calls
+        self.assertEqual([self.app.source.item(i)["name"] for i in range(self.app.source.count)],
+                         ["The Silent Sea", "Other"])  # title match before author match
+        self.app.category_var.set("book")
+        self.app.load_category()
+        self.assertEqual(self.app.source.count, 2)
+        self.assertEqual(mock_get.call_count, 1)  # only the listing itself
+
+    @patch("gui.requests.Session.get")
+    def test_typeahead_asks_server_while_paging(self, mock_get):
+        page = {"items":[{"name":"A","author":"A","publication_date":"2020","category":"Book"}], "total":900, "next_cursor":"QQ"}
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: page)
+        self.app.load_all()
+        self.app.runner.wait()
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: [])
+        self.app.search_var.set("zzz")
+        self.app._run_typeahead()
+        self.app.runner.wait()
+        self.assertEqual(mock_get.call_args.kwargs["params"]["q"], "zzz")
+
+    def test_runner_cancels_and_coalesces(self):
+        release, calls, results = threading.Event(), [], []
+        def slow(tag):
+            def fn(session, call):
+                calls.append(tag)
+                release.wait(2)
+                return tag
+            return fn
+        runner = self.app.runner
+        runner.submit("view", slow("old"), results.append)
+        runner.submit("view", slow("new"), results.append)  # supersedes "old"
+        runner.submit("refresh", slow("r1"), results.append, coalesce=True)
+        runner.submit("refresh", slow("r2"), results.append, coalesce=True)  # joins "r1"
+        release.set()
+        runner.wait()
+        self.assertNotIn("r2", calls)
+        self.assertEqual(sorted(results), ["new", "r1", "r1"])
+
+    @patch("gui.requests.Session.get")
+    def test_load_categories_fills_combobox(self, mock_get):
+        mock_get.return_value = MagicMock(status_code=200, json=lambda: [{"category":"Book","count":3}, {"category":"Comic","count":1}])
+        self.app.load_categories()
+        self.app.runner.wait()
+        self.assertEqual(list(self.app.category_combo.cget("values")), ["Book", "Comic"])
+
+    @patch("gui.requests.Session.get")
     def test_search_not_found(self, mock_get):
         m = MagicMock()
         m.status_code = 404
@@ -28,6 +174,7 @@ class FrontendTests(unittest.TestCase):
         self.app.search_var.set("DoesNotExist")
         # should not raise
         self.app.search_name()
+        self.app.runner.wait()
 
 if __name__=="__main__":
     unittest.main()
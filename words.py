@@ -0,0 +1,56 @@
+"""Folding text into search words, shared by the server's index and the GUI.
+
+Only the standard library: the GUI imports this without the server's code.
+"""
+import functools
+import re
+import unicodedata
+from typing import Any, List, Pattern
+
+_ASCII_TOKEN = re.compile(r"[a-z0-9]+")
+# accents that fold away: the combining diacritics used by Latin, Greek and
+# Cyrillic. Indic vowel signs and viramas are combining marks too, but they
+# are part of the word, so they are kept.
+_DIACRITICS = re.compile("[\u0300-\u036f\u1ab0-\u1aff\u1dc0-\u1dff\u20d0-\u20ff\ufe20-\ufe2f]")
+
+
+def _mark_ranges() -> str:
+    """Regex class body covering the combining marks of the BMP."""
+    ranges, start = [], None
+    for cp in range(0x10000):
+        is_mark = unicodedata.category(chr(cp))[0] == "M"
+        if is_mark and start is None:
+            start = cp
+        elif not is_mark and start is not None:
+            ranges.append(f"\\u{start:04x}-\\u{cp - 1:04x}")
+            start = None
+    return "".join(ranges)
+
+
+@functools.lru_cache(maxsize=None)
+def _word() -> Pattern[str]:
+    """A word: a run of letters, digits and combining marks (which keeps Indic
+    vowel signs inside the word); underscore is a separator. Compiled on the
+    first non-ASCII text, as finding the marks takes a walk over the BMP."""
+    return re.compile(f"(?:[^\\W_]|[{_mark_ranges()}])+")
+
+
+def fold(text: str) -> str:
+    """Case- and accent-fold ``text`` ("Señor" -> "senor")."""
+    if text.isascii():
+        return text.lower()
+    return _DIACRITICS.sub("", unicodedata.normalize("NFKD", text)).casefold()
+
+
+def tokenize(text: Any) -> List[str]:
+    """Folded words of ``text``; a word is a run of letters, digits and marks."""
+    if not isinstance(text, str):
+        return []
+    return split(fold(text))
+
+
+def split(text: str) -> List[str]:
+    """The words of already folded ``text``."""
+    if text.isascii():
+        return _ASCII_TOKEN.findall(text)
+    return _word().findall(text)